@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import asyncio
+from harness import Case, run
+
+from utils.db import DB
+from utils.outline import AccessKey, DataLimit
+
+class StaticOutline:
+  def __init__(self, access_keys: list[AccessKey]) -> None:
+    self.access_keys = access_keys
+
+  async def get_access_keys(self) -> list[AccessKey]:
+    return self.access_keys
+
+  async def get_transfer_metrics(self) -> dict[str, int]:
+    return {x.id: int(x.id) * 7_654_321 for x in self.access_keys}
+
+def create_outline_keys(count: int) -> list[AccessKey]:
+  access_keys = []
+  for i in range(count):
+    port = (443, 8443, 80)[i % 3]
+    access_keys.append(AccessKey(
+      id=str(i), name=f"Key #{i}", password="password", port=port, method="chacha20-ietf-poly1305",
+      access_url=f"ss://Y2hhY2hhMjAtaWV0Zi1wb2x5MTMwNTpwYXNzd29yZA@127.0.0.1:{port}/?outline=1#{i}",
+      data_limit=DataLimit(50 * 10**9) if i % 2 else None,
+    ))
+  return access_keys
+
+def create_vpn(count: int):
+  from utils.vpn import VPNManager
+
+  db = DB(":memory:")
+  owner = db.users.create(1, "user")
+  access_keys = create_outline_keys(count)
+  with db.transaction():
+    for access_key in access_keys:
+      db.access_keys.create(owner, access_key.id)
+
+  tunnel_url = "ssconf://tunnel.example.com/"
+  return VPNManager(
+    db, StaticOutline(access_keys),
+    access_url_provider=lambda x: f"{tunnel_url}{x.owner.nickname}/{x.id}" if x.owner else x.access_url,
+  )
+
+def create_get_access_keys(count: int):
+  vpn = create_vpn(count)
+  return lambda: asyncio.run(vpn.get_access_keys())
+
+def create_prefix_access_urls(count: int, cached: bool):
+  from utils.vpn import DEFAULT_PREFIX_MAP, _get_prefixed_access_url, _prefix_access_url
+
+  access_keys = create_outline_keys(count)
+  prefix_map = {x: tuple(y) for x, y in DEFAULT_PREFIX_MAP.items()}
+  def prefix_access_urls():
+    cached or _prefix_access_url.cache_clear()
+    for access_key in access_keys:
+      _get_prefixed_access_url(access_key, prefix_map)
+
+  prefix_access_urls()
+  return prefix_access_urls
+
+def cases():
+  for count in (100, 1_000, 10_000):
+    yield Case(f"vpn.get_access_keys[{count}]", lambda count=count: create_get_access_keys(count))
+  for cached in (False, True):
+    name = "cached" if cached else "uncached"
+    yield Case(f"vpn.prefix_access_urls[{name},10000]", lambda cached=cached: create_prefix_access_urls(10_000, cached))
+
+if __name__ == "__main__":
+  run(cases())
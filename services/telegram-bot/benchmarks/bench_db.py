@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+from datetime import datetime, timedelta, timezone
+from functools import cache
+from itertools import cycle
+from harness import Case, run
+
+from utils.db import DB, Tag
+
+COUNTS = (1_000, 10_000, 100_000)
+
+@cache
+def create_db(count: int) -> DB:
+  db = DB(":memory:")
+  now = datetime.now(timezone.utc)
+  expired_at = (now - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+  expires_at = (now + timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S")
+  admin = db.tags.get_id(Tag.ADMIN)
+  with db.transaction():
+    db.exec_many(
+      "INSERT INTO users (id, nickname) VALUES (?, ?)",
+      [(i, f"user{i}") for i in range(1, count + 1)]
+    )
+    db.exec_many(
+      "INSERT INTO user_tags (user_id, tag_id) VALUES (?, ?)",
+      [(i, admin) for i in range(1, count + 1, 10)]
+    )
+    db.exec_many(
+      "INSERT INTO access_keys (id, user_id, outline_id, expires_at) VALUES (?, ?, ?, ?)",
+      [
+        (f"key{i}", i, str(i), (expired_at if i % 20 == 0 else expires_at) if i % 2 else None)
+          for i in range(1, count + 1)
+      ]
+    )
+  return db
+
+def create_exists(count: int):
+  db = create_db(count)
+  users = cycle(range(1, count + 1, 7))
+  return lambda: db.user_tags.exists(next(users), Tag.ADMIN)
+
+def cases():
+  for count in COUNTS:
+    yield Case(f"db.user_tags.exists[{count}]", lambda count=count: create_exists(count), number=1_000)
+    yield Case(f"db.users.get_all[{count}]", lambda count=count: create_db(count).users.get_all)
+    yield Case(f"db.access_keys.get_all[{count}]", lambda count=count: create_db(count).access_keys.get_all)
+    yield Case(f"db.access_keys.get_all_expired[{count}]", lambda count=count: create_db(count).access_keys.get_all_expired)
+
+if __name__ == "__main__":
+  run(cases())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+from datetime import datetime, timezone
+from harness import Case, run
+from reference_format import FormatMap as ReferenceFormatMap
+
+from utils.db import User
+from utils.l10n import load_l10n_table
+from utils.units import DataSpan
+from utils.vpn import AccessKey, ServerInfo
+
+def create_users(count: int) -> list[User]:
+  users = []
+  for i in range(count):
+    user = User(id=i + 1, nickname=f"user{i}", joined_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+    user.is_admin = i % 10 == 0
+    user.is_banned = i % 25 == 0
+    users.append(user)
+  return users
+
+def create_server_info(count: int) -> ServerInfo:
+  owners = create_users(max(count // 4, 1))
+  access_keys = [
+    AccessKey(
+      id=f"key{i}", outline_id=str(i), owner=owners[i % len(owners)] if i % 3 else None,
+      name=f"Key #{i}", password="password", port=443, method="chacha20-ietf-poly1305",
+      access_url=f"ss://Y2hhY2hhMjAtaWV0Zi1wb2x5MTMwNTpwYXNzd29yZA@127.0.0.1:443/?outline=1#{i}",
+      data_usage=DataSpan(i * 7_654_321), data_limit=DataSpan(50 * 10**9) if i % 2 else None,
+      expires_at=datetime(2030, 1, 1, tzinfo=timezone.utc) if i % 5 else None,
+    )
+    for i in range(count)
+  ]
+  return ServerInfo(
+    id="server", name="Server", version="1.0.0", hostname="127.0.0.1", port=443,
+    created=datetime(2024, 1, 1), telemetry_enabled=False, data_limit=None, access_keys=access_keys,
+  )
+
+def create_render(key: str, params):
+  template = load_l10n_table()[key]
+  return lambda: template.render(params)
+
+def create_reference_render(key: str, params):
+  template = str(load_l10n_table()[key])
+  return lambda: template.format_map(ReferenceFormatMap(params))
+
+def cases():
+  for count in (100, 1_000, 10_000):
+    yield Case(f"l10n.ALL_USERS_INFO[{count}]", lambda count=count: create_render("ALL_USERS_INFO", {"users": create_users(count)}))
+    yield Case(f"l10n.ALL_USERS_INFO[{count}].reference", lambda count=count: create_reference_render("ALL_USERS_INFO", {"users": create_users(count)}))
+    yield Case(f"l10n.SERVER_INFO[{count}]", lambda count=count: create_render("SERVER_INFO", create_server_info(count)))
+    yield Case(f"l10n.SERVER_INFO[{count}].reference", lambda count=count: create_reference_render("SERVER_INFO", create_server_info(count)))
+
+if __name__ == "__main__":
+  run(cases())
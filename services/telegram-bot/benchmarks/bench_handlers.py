@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import re
+from types import SimpleNamespace
+from harness import Case, run as run_cases
+
+from telegram import Update
+from utils.tg import prepare_handler
+from utils.units import DataSpan, TimeSpan
+
+_VPN_ADD_PATTERN = (
+  r"^/vpn(?:\s*|_)add\s+@?(?P<user>[\w-]+)(?::(?P<id>[\w-]+))?"
+  r"(?:\s+with\s+(?P<data_limit>[-+]?(?:\d*\.\d+|\d+)\s*\S*))?"
+  r"(?:\s+for\s+(?P<time_limit>[-+]?(?:\d*\.\d+|\d+)\s*\S*))?"
+  r"(?:\s+at\s*(?P<port>\d{1,5}))?"
+  r"(?:\s+as\s*(?P<name>.*))?$"
+)
+
+def add_access_key(
+    user: str, name: str = None, port: int = None,
+    data_limit: DataSpan = None, time_limit: TimeSpan = None) -> None:
+  pass
+
+def print_user(user: str, unused: str = None) -> None:
+  pass
+
+def print_telegram_user(update: Update, user_id: int = None) -> None:
+  pass
+
+def run(coroutine) -> None:
+  try:
+    coroutine.send(None)
+  except StopIteration:
+    pass
+
+def create_update(pattern: str | None, handler, text: str):
+  match = re.match(pattern, text) if pattern else None
+  update = SimpleNamespace(message=SimpleNamespace(from_user=SimpleNamespace(id=1)))
+  context = SimpleNamespace(match=match)
+  callback = prepare_handler(handler, pattern=pattern)
+  return lambda: run(callback(update, context))
+
+def cases():
+  handlers = (
+    ("vpn add", _VPN_ADD_PATTERN, add_access_key, "/vpn add alice with 50 GB for 4 weeks at 8443 as Phone"),
+    ("user", r"^/user\s+@?(?P<user>[\w-]+)$", print_user, "/user alice"),
+    ("forwarded", None, print_telegram_user, "hello"),
+  )
+  for name, pattern, handler, text in handlers:
+    yield Case(f"tg.handler[{name}]", lambda x=(pattern, handler, text): create_update(*x), number=10_000)
+
+if __name__ == "__main__":
+  run_cases(cases())
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+from harness import Case, run
+
+from utils.units import BYTE, SECOND, format_unit, parse_unit
+
+def cases():
+  yield Case("units.parse_unit[GB]", lambda: lambda: parse_unit("50 GB", BYTE), number=10_000)
+  yield Case("units.parse_unit[weeks]", lambda: lambda: parse_unit("4 weeks", SECOND), number=10_000)
+  yield Case("units.format_unit[bytes]", lambda: lambda: format_unit(12_345_678_901, BYTE, ".2f"), number=10_000)
+  yield Case("units.format_unit[seconds]", lambda: lambda: format_unit(1_209_600, SECOND), number=10_000)
+
+if __name__ == "__main__":
+  run(cases())
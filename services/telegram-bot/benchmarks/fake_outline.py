@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import asyncio
+import base64
+import json
+import random
+import time
+from argparse import ArgumentParser
+from tornado.web import Application, RequestHandler
+
+_METHOD = "chacha20-ietf-poly1305"
+
+class FakeOutlineServer:
+  def __init__(
+      self, key_count: int = 1_000, *, latency: float = 0.0, jitter: float = 0.0,
+      hostname: str = "127.0.0.1", port: int = 443, traffic: int = 10_000) -> None:
+    self.latency = latency
+    self.jitter = jitter
+    self.hostname = hostname
+    self.port = port
+    self.traffic = traffic
+    self.name = "Fake Outline Server"
+    self.created_at = time.time()
+    self.requests = 0
+    self.access_keys = {}
+    self._random = random.Random(0)
+    self._next_id = key_count
+    self._transferred = {}
+    for i in range(key_count):
+      self._create_access_key(str(i), {"name": f"Key #{i}"})
+
+  def create_app(self, secret: str = "") -> Application:
+    prefix = f"/{secret}" if secret else ""
+    return Application([(prefix + r"(/.*)", _FakeOutlineHandler, dict(server=self))])
+
+  async def delay(self) -> None:
+    latency = self.latency + self._random.uniform(0, self.jitter)
+    if latency > 0:
+      await asyncio.sleep(latency)
+
+  def handle(self, method: str, path: str, body: dict) -> tuple[int, dict | None]:
+    self.requests += 1
+    route = path.strip("/").split("/")
+    id = route[1] if len(route) > 1 and route[0] == "access-keys" else None
+    access_key = id and self.access_keys.get(id)
+
+    if method == "GET" and route == ["server"]:
+      return 200, self._get_server_info()
+    if method == "GET" and route == ["metrics", "enabled"]:
+      return 200, {"metricsEnabled": True}
+    if method == "GET" and route == ["metrics", "transfer"]:
+      return 200, {"bytesTransferredByUserId": self._get_transfer_metrics()}
+    if method == "GET" and route == ["access-keys"]:
+      return 200, {"accessKeys": list(self.access_keys.values())}
+    if method == "POST" and route == ["access-keys"]:
+      self._next_id += 1
+      return 201, self._create_access_key(str(self._next_id), body)
+    if method == "PUT" and len(route) == 2 and id:
+      return (409, None) if access_key else (201, self._create_access_key(id, body))
+    if id and not access_key:
+      return 404, {"code": "NotFound", "message": f"Access key '{id}' not found"}
+    if method == "GET" and len(route) == 2:
+      return 200, access_key
+    if method == "DELETE" and len(route) == 2:
+      del self.access_keys[id]
+      self._transferred.pop(id, None)
+      return 204, None
+    if method == "PUT" and route[2:] == ["name"]:
+      access_key["name"] = body.get("name", "")
+      return 204, None
+    if method == "PUT" and route[2:] == ["data-limit"]:
+      access_key["dataLimit"] = body.get("limit")
+      return 204, None
+    if method == "DELETE" and route[2:] == ["data-limit"]:
+      access_key.pop("dataLimit", None)
+      return 204, None
+    if method == "PUT" and route in (["name"], ["metrics", "enabled"]) or route[:1] == ["server"]:
+      self.name = body.get("name", self.name)
+      return 204, None
+    return 404, {"code": "NotFound", "message": f"'{method} {path}' not found"}
+
+  def _get_server_info(self) -> dict:
+    return {
+      "serverId": "fake", "name": self.name, "version": "1.0.0",
+      "hostnameForAccessKeys": self.hostname, "portForNewAccessKeys": self.port,
+      "createdTimestampMs": int(self.created_at * 1000), "metricsEnabled": True,
+    }
+
+  def _get_transfer_metrics(self) -> dict[str, int]:
+    elapsed = time.time() - self.created_at
+    return {x: y + int(elapsed * self.traffic) for x, y in self._transferred.items()}
+
+  def _create_access_key(self, id: str, body: dict) -> dict:
+    password = body.get("password") or base64.urlsafe_b64encode(self._random.randbytes(16)).decode().rstrip("=")
+    port = body.get("port") or self.port
+    method = body.get("method") or _METHOD
+    user_info = base64.urlsafe_b64encode(f"{method}:{password}".encode()).decode().rstrip("=")
+    access_key = {
+      "id": id, "name": body.get("name") or "", "password": password, "port": port, "method": method,
+      "accessUrl": f"ss://{user_info}@{self.hostname}:{port}/?outline=1",
+    }
+    if body.get("limit"):
+      access_key["dataLimit"] = body["limit"]
+    self.access_keys[id] = access_key
+    self._transferred[id] = self._random.randrange(10**10)
+    return access_key
+
+class _FakeOutlineHandler(RequestHandler):
+  def initialize(self, server: FakeOutlineServer) -> None:
+    self.server = server
+
+  async def _handle(self, path: str) -> None:
+    await self.server.delay()
+    body = json.loads(self.request.body) if self.request.body else {}
+    code, response = self.server.handle(self.request.method, path, body)
+    self.set_status(code)
+    if response is not None:
+      self.set_header("Content-Type", "application/json")
+      self.write(json.dumps(response))
+
+  get = post = put = delete = _handle
+
+
+async def main() -> None:
+  parser = ArgumentParser(description="Serve a stand-in for the Outline Management API.")
+  parser.add_argument("--address", type=str, default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8081)
+  parser.add_argument("--secret", type=str, default="secret")
+  parser.add_argument("--keys", type=int, default=1_000)
+  parser.add_argument("--latency", type=float, default=0.0)
+  parser.add_argument("--jitter", type=float, default=0.0)
+  args = parser.parse_args()
+
+  server = FakeOutlineServer(args.keys, latency=args.latency, jitter=args.jitter)
+  server.create_app(args.secret).listen(args.port, args.address)
+  print(f"http://{args.address}:{args.port}/{args.secret}", flush=True)
+  await asyncio.Event().wait()
+
+if __name__ == "__main__":
+  asyncio.run(main())
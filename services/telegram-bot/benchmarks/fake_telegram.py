@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from typing import Callable
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.web import Application, RequestHandler
+
+_BOT = {"id": 1, "is_bot": True, "first_name": "Telebot", "username": "telebot_load_bot"}
+_RAW_FIELDS = {"text", "secret_token", "url"}
+
+@dataclass
+class SentMessage:
+  chat_id: int
+  text: str
+  sent_at: float
+
+class FakeTelegramServer:
+  def __init__(self, *, on_message: Callable[[SentMessage], None] = None, max_clients: int = 256) -> None:
+    self.on_message = on_message
+    self.webhook_url = ""
+    self.secret_token = ""
+    self.webhook_set = asyncio.Event()
+    self.requests = 0
+    self.messages: list[SentMessage] = []
+    self._message_id = 0
+    self._client = AsyncHTTPClient(force_instance=True, max_clients=max_clients)
+
+  def create_app(self) -> Application:
+    return Application([(r"/bot(?P<token>[^/]+)/(?P<method>\w+)", _FakeTelegramHandler, dict(server=self))])
+
+  def handle(self, method: str, params: dict) -> object:
+    self.requests += 1
+    if method == "getMe":
+      return _BOT
+    if method == "setWebhook":
+      self.webhook_url = params.get("url", "")
+      self.secret_token = params.get("secret_token", "")
+      self.webhook_set.set()
+      return True
+    if method == "deleteWebhook":
+      self.webhook_url = ""
+      self.webhook_set.clear()
+      return True
+    if method == "sendMessage":
+      return self._send_message(params)
+    return True
+
+  async def deliver(self, update: dict) -> int:
+    request = HTTPRequest(
+      self.webhook_url, "POST", body=json.dumps(update),
+      headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": self.secret_token},
+      request_timeout=30,
+    )
+    response = await self._client.fetch(request, raise_error=False)
+    return response.code
+
+  def close(self) -> None:
+    self._client.close()
+
+  def _send_message(self, params: dict) -> dict:
+    message = SentMessage(int(params["chat_id"]), params.get("text", ""), time.perf_counter())
+    self.messages.append(message)
+    self.on_message and self.on_message(message)
+    self._message_id += 1
+    return {
+      "message_id": self._message_id, "date": int(time.time()), "from": _BOT,
+      "chat": {"id": message.chat_id, "type": "private"}, "text": message.text,
+    }
+
+class _FakeTelegramHandler(RequestHandler):
+  def initialize(self, server: FakeTelegramServer) -> None:
+    self.server = server
+
+  def _parse_params(self) -> dict:
+    if self.request.headers.get("Content-Type", "").startswith("application/json"):
+      return json.loads(self.request.body or b"{}")
+
+    params = {}
+    for name, values in self.request.body_arguments.items():
+      value = values[-1].decode()
+      if name not in _RAW_FIELDS:
+        try:
+          value = json.loads(value)
+        except ValueError:
+          pass
+      params[name] = value
+    return params
+
+  def _handle(self, token: str, method: str) -> None:
+    result = self.server.handle(method, self._parse_params())
+    self.set_header("Content-Type", "application/json")
+    self.write(json.dumps({"ok": True, "result": result}))
+
+  get = post = _handle
+
+
+async def main() -> None:
+  parser = ArgumentParser(description="Serve a stand-in for the Telegram Bot API that records sent messages.")
+  parser.add_argument("--address", type=str, default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8082)
+  args = parser.parse_args()
+
+  on_message = lambda x: print(f"{x.chat_id}: {x.text!r}", flush=True)
+  server = FakeTelegramServer(on_message=on_message)
+  server.create_app().listen(args.port, args.address)
+  print(f"http://{args.address}:{args.port}", flush=True)
+  await asyncio.Event().wait()
+
+if __name__ == "__main__":
+  asyncio.run(main())
@@ -0,0 +1,49 @@
+import re
+import statistics
+import sys
+import timeit
+from dataclasses import dataclass
+from os import path
+from typing import Any, Callable, Iterable
+
+SRC_DIR = path.join(path.dirname(path.dirname(path.abspath(__file__))), "src", "telebot")
+sys.path.insert(0, SRC_DIR)
+
+@dataclass
+class Case:
+  name: str
+  setup: Callable[[], Callable[[], Any]]
+  number: int = 1
+  repeat: int = 5
+
+@dataclass
+class Result:
+  name: str
+  min: float
+  median: float
+  number: int
+  repeat: int
+
+
+def measure(case: Case) -> Result:
+  func = case.setup()
+  timings = [x / case.number for x in timeit.repeat(func, number=case.number, repeat=case.repeat)]
+  return Result(case.name, min(timings), statistics.median(timings), case.number, case.repeat)
+
+def format_duration(seconds: float) -> str:
+  for unit, factor in (("s", 1.0), ("ms", 10.0**-3), ("us", 10.0**-6)):
+    if seconds >= factor:
+      return f"{seconds / factor:9.2f} {unit}"
+  return f"{seconds / 10.0**-9:9.2f} ns"
+
+def run(cases: Iterable[Case], pattern: str = None, file=sys.stdout) -> list[Result]:
+  pattern = pattern and re.compile(pattern)
+  results = []
+  for case in cases:
+    if pattern and not pattern.search(case.name):
+      continue
+
+    result = measure(case)
+    results.append(result)
+    print(f"{result.name:<48} {format_duration(result.min)} {format_duration(result.median)}", file=file, flush=True)
+  return results
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import platform
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from itertools import cycle
+from os import path
+from urllib.parse import urlparse
+from harness import SRC_DIR
+from fake_outline import FakeOutlineServer
+from fake_telegram import FakeTelegramServer, SentMessage
+
+from utils.db import DB
+
+_OUTLINE_SECRET = "secret"
+_BOT_TOKEN = "1:load"
+_STARTUP_TIMEOUT = 30
+_SHUTDOWN_TIMEOUT = 10
+
+def _parse_args(args=None):
+  parser = ArgumentParser(prog="load.py", description=(
+    "Push Telegram updates through a running bot backed by fake Outline and Telegram Bot API servers, "
+    "and measure its throughput, latency, and memory usage."
+  ))
+  parser.add_argument("-r", "--rate", type=float, default=50, help=(
+    "Number of updates to deliver per second."
+  ))
+  parser.add_argument("-t", "--duration", type=float, default=30, help=(
+    "Number of seconds to deliver updates for."
+  ))
+  parser.add_argument("-u", "--users", type=int, default=1_000, help=(
+    "Number of registered users to send updates from."
+  ))
+  parser.add_argument("--keys", type=int, default=1_000, help=(
+    "Number of access keys on the fake Outline Server."
+  ))
+  parser.add_argument("--commands", type=str, default="/vpn", help=(
+    "Comma-separated list of commands to cycle through."
+  ))
+  parser.add_argument("--outline-latency", type=float, default=0.05, help=(
+    "Latency, in seconds, of every Outline Management API request."
+  ))
+  parser.add_argument("--outline-jitter", type=float, default=0.0, help=(
+    "Maximum random delay, in seconds, added to the Outline latency."
+  ))
+  parser.add_argument("--concurrent-updates", type=int, default=16, help=(
+    "Number of updates the bot may process concurrently."
+  ))
+  parser.add_argument("--drain", type=float, default=10, help=(
+    "Number of seconds to wait for outstanding replies after the last update."
+  ))
+  parser.add_argument("-o", "--output", type=str, help=(
+    "Path to the JSON file to write the results to."
+  ))
+  return parser.parse_args(args)
+
+def _get_free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+def _get_rss(pid: int) -> int:
+  try:
+    with open(f"/proc/{pid}/status", "r") as file:
+      for line in file:
+        if line.startswith("VmRSS:"):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+  return 0
+
+def _percentile(values: list[float], fraction: float) -> float:
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def _seed(database: str, users: int, keys: int) -> None:
+  db = DB(database)
+  with db.transaction():
+    db.exec_many(
+      "INSERT INTO users (id, nickname) VALUES (?, ?)",
+      [(i, f"user{i}") for i in range(1, users + 1)]
+    )
+    db.exec_many(
+      "INSERT INTO access_keys (id, user_id, outline_id) VALUES (?, ?, ?)",
+      [(f"key{i}", i + 1 if i < users else -1, str(i)) for i in range(keys)]
+    )
+  db.close()
+
+async def _wait_for_webhook(telegram: FakeTelegramServer) -> None:
+  await telegram.webhook_set.wait()
+  url = urlparse(telegram.webhook_url)
+  while True:
+    try:
+      _, writer = await asyncio.open_connection(url.hostname, url.port)
+    except OSError:
+      await asyncio.sleep(0.1)
+    else:
+      writer.close()
+      return
+
+def _create_update(update_id: int, user_id: int, text: str) -> dict:
+  command_length = len(text.split()[0]) if text.startswith("/") else 0
+  return {
+    "update_id": update_id,
+    "message": {
+      "message_id": update_id, "date": int(time.time()),
+      "chat": {"id": user_id, "type": "private"},
+      "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"user{user_id}"},
+      "text": text,
+      "entities": [{"type": "bot_command", "offset": 0, "length": command_length}] if command_length else [],
+    },
+  }
+
+def _start_bot(directory: str, telegram_port: int, outline_port: int, concurrent_updates: int) -> subprocess.Popen:
+  config = path.join(directory, "config.json")
+  with open(config, "w", encoding="utf-8") as file:
+    json.dump({"outline": {"reconcile_interval": 0}}, file)
+
+  api_port, webhook_port = _get_free_port(), _get_free_port()
+  return subprocess.Popen([
+    sys.executable, SRC_DIR,
+    "-c", config, "-d", path.join(directory, "db.sqlite3"), "--token", _BOT_TOKEN,
+    "--api-address", "127.0.0.1", "--api-port", str(api_port), "--api-url", f"http://127.0.0.1:{api_port}",
+    "--webhook-address", "127.0.0.1", "--webhook-port", str(webhook_port),
+    "--webhook-url", f"http://127.0.0.1:{webhook_port}/",
+    "--telegram-api-url", f"http://127.0.0.1:{telegram_port}",
+    "--outline-api-url", f"http://127.0.0.1:{outline_port}/{_OUTLINE_SECRET}", "--outline-ignore-localhost",
+    "--concurrent-updates", str(concurrent_updates),
+  ], cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+def _stop_bot(process: subprocess.Popen) -> str:
+  if process.poll() is None:
+    process.send_signal(signal.SIGINT)
+  try:
+    _, stderr = process.communicate(timeout=_SHUTDOWN_TIMEOUT)
+  except subprocess.TimeoutExpired:
+    process.kill()
+    _, stderr = process.communicate()
+  return stderr.decode(errors="replace")
+
+async def _load(args, process: subprocess.Popen, telegram: FakeTelegramServer, outline: FakeOutlineServer) -> dict:
+  pending: dict[int, deque[float]] = defaultdict(deque)
+  latencies = []
+  unexpected = 0
+  def on_message(message: SentMessage) -> None:
+    nonlocal unexpected
+    sent_at = pending[message.chat_id]
+    if sent_at:
+      latencies.append(message.sent_at - sent_at.popleft())
+    else:
+      unexpected += 1
+  telegram.on_message = on_message
+
+  rss = [_get_rss(process.pid)]
+  outline_requests = outline.requests
+  users = cycle(range(1, args.users + 1))
+  commands = cycle([x.strip() for x in args.commands.split(",") if x.strip()])
+  count = int(args.rate * args.duration)
+  deliveries = []
+  failed = 0
+  async def deliver(user_id: int, update: dict) -> None:
+    nonlocal failed
+    code = await telegram.deliver(update)
+    if code != 200:
+      failed += 1
+      pending[user_id].pop()
+
+  started_at = time.perf_counter()
+  for i in range(count):
+    delay = started_at + i / args.rate - time.perf_counter()
+    if delay > 0:
+      await asyncio.sleep(delay)
+    if i % max(int(args.rate), 1) == 0:
+      rss.append(_get_rss(process.pid))
+
+    user_id = next(users)
+    pending[user_id].append(time.perf_counter())
+    deliveries.append(asyncio.create_task(deliver(user_id, _create_update(i + 1, user_id, next(commands)))))
+  await asyncio.gather(*deliveries)
+  sent_at = time.perf_counter()
+
+  while len(latencies) < count - failed and time.perf_counter() - sent_at < args.drain and process.poll() is None:
+    await asyncio.sleep(0.1)
+  finished_at = time.perf_counter()
+  rss.append(_get_rss(process.pid))
+
+  elapsed = (max(telegram.messages[-1].sent_at, sent_at) if telegram.messages else finished_at) - started_at
+  return {
+    "updates": count,
+    "failed": failed,
+    "replies": len(latencies),
+    "missing": count - failed - len(latencies),
+    "unexpected": unexpected,
+    "elapsed": elapsed,
+    "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+    "latency": {
+      "min": min(latencies, default=0.0),
+      "mean": statistics.fmean(latencies) if latencies else 0.0,
+      "p50": _percentile(latencies, 0.50),
+      "p90": _percentile(latencies, 0.90),
+      "p99": _percentile(latencies, 0.99),
+      "max": max(latencies, default=0.0),
+    },
+    "rss": {"start": rss[0], "peak": max(rss), "end": rss[-1]},
+    "outline_requests": outline.requests - outline_requests,
+  }
+
+def _print_results(results: dict, file=sys.stderr) -> None:
+  latency = results["latency"]
+  rss = results["rss"]
+  print(
+    f"updates:    {results['updates']} sent, {results['failed']} rejected\n"
+    f"replies:    {results['replies']} received, {results['missing']} missing, {results['unexpected']} unexpected\n"
+    f"throughput: {results['throughput']:.1f} replies/s over {results['elapsed']:.1f} s\n"
+    f"latency:    p50 {latency['p50'] * 1000:.1f} ms, p90 {latency['p90'] * 1000:.1f} ms, "
+    f"p99 {latency['p99'] * 1000:.1f} ms, max {latency['max'] * 1000:.1f} ms\n"
+    f"memory:     {rss['start'] / 2**20:.1f} MiB at start, {rss['peak'] / 2**20:.1f} MiB peak, "
+    f"{rss['end'] / 2**20:.1f} MiB at end\n"
+    f"outline:    {results['outline_requests']} requests",
+    file=file,
+  )
+
+async def run(args) -> dict:
+  outline = FakeOutlineServer(args.keys, latency=args.outline_latency, jitter=args.outline_jitter)
+  telegram = FakeTelegramServer()
+  outline_port, telegram_port = _get_free_port(), _get_free_port()
+  outline_server = outline.create_app(_OUTLINE_SECRET).listen(outline_port, "127.0.0.1")
+  telegram_server = telegram.create_app().listen(telegram_port, "127.0.0.1")
+
+  with tempfile.TemporaryDirectory() as directory:
+    _seed(path.join(directory, "db.sqlite3"), args.users, args.keys)
+    process = _start_bot(directory, telegram_port, outline_port, args.concurrent_updates)
+    try:
+      try:
+        await asyncio.wait_for(_wait_for_webhook(telegram), _STARTUP_TIMEOUT)
+      except asyncio.TimeoutError:
+        raise RuntimeError("the bot did not set its webhook in time") from None
+      results = await _load(args, process, telegram, outline)
+    finally:
+      stderr = await asyncio.to_thread(_stop_bot, process)
+      outline_server.stop()
+      telegram_server.stop()
+      telegram.close()
+    if process.returncode not in (0, -signal.SIGINT):
+      print(stderr, file=sys.stderr)
+
+  return {
+    "created_at": datetime.now(timezone.utc).isoformat(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "config": {
+      "rate": args.rate, "duration": args.duration, "users": args.users, "keys": args.keys,
+      "commands": args.commands, "outline_latency": args.outline_latency,
+      "outline_jitter": args.outline_jitter, "concurrent_updates": args.concurrent_updates,
+    },
+    "results": results,
+  }
+
+def main(args=None) -> None:
+  parsed_args = _parse_args(args)
+  report = asyncio.run(run(parsed_args))
+  _print_results(report["results"])
+
+  if parsed_args.output:
+    with open(parsed_args.output, "w", encoding="utf-8") as file:
+      json.dump(report, file, indent=2)
+      file.write("\n")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import json
+import platform
+import subprocess
+import sys
+from argparse import ArgumentParser
+from dataclasses import asdict
+from datetime import datetime, timezone
+from importlib import import_module
+from harness import SRC_DIR, Result, format_duration, run
+
+SUITES = ("bench_db", "bench_format", "bench_units", "bench_access_keys", "bench_handlers")
+
+def _parse_args(args=None):
+  parser = ArgumentParser(prog="run.py", description=(
+    "Run the offline benchmark suite against synthetic data."
+  ))
+  parser.add_argument("-k", "--filter", type=str, help=(
+    "Only run the benchmarks whose names match the specified regular expression."
+  ))
+  parser.add_argument("-o", "--output", type=str, help=(
+    "Path to the JSON file to write the results to."
+  ))
+  parser.add_argument("-b", "--baseline", type=str, help=(
+    "Path to the JSON results of a previous run to compare against."
+  ))
+  parser.add_argument("--max-regression", type=float, help=(
+    "Exit with a non-zero status if any benchmark is slower than the baseline by more than the specified fraction (e.g., 0.2)."
+  ))
+  return parser.parse_args(args)
+
+def _get_commit() -> str | None:
+  try:
+    return subprocess.run(
+      ["git", "rev-parse", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True, check=True,
+    ).stdout.strip() or None
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def _compare(results: list[Result], baseline: dict) -> list[tuple[str, float]]:
+  baseline_results = {x["name"]: x for x in baseline.get("results", [])}
+  changes = []
+  print(file=sys.stderr)
+  for result in results:
+    baseline_result = baseline_results.get(result.name)
+    if not baseline_result or baseline_result["min"] <= 0:
+      continue
+
+    change = result.min / baseline_result["min"] - 1
+    changes.append((result.name, change))
+    print(
+      f"{result.name:<48} {format_duration(baseline_result['min'])} -> {format_duration(result.min)} {change:+8.1%}",
+      file=sys.stderr,
+    )
+  return changes
+
+def main(args=None) -> None:
+  parsed_args = _parse_args(args)
+  results = []
+  for suite in SUITES:
+    results.extend(run(import_module(suite).cases(), parsed_args.filter, file=sys.stderr))
+
+  report = {
+    "created_at": datetime.now(timezone.utc).isoformat(),
+    "commit": _get_commit(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "results": [asdict(x) for x in results],
+  }
+  if parsed_args.output:
+    with open(parsed_args.output, "w", encoding="utf-8") as file:
+      json.dump(report, file, indent=2)
+      file.write("\n")
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+  if not parsed_args.baseline:
+    return
+
+  with open(parsed_args.baseline, "r", encoding="utf-8") as file:
+    changes = _compare(results, json.load(file))
+  regressions = [x for x, y in changes if parsed_args.max_regression is not None and y > parsed_args.max_regression]
+  if regressions:
+    print(f"\n{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}", file=sys.stderr)
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -1,16 +1,41 @@
 #!/usr/bin/env python3
+import asyncio
+import sys
+import time
 from argparse import ArgumentParser
+from contextlib import nullcontext
 from os import environ
 from os.path import isfile
-from telebot import Telebot
-from typing import Sequence
-from utils.config import Config, MailConfig, OutlineConfig
+from typing import Sequence, TYPE_CHECKING
+from utils.config import Config, MailConfig, OutlineConfig, OutlineServerConfig
 from utils.db import DB
-from utils.mail import Mail
-from utils.outline import OutlineAPIClient
-from utils.outline import OutlineAPIClient
 from utils.url import expand_url
 
+if TYPE_CHECKING:
+  from utils.mail import Mail
+  from utils.outline import OutlineAPIClient, OutlinePool
+
+_STARTED_AT = time.perf_counter()
+
+class _StartupProfile:
+  def __init__(self, enabled: bool) -> None:
+    self.enabled = enabled
+    self.timings: list[tuple[str, float]] = [("interpreter", time.perf_counter() - _STARTED_AT)]
+    self._last = time.perf_counter()
+
+  def mark(self, name: str) -> None:
+    now = time.perf_counter()
+    self.timings.append((name, now - self._last))
+    self._last = now
+
+  def report(self, file=sys.stderr) -> None:
+    if not self.enabled:
+      return
+
+    for name, elapsed in self.timings:
+      print(f"{name:<16} {elapsed * 1000:9.1f} ms", file=file)
+    print(f"{'total':<16} {sum(x[1] for x in self.timings) * 1000:9.1f} ms", file=file)
+
 def _parse_args(args: Sequence[str] = None):
   parser = ArgumentParser(prog="telebot", add_help=False, description=(
     "A Telegram bot for managing Outline Server and more."
@@ -42,6 +67,10 @@ def _parse_args(args: Sequence[str] = None):
     "The port number where the bot should listen for Tunnel API requests.\n"
     "Defaults to 80."
   ))
+  parser.add_argument("--api-token", type=str, help=(
+    "The bearer token required by the Admin API. The Admin API is disabled if it is not set.\n"
+    "This can also be set via the 'TB_API_TOKEN' environment variable."
+  ))
   parser.add_argument("--api-url", type=str, help=(
     "The public URL where Telegram can send webhook requests.\n"
     "This should be reachable from the Internet."
@@ -58,6 +87,15 @@ def _parse_args(args: Sequence[str] = None):
     "The public URL where Telegram can send webhook requests.\n"
     "This must be reachable from the Internet."
   ))
+  parser.add_argument("--telegram-api-url", type=str, help=(
+    "The base URL of the Telegram Bot API, e.g., of a self-hosted Bot API server.\n"
+    "Defaults to 'https://api.telegram.org'."
+  ))
+  parser.add_argument("--concurrent-updates", type=int, help=(
+    "The maximum number of updates processed concurrently.\n"
+    "Updates from the same chat are always processed in order.\n"
+    "Defaults to 16."
+  ))
   parser.add_argument("--outline-api-url", type=str, help=(
     "The base URL of the Outline Management API.\n"
     "Required if '--outline-access-config' is not provided."
@@ -73,6 +111,43 @@ def _parse_args(args: Sequence[str] = None):
   parser.add_argument("--outline-ignore-localhost", action="store_true", help=(
     "Indicates whether the bot should attempt to send requests to the Outline Management API via localhost."
   ))
+  parser.add_argument("--profile-startup", action="store_true", help=(
+    "Print how long each startup step takes, including module imports, before the bot starts."
+  ))
+
+  commands = parser.add_subparsers(dest="command", title="commands", metavar="<command>")
+  export_parser = commands.add_parser("export", help=(
+    "Export users, their tags, and access keys as JSON Lines, then exit."
+  ))
+  export_parser.add_argument("-o", "--output", type=str, default="-", help=(
+    "Path to the output file.\n"
+    "Defaults to stdout."
+  ))
+  export_parser.add_argument("--users", type=str, help=(
+    "A comma-separated list of users to export.\n"
+    "Defaults to all users."
+  ))
+  export_parser.add_argument("--tag", type=str, help=(
+    "Export only the users with the specified tag."
+  ))
+  export_parser.add_argument("--skip-outline", action="store_true", help=(
+    "Do not include the access keys' names, passwords, ports, and data limits from the Outline Server."
+  ))
+  import_parser = commands.add_parser("import", help=(
+    "Import users, their tags, and access keys from JSON Lines, then exit.\n"
+    "Existing records are updated."
+  ))
+  import_parser.add_argument("-i", "--input", type=str, default="-", help=(
+    "Path to the input file.\n"
+    "Defaults to stdin."
+  ))
+  import_parser.add_argument("--recreate-keys", action="store_true", help=(
+    "Re-create the imported access keys that are missing on the configured Outline Server."
+  ))
+  import_parser.add_argument("--batch-size", type=int, default=500, help=(
+    "The number of records written per transaction.\n"
+    "Defaults to 500."
+  ))
   return parser.parse_args(args)
 
 def _patch_config(config: Config, args, env=environ) -> Config:
@@ -83,10 +158,13 @@ def _patch_config(config: Config, args, env=environ) -> Config:
   config.bot.token = token
   config.bot.api_address = args.api_address or config.bot.api_address
   config.bot.api_port = args.api_port or config.bot.api_port
+  config.bot.api_token = config.bot.api_token or args.api_token or env.get("TB_API_TOKEN") or ""
   config.bot.api_url = args.api_url or config.bot.api_url or f"*:{config.bot.api_port}"
   config.bot.webhook_address = args.webhook_address or config.bot.webhook_address
   config.bot.webhook_port = args.webhook_port or config.bot.webhook_port
   config.bot.webhook_url = args.webhook_url or config.bot.webhook_url
+  config.bot.telegram_api_url = args.telegram_api_url or config.bot.telegram_api_url
+  config.bot.concurrent_updates = args.concurrent_updates or config.bot.concurrent_updates
 
   config.outline.api_url = args.outline_api_url or config.outline.api_url
   config.outline.cert_sha256 = args.outline_cert_sha256 or config.outline.cert_sha256
@@ -100,31 +178,123 @@ def _patch_config(config: Config, args, env=environ) -> Config:
 
   return config
 
-def _init_outline(config: OutlineConfig) -> OutlineAPIClient:
+def _init_outline_client(config: OutlineConfig | OutlineServerConfig, prefer_localhost=False) -> "OutlineAPIClient":
   if config.api_url:
-    return OutlineAPIClient.from_url(config.api_url, config.cert_sha256, config.prefer_localhost)
+    from utils.outline import OutlineAPIClient
+    return OutlineAPIClient.from_url(config.api_url, config.cert_sha256, prefer_localhost)
   elif config.access_config and isfile(config.access_config):
-    return OutlineAPIClient.from_access_config(config.access_config, config.prefer_localhost)
+    from utils.outline import OutlineAPIClient
+    return OutlineAPIClient.from_access_config(config.access_config, prefer_localhost)
   else:
     return None
 
-def _init_mail(config: MailConfig) -> Mail:
+def _init_outline(config: OutlineConfig) -> "OutlineAPIClient | OutlinePool":
+  outline = _init_outline_client(config, config.prefer_localhost)
+  if not config.servers:
+    return outline
+
+  from utils.outline import OutlinePool
+  clients = {"": outline} if outline else {}
+  for server in config.servers:
+    client = _init_outline_client(server)
+    if not (server.name and client) or server.name in clients:
+      raise ValueError(f"invalid Outline Server configuration: '{server.name}'")
+    clients[server.name] = client
+  return OutlinePool(clients)
+
+def _init_mail(config: MailConfig) -> "Mail":
   if config.user or config.smtp_user or config.imap_user:
+    from utils.mail import Mail
     return Mail(**config.to_dict())
   else:
     return None
 
+def _get_user_ids(db: DB, users: str = None, tag: str = None) -> set[int] | None:
+  if not (users or tag):
+    return None
+
+  ids = set()
+  for user in filter(None, (x.strip() for x in (users or "").split(","))):
+    db_user = db.users.get(user.lstrip("@"))
+    if not db_user:
+      raise ValueError(f"invalid user: '{user}'")
+    ids.add(db_user.id)
+
+  if tag:
+    user_tags = db.user_tags.get_all_by_tag(tag.lstrip("#"))
+    if user_tags is None:
+      raise ValueError(f"invalid tag: '{tag}'")
+    ids.update(x.user_id for x in user_tags)
+  return ids
+
+def _export(args, db: DB, outline: "OutlineAPIClient | OutlinePool") -> None:
+  from utils.dump import export_records, write_records
+
+  users = _get_user_ids(db, args.users, args.tag)
+  outline_keys = {}
+  if outline and not args.skip_outline:
+    outline_keys = {(x.server or "", x.id): x for x in asyncio.run(outline.get_access_keys())}
+
+  with open(args.output, "w", encoding="utf-8") if args.output != "-" else nullcontext(sys.stdout) as file:
+    count = write_records(export_records(db, users=users, outline_keys=outline_keys), file)
+  print(f"exported {count} records", file=sys.stderr)
+
+def _import(args, db: DB, outline: "OutlineAPIClient | OutlinePool") -> None:
+  from utils.dump import Importer, read_records
+
+  importer = Importer(db, outline, recreate=args.recreate_keys, batch_size=args.batch_size)
+  with open(args.input, "r", encoding="utf-8") if args.input != "-" else nullcontext(sys.stdin) as file:
+    report = asyncio.run(importer.run(read_records(file)))
+  print(
+    f"imported {report.users} users, {report.user_tags} user tags, {report.access_keys} access keys; "
+    f"re-created {report.recreated} access keys ({report.skipped} failed)",
+    file=sys.stderr,
+  )
+
 def main(args: Sequence[str] = None) -> None:
   parsed_args = _parse_args(args)
+  if parsed_args.command:
+    config = _patch_config(Config.load(parsed_args.config), parsed_args)
+    db = DB(parsed_args.database)
+    outline = _init_outline(config.outline)
+    command = _export if parsed_args.command == "export" else _import
+    command(parsed_args, db, outline)
+    return
+
+  profile = _StartupProfile(parsed_args.profile_startup)
   config = _patch_config(Config.load(parsed_args.config), parsed_args)
+  profile.mark("config")
 
   db = DB(parsed_args.database)
+  profile.mark("database")
   outline = _init_outline(config.outline)
+  profile.mark("outline")
   mail = _init_mail(config.mail)
+  profile.mark("mail")
   language = config.language
 
-  bot = Telebot(db, outline=outline, mail=mail, language=language)
-  bot.run(**config.bot.to_dict())
+  bot_config = config.bot.to_dict()
+  concurrent_updates = bot_config.pop("concurrent_updates")
+  api_token = bot_config.pop("api_token")
+  telegram_api_url = bot_config.pop("telegram_api_url")
+  trace_sample_rate = bot_config.pop("trace_sample_rate")
+  trace_threshold = bot_config.pop("trace_threshold")
+
+  from telebot import Telebot
+  profile.mark("import telebot")
+  bot = Telebot(
+    db, outline=outline, mail=mail, language=language, concurrent_updates=concurrent_updates,
+    telegram_api_url=telegram_api_url, api_token=api_token,
+    trace_sample_rate=trace_sample_rate, trace_threshold=trace_threshold,
+    reconcile_interval=config.outline.reconcile_interval, reconcile_fix=config.outline.reconcile_fix,
+    transfer_sample_interval=config.outline.transfer_sample_interval,
+    data_limit_action=config.outline.data_limit_action,
+    data_limit_extension=config.outline.data_limit_extension,
+  )
+  profile.mark("init telebot")
+  profile.report()
+
+  bot.run(**bot_config)
 
 if __name__ == "__main__":
   main()
@@ -1,44 +1,89 @@
 import asyncio
+import re
 import uuid
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 from telegram import Message, MessageOrigin
 from telegram.ext import ApplicationBuilder, Defaults, MessageHandler, filters
-from utils.db import DB, Tag, TagLike
-from utils.format import FormatMap
+from utils.api import API_PATH, AdminAPI
+from utils.db import DB, Tag, TagLike, User
 from utils.l10n import L10nTable, load_l10n_table
-from utils.mail import Mail, request_url
+from utils.mail import Mail
+from utils.metrics import REGISTRY, counter
+from utils.mirror import MirrorCache
 from utils.net import create_http_server
-from utils.outline import OutlineAPIClient
-from utils.tg import prepare_handler
+from utils.outline import OutlineAPIClient, OutlinePool
+from utils.tasks import periodic
+from utils.tg import ChatUpdateProcessor, CommandRouter, MessageScheduler, prepare_handler
+from utils.trace import TRACER, DEFAULT_SAMPLE_RATE, DEFAULT_THRESHOLD
 from utils.units import DataSpan, TimeSpan
+from utils.usage import UsageAlert, UsageWatcher
 from utils.vpn import AccessKey, VPNManager
 
 _TOKEN_PLACEHOLDER = "<TOKEN>"
-
-class _HasTagFilter(filters.MessageFilter):
-  def __init__(self, db: DB, tag: TagLike) -> None:
-    super().__init__()
-    self.db = db
-    self.tag = tag
-
-  def filter(self, message: Message) -> bool:
-    user = message.from_user
-    return bool(user and self.db.user_tags.exists(user.id, self.tag))
+_TELEGRAM_API_URL = "https://api.telegram.org"
+_MIRROR_REFRESH_INTERVAL = 15 * 60
+_TOP_USAGE_MAX_COUNT = 50
+_TRACE_MAX_COUNT = 20
+_USER_LIST_SEPARATOR = re.compile(r"\s*,\s*")
+_DATA_LIMIT_ACTIONS = ("notify", "extend", "revoke")
+# The "_" nickname belongs to the reserved user, so no tunnel URL can start with it.
+_RESERVED_PATH = "/_"
+
+_TUNNEL_REQUESTS = counter(
+  "telebot_tunnel_requests_total", "Requests for dynamic access keys served by the tunnel API.", ("status",),
+)
+_CACHE_REQUESTS = counter(
+  "telebot_cache_requests_total", "Cache lookups by cache name and result.", ("cache", "result"),
+)
+
+def _parse_data_limit_extension(action: str, extension: str | None) -> int | None:
+  if action not in _DATA_LIMIT_ACTIONS:
+    raise ValueError(f"invalid data limit action: '{action}'")
+  if action != "extend":
+    return None
+
+  try:
+    value = int(DataSpan(extension)) if extension else 0
+  except ValueError:
+    value = 0
+  if value <= 0:
+    raise ValueError(f"invalid data limit extension: '{extension}'")
+  return value
 
 
 class Telebot:
   def __init__(
-      self, db: DB, outline: OutlineAPIClient = None,
-      mail: Mail = None, language: str | L10nTable = None) -> None:
+      self, db: DB, outline: OutlineAPIClient | OutlinePool = None,
+      mail: Mail = None, language: str | L10nTable = None,
+      concurrent_updates: int = 1, telegram_api_url: str = "", api_token: str = "",
+      trace_sample_rate: float = DEFAULT_SAMPLE_RATE, trace_threshold: float = DEFAULT_THRESHOLD,
+      reconcile_interval: int = 0, reconcile_fix=False,
+      transfer_sample_interval: int = 0, data_limit_action: str = "notify",
+      data_limit_extension: str = None) -> None:
     self.db = db
     self.mail = mail
     self.l10n = load_l10n_table(language)
-
-    self.telegram_app = self.__build_telegram_app(db)
-    self.http_server = self.__build_http_server()
+    self.reconcile_interval = reconcile_interval
+    self.reconcile_fix = reconcile_fix
+    self.transfer_sample_interval = transfer_sample_interval
+    TRACER.sample_rate = trace_sample_rate
+    TRACER.threshold = trace_threshold
+
+    self.scheduler = MessageScheduler()
+    self.telegram_app = self.__build_telegram_app(db, concurrent_updates, telegram_api_url)
     self.vpn = self.__build_vpn_manager(db, outline)
+    self.api = AdminAPI(db, self.vpn)
+    self.http_server = self.__build_http_server(api_token)
+    self.mirrors = MirrorCache(db, mail) if mail else None
+    self.usage = self.vpn and UsageWatcher(
+      self.vpn,
+      extension=_parse_data_limit_extension(data_limit_action, data_limit_extension),
+      revoke=data_limit_action == "revoke",
+      on_alerts=self.on_usage_alerts,
+    )
 
-    self._cache = self.telegram_app.bot_data
+    self._tasks: list[asyncio.Task] = []
+    self._tunnel_url = ""
 
   def run(
       self, token: str, *, api_url="", api_address="", api_port=80,
@@ -46,7 +91,7 @@ class Telebot:
     if not token:
       raise ValueError(f"could not start the bot: the token is missing")
 
-    self.http_server.url = api_url or ""
+    self.__set_tunnel_url(api_url)
     self.http_server.listen(address=api_address, port=api_port)
 
     bot = self.telegram_app.bot
@@ -65,7 +110,7 @@ class Telebot:
       self.telegram_app.run_polling()
 
     self.http_server.stop()
-    self.http_server.url = ""
+    self.__set_tunnel_url("")
     [bot._token, bot._base_url, bot._base_file_url] = bot_settings
 
 
@@ -73,6 +118,10 @@ class Telebot:
     self.vpn and await self.vpn.delete_expired_access_keys()
     return self.l10n["CLEANUP_SUCCESS"]
 
+  def print_traces(self, count: int = 5) -> str:
+    report = TRACER.get_report(min(max(count, 1), _TRACE_MAX_COUNT))
+    return self.l10n["TRACE_REPORT"].render(report)
+
   def register(self, user_id: int, user_username: str) -> str:
     self.db.users.create(user_id, user_username)
     return self.help()
@@ -84,39 +133,39 @@ class Telebot:
     return self.l10n["HELP_ADMIN"]
 
   def add_tag_self(self, user_id: int, tag: TagLike, token: str) -> str:
-    params = FormatMap({"user": user_id, "tag": tag})
+    params = {"user": user_id, "tag": tag}
     if token != self.telegram_app.bot.token:
       return self.l10n["INVALID_TOKEN"]
 
     created = self.db.user_tags.create(user_id, tag)
     if created:
-      return self.l10n["USER_SELF_TAG_ADD_SUCCESS"].format_map(params)
+      return self.l10n["USER_SELF_TAG_ADD_SUCCESS"].render(params)
     else:
-      return self.l10n["USER_SELF_TAG_ADD_FAILURE"].format_map(params)
+      return self.l10n["USER_SELF_TAG_ADD_FAILURE"].render(params)
 
   def add_tag(self, user: str, tag: TagLike) -> str:
     user_tag = self.db.user_tags.create(user, tag)
-    params = FormatMap({"user": user, "tag": tag})
+    params = {"user": user, "tag": tag}
     if user_tag:
-      return self.l10n["USER_TAG_ADD_SUCCESS"].format_map(params)
+      return self.l10n["USER_TAG_ADD_SUCCESS"].render(params)
     else:
-      return self.l10n["USER_TAG_ADD_FAILURE"].format_map(params)
+      return self.l10n["USER_TAG_ADD_FAILURE"].render(params)
 
   def remove_tag(self, user: str, tag: TagLike) -> str:
     deleted = self.db.user_tags.delete(user, tag)
-    params = FormatMap({"user": user, "tag": tag})
+    params = {"user": user, "tag": tag}
     if deleted:
-      return self.l10n["USER_TAG_REMOVE_SUCCESS"].format_map(params)
+      return self.l10n["USER_TAG_REMOVE_SUCCESS"].render(params)
     else:
-      return self.l10n["USER_TAG_REMOVE_FAILURE"].format_map(params)
+      return self.l10n["USER_TAG_REMOVE_FAILURE"].render(params)
 
   def set_nickname(self, user: str, nickname: str) -> str:
     updated = self.db.users.update(user, nickname=nickname)
-    params = FormatMap({"user": user, "nickname": nickname})
+    params = {"user": user, "nickname": nickname}
     if updated:
-      return self.l10n["USER_NICKNAME_SET_SUCCESS"].format_map(params)
+      return self.l10n["USER_NICKNAME_SET_SUCCESS"].render(params)
     else:
-      return self.l10n["USER_NICKNAME_SET_FAILURE"].format_map(params)
+      return self.l10n["USER_NICKNAME_SET_FAILURE"].render(params)
 
   def print_telegram_user(self, message: Message) -> str:
     user = message and message.from_user
@@ -124,18 +173,18 @@ class Telebot:
     if origin is not None:
       user = origin.sender_user if origin.type == MessageOrigin.USER else None
     if user:
-      return self.l10n["TELEGRAM_USER_INFO"].format_map(FormatMap(user))
+      return self.l10n["TELEGRAM_USER_INFO"].render(user)
     else:
       return self.l10n["TELEGRAM_USER_INFO_MISSING"]
 
   def print_user(self, user: str) -> str:
     db_user = self.db.users.get(user)
     if not db_user:
-      return self.l10n["INVALID_USER"].format_map(FormatMap({"user": user}))
+      return self.l10n["INVALID_USER"].render({"user": user})
 
     db_user.is_admin = self.db.user_tags.exists(db_user, Tag.ADMIN)
     db_user.is_banned = self.db.user_tags.exists(db_user, Tag.BANNED)
-    return self.l10n["USER_INFO"].format_map(FormatMap(db_user))
+    return self.l10n["USER_INFO"].render(db_user)
 
   def print_users(self) -> str:
     users = [x for x in self.db.users.get_all() if x.id > 0]
@@ -144,35 +193,33 @@ class Telebot:
     for user in users:
       user.is_admin = any(x.user_id == user.id for x in op_users)
       user.is_banned = any(x.user_id == user.id for x in banned_users)
-    return self.l10n["ALL_USERS_INFO"].format_map(FormatMap({"users": users}))
+    return self.l10n["ALL_USERS_INFO"].render({"users": users})
 
   async def get_mirror(self, address: str, force: bool = False):
     if not self.mail:
       yield self.l10n["FEATURE_DISABLED"]
       return
 
-    cached_url, cache_date = self._cache.get(address, ("", datetime.min))
-    url = cached_url
-    new_url = ""
-    if force or datetime.now() - cache_date >= timedelta(hours=6):
+    mirror = self.mirrors.get(address)
+    url = mirror.url if mirror else ""
+    if force or not self.mirrors.is_fresh(mirror):
+      _CACHE_REQUESTS.inc("mirror", "miss")
       yield self.l10n["MIRROR_FETCH_IN_PROGRESS"]
-      new_url = await request_url(self.mail, address, timeout=120)
-
-    if new_url:
-      self._cache[address] = (new_url, datetime.now())
-      url = new_url
+      url = await self.mirrors.fetch(address) or url
+    else:
+      _CACHE_REQUESTS.inc("mirror", "hit")
 
     if url:
-      yield self.l10n["MIRROR_FETCH_SUCCESS"].format_map(FormatMap({"url": url}))
+      yield self.l10n["MIRROR_FETCH_SUCCESS"].render({"url": url})
     else:
       yield self.l10n["MIRROR_FETCH_FAILURE"]
 
-  async def print_server_info(self) -> str:
+  async def print_server_info(self, period: TimeSpan = None) -> str:
     if not self.vpn:
       return self.l10n["FEATURE_DISABLED"]
 
-    server_info = await self.vpn.get_server_info()
-    return self.l10n["SERVER_INFO"].format_map(FormatMap(server_info))
+    server_info = await self.vpn.get_server_info(period=period)
+    return self.l10n["SERVER_INFO"].render(server_info)
 
   async def edit_server_info(self, name: str = None, port: int = None, data_limit: DataSpan = None) -> str:
     if not self.vpn:
@@ -186,12 +233,12 @@ class Telebot:
     )
     return self.l10n["SERVER_INFO_UPDATE_SUCCESS"]
 
-  async def print_access_keys(self, user_id: int) -> str:
+  async def print_access_keys(self, user_id: int, period: TimeSpan = None) -> str:
     if not self.vpn:
       return self.l10n["FEATURE_DISABLED"]
 
-    access_keys = await self.vpn.get_access_keys(user=user_id)
-    return self.l10n["ACCESS_INFO"].format_map(FormatMap({"access_keys": access_keys}))
+    access_keys = await self.vpn.get_access_keys(user=user_id, period=period)
+    return self.l10n["ACCESS_INFO"].render({"access_keys": access_keys, "period": access_keys and period})
 
   async def add_access_key(self, user: str, name: str = None, port: int = None, data_limit: DataSpan = None, time_limit: TimeSpan = None) -> str:
     if not self.vpn:
@@ -203,7 +250,7 @@ class Telebot:
       expires_at = datetime.now() + time_limit
 
     if not owner:
-      return self.l10n["INVALID_USER"].format_map(FormatMap({"user": user}))
+      return self.l10n["INVALID_USER"].render({"user": user})
 
     access_key = await self.vpn.create_access_key(
       user=owner,
@@ -213,10 +260,54 @@ class Telebot:
       expires_at=expires_at,
     )
     if access_key:
-      return self.l10n["ACCESS_KEYS_ADD_SUCCESS"].format_map(FormatMap({"access_keys": [access_key]}))
+      return self.l10n["ACCESS_KEYS_ADD_SUCCESS"].render({"access_keys": [access_key]})
     else:
       return self.l10n["ACCESS_KEYS_ADD_FAILURE"]
 
+  async def add_access_keys(self, users: str, name: str = None, port: int = None, data_limit: DataSpan = None, time_limit: TimeSpan = None) -> str:
+    if not self.vpn:
+      return self.l10n["FEATURE_DISABLED"]
+
+    targets = {x: self._resolve_users(x) for x in _USER_LIST_SEPARATOR.split(users.strip())}
+    invalid_targets = [x for x, y in targets.items() if y is None]
+    if invalid_targets:
+      return self.l10n["INVALID_USER"].render({"user": ", ".join(invalid_targets)})
+
+    owners = {y.id: y for x in targets.values() for y in x}
+    if not owners:
+      return self.l10n["INVALID_USER"].render({"user": users})
+
+    expires_at = None
+    if time_limit and time_limit.total_seconds() >= 0:
+      expires_at = datetime.now() + time_limit
+
+    access_keys = await self.vpn.create_access_keys(
+      list(owners.values()),
+      names=[name or x.nickname for x in owners.values()],
+      port=port,
+      data_limit=data_limit,
+      expires_at=expires_at,
+    )
+    if not access_keys:
+      return self.l10n["ACCESS_KEYS_ADD_FAILURE"]
+
+    response = self.l10n["ACCESS_KEYS_ADD_SUCCESS"].render({"access_keys": access_keys})
+    failed = len(owners) - len(access_keys)
+    if failed:
+      response += "\n\n" + self.l10n["ACCESS_KEYS_ADD_PARTIAL_FAILURE"].render({"failed": failed})
+    return response
+
+  def _resolve_users(self, target: str) -> list[User] | None:
+    if not target.startswith("#"):
+      user = self.db.users.get(target.lstrip("@"))
+      return [user] if user else None
+
+    user_tags = self.db.user_tags.get_all_by_tag(target[1:])
+    if user_tags is None:
+      return None
+    user_ids = [x.user_id for x in user_tags]
+    return self.db.users.get_all(user_ids) if user_ids else []
+
   async def edit_access_keys(self, user: str, id: str = None, name: str = None, data_limit: DataSpan = None, time_limit: TimeSpan = None) -> str:
     if not self.vpn:
       return self.l10n["FEATURE_DISABLED"]
@@ -229,34 +320,70 @@ class Telebot:
       expires_at = None
 
     if not owner:
-      return self.l10n["INVALID_USER"].format_map(FormatMap({"user": user}))
+      return self.l10n["INVALID_USER"].render({"user": user})
 
-    count = await self.vpn.patch_access_keys(
+    report = await self.vpn.patch_access_keys(
       user=owner,
       id=id,
       name=name,
       data_limit=data_limit,
       expires_at=expires_at,
     )
-    if count:
-      return self.l10n["ACCESS_KEYS_EDIT_SUCCESS"].format_map(FormatMap({"count": count}))
-    else:
+    if not report.applied and not report.queued:
       return self.l10n["ACCESS_KEYS_EDIT_FAILURE"]
 
+    responses = []
+    if report.applied:
+      responses.append(self.l10n["ACCESS_KEYS_EDIT_SUCCESS"].render({"count": report.applied}))
+    if report.queued:
+      responses.append(self.l10n["ACCESS_KEYS_EDIT_PENDING"].render({"count": report.queued}))
+    return "\n\n".join(responses)
+
+  async def print_top_usage(self, count: int = 10, period: TimeSpan = None) -> str:
+    if not self.vpn:
+      return self.l10n["FEATURE_DISABLED"]
+
+    usage_report = await self.vpn.get_top_usage(min(max(count, 1), _TOP_USAGE_MAX_COUNT), period=period)
+    return self.l10n["TOP_USAGE"].render(usage_report)
+
+  async def reconcile_access_keys(self, fix: str = None) -> str:
+    if not self.vpn:
+      return self.l10n["FEATURE_DISABLED"]
+
+    report = await self.vpn.reconcile(fix=bool(fix))
+    if report.fixed:
+      return self.l10n["ACCESS_KEYS_RECONCILE_FIX_SUCCESS"].render(report)
+    else:
+      return self.l10n["ACCESS_KEYS_RECONCILE_REPORT"].render(report)
+
   async def remove_access_keys(self, user: str, id: str = None) -> str:
     if not self.vpn:
       return self.l10n["FEATURE_DISABLED"]
 
     owner = self.db.users.get(user)
     if not owner:
-      return self.l10n["INVALID_USER"].format_map(FormatMap({"user": user}))
+      return self.l10n["INVALID_USER"].render({"user": user})
 
     access_keys = await self.vpn.delete_access_keys(owner, id)
     if access_keys:
-      return self.l10n["ACCESS_KEYS_REMOVE_SUCCESS"].format_map(FormatMap({"access_keys": access_keys}))
+      return self.l10n["ACCESS_KEYS_REMOVE_SUCCESS"].render({"access_keys": access_keys})
     else:
       return self.l10n["ACCESS_KEYS_REMOVE_FAILURE"]
 
+  async def rotate_access_keys(self, user: str, id: str = None, port: int = None, method: str = None) -> str:
+    if not self.vpn:
+      return self.l10n["FEATURE_DISABLED"]
+
+    owner = None if user == "*" else self.db.users.get(user)
+    if user != "*" and not owner:
+      return self.l10n["INVALID_USER"].render({"user": user})
+
+    access_keys = await self.vpn.rotate_access_keys(owner, id, port=port, method=method)
+    if access_keys:
+      return self.l10n["ACCESS_KEYS_ROTATE_SUCCESS"].render({"access_keys": access_keys})
+    else:
+      return self.l10n["ACCESS_KEYS_ROTATE_FAILURE"]
+
   async def on_access_key_created(self, access_key: AccessKey) -> None:
     try:
       await self._on_access_key_created(access_key)
@@ -267,8 +394,8 @@ class Telebot:
     if not (access_key.owner and access_key.owner.id > 0):
       return None
     user = access_key.owner.id
-    notification = self.l10n["ACCESS_KEYS_ADD_NOTIFICATION"].format_map(FormatMap({"access_keys": [access_key]}))
-    await self.telegram_app.bot.send_message(user, notification, disable_web_page_preview=True)
+    notification = self.l10n["ACCESS_KEYS_ADD_NOTIFICATION"].render({"access_keys": [access_key]})
+    self.scheduler.notify(user, notification, disable_web_page_preview=True)
 
   async def on_access_key_deleted(self, access_key: AccessKey) -> None:
     try:
@@ -281,8 +408,28 @@ class Telebot:
       return None
 
     user = access_key.owner.id
-    notification = self.l10n["ACCESS_KEYS_REMOVE_NOTIFICATION"].format_map(FormatMap({"access_keys": [access_key]}))
-    await self.telegram_app.bot.send_message(user, notification)
+    notification = self.l10n["ACCESS_KEYS_REMOVE_NOTIFICATION"].render({"access_keys": [access_key]})
+    self.scheduler.notify(user, notification)
+
+  def on_access_keys_changed(self) -> None:
+    self.usage and self.usage.invalidate()
+
+  async def on_usage_alerts(self, alerts: list[UsageAlert]) -> None:
+    try:
+      await self._on_usage_alerts(alerts)
+    except:
+      pass
+
+  async def _on_usage_alerts(self, alerts: list[UsageAlert]) -> None:
+    alerts_by_user: dict[int, list[UsageAlert]] = {}
+    for alert in alerts:
+      owner = alert.access_key.owner
+      if owner and owner.id > 0:
+        alerts_by_user.setdefault(owner.id, []).append(alert)
+
+    for user, user_alerts in alerts_by_user.items():
+      notification = self.l10n["DATA_LIMIT_NOTIFICATION"].render({"alerts": user_alerts})
+      self.scheduler.notify(user, notification)
 
   async def get_raw_access_url(self, user: str, id: str) -> str | None:
     if not (self.vpn and id):
@@ -290,28 +437,56 @@ class Telebot:
 
     return await self.vpn.get_raw_access_url(user or -1, id)
 
+  async def check_health(self) -> tuple[dict, int]:
+    checks = {"db": "ok", "outline": "disabled"}
+    try:
+      self.db.ping()
+    except Exception as e:
+      checks["db"] = f"error: {e}"
+
+    if self.vpn:
+      checks["outline"] = "ok" if await self.vpn.check_health() else "unreachable"
+
+    healthy = all(x in ("ok", "disabled") for x in checks.values())
+    return {"status": "ok" if healthy else "fail", "checks": checks}, 200 if healthy else 503
+
   def get_access_url(self, access_key: AccessKey) -> str:
-    if not (self.http_server.url and access_key.id):
+    if not (self._tunnel_url and access_key.id):
       return access_key.access_url
 
-    base_url = self.http_server.url.split("://", maxsplit=1)[-1].rstrip("/")
     if access_key.owner and access_key.owner.id > 0:
-      access_url = f"ssconf://{base_url}/{access_key.owner.nickname}/{access_key.id}"
+      return f"{self._tunnel_url}{access_key.owner.nickname}/{access_key.id}"
     else:
-      access_url = f"ssconf://{base_url}/{access_key.id}"
-    return access_url
+      return f"{self._tunnel_url}{access_key.id}"
+
+  def __set_tunnel_url(self, url: str) -> None:
+    self.http_server.url = url or ""
+    base_url = self.http_server.url.split("://", maxsplit=1)[-1].rstrip("/")
+    self._tunnel_url = f"ssconf://{base_url}/" if base_url else ""
 
 
-  def __build_http_server(self):
+  def __build_http_server(self, api_token: str):
     async def http_handler(path: str, _: str) -> str | None:
       *_, user, id = ["", "", *(x for x in path.split("/") if x)]
-      return await self.get_raw_access_url(user, id)
+      access_url = await self.get_raw_access_url(user, id)
+      _TUNNEL_REQUESTS.inc("found" if access_url else "not_found")
+      return access_url
 
-    http_server = create_http_server(http_handler)
+    async def health_handler(_: str, __: str) -> tuple[dict, int]:
+      return await self.check_health()
+
+    def metrics_handler(_: str, __: str) -> tuple[str, int, str]:
+      return REGISTRY.render(), 200, "text/plain; version=0.0.4; charset=utf-8"
+
+    api_routes = {rf"{API_PATH}/.*": self.api.handle} if api_token else {}
+    http_server = create_http_server(http_handler, {
+      f"{_RESERVED_PATH}/healthz": health_handler,
+      f"{_RESERVED_PATH}/metrics": metrics_handler,
+    }, api_routes, api_token)
     http_server.url = ""
     return http_server
 
-  def __build_vpn_manager(self, db: DB, outline: OutlineAPIClient | None):
+  def __build_vpn_manager(self, db: DB, outline: OutlineAPIClient | OutlinePool | None):
     if not (db and outline):
       return None
 
@@ -321,26 +496,62 @@ class Telebot:
       access_url_provider=self.get_access_url,
       on_access_key_created=self.on_access_key_created,
       on_access_key_deleted=self.on_access_key_deleted,
+      on_access_keys_changed=self.on_access_keys_changed,
     )
 
-  def __build_telegram_app(self, db: DB):
+  async def __startup(self, _) -> None:
+    if self.vpn:
+      self._tasks.append(asyncio.create_task(self.vpn.run_outbox()))
+    if self.vpn and self.reconcile_interval > 0:
+      reconcile = lambda: self.vpn.reconcile(fix=self.reconcile_fix)
+      self._tasks.append(asyncio.create_task(periodic(self.reconcile_interval, reconcile, delay=60)))
+    if self.vpn and self.transfer_sample_interval > 0:
+      self._tasks.append(asyncio.create_task(periodic(self.transfer_sample_interval, self.__sample_transfer_metrics)))
+    if self.mirrors:
+      self._tasks.append(asyncio.create_task(periodic(_MIRROR_REFRESH_INTERVAL, self.mirrors.refresh)))
+
+  async def __sample_transfer_metrics(self) -> None:
+    counters = await self.vpn.sample_transfer_metrics()
+    await self.usage.evaluate(counters)
+
+  async def __shutdown(self, _) -> None:
+    for task in self._tasks:
+      task.cancel()
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+    self._tasks.clear()
+    await self.scheduler.stop()
+    if self.mail:
+      await self.mail.close()
+
+  def __build_telegram_app(self, db: DB, concurrent_updates: int, telegram_api_url: str = ""):
     defaults = Defaults(parse_mode="HTML", tzinfo=timezone.utc)
-    app = ApplicationBuilder().token(_TOKEN_PLACEHOLDER).defaults(defaults).build()
+    update_processor = ChatUpdateProcessor(max(concurrent_updates, 1))
+    telegram_api_url = (telegram_api_url or _TELEGRAM_API_URL).rstrip("/")
+    app = (
+      ApplicationBuilder()
+        .token(_TOKEN_PLACEHOLDER)
+        .base_url(f"{telegram_api_url}/bot")
+        .base_file_url(f"{telegram_api_url}/file/bot")
+        .defaults(defaults)
+        .concurrent_updates(update_processor)
+        .post_init(self.__startup)
+        .post_shutdown(self.__shutdown)
+        .build()
+    )
+    self.scheduler.bot = app.bot
 
-    is_allowed = ~_HasTagFilter(db, Tag.BANNED)
-    is_admin = _HasTagFilter(db, Tag.ADMIN)
-    def h(pattern, callback, filter=None):
-      pattern = filters.Regex(pattern) if isinstance(pattern, str) else pattern
-      filter = is_allowed & filter if filter is not None else is_allowed
-      filter = pattern & filter
-      app.add_handler(MessageHandler(filter, prepare_handler(callback)))
+    resolve_permissions = lambda user: {x.name for x in db.tags.get_all_by_user(user.id)}
+    router = CommandRouter(resolve_permissions, blocked_tag=Tag.BANNED)
+    is_admin = Tag.ADMIN
+    def h(command, pattern, callback, tag=None):
+      router.add(command, pattern, prepare_handler(callback, scheduler=self.scheduler, pattern=pattern), tag=tag)
 
     # General Commands
-    h(r"^/start$", self.register)
-    h(r"^/help$", self.help_admin, is_admin)
-    h(r"^/help$", self.help)
-    h(r"^/me$", self.print_telegram_user)
-    h(filters.FORWARDED, self.print_telegram_user)
+    h("start", r"^/start$", self.register)
+    h("help", r"^/help$", self.help_admin, is_admin)
+    h("help", r"^/help$", self.help)
+    h("me", r"^/me$", self.print_telegram_user)
+    router.add_fallback(filters.FORWARDED, prepare_handler(self.print_telegram_user, scheduler=self.scheduler))
 
     # VPN Management
     vpn_id = r"\s+@?(?P<user>[\w-]+)(?::(?P<id>[\w-]+))?"
@@ -350,30 +561,42 @@ class Telebot:
       r"(?:\s+at\s*(?P<port>\d{1,5}))?"
       r"(?:\s+as\s*(?P<name>.*))?$"
     )
-    h(r"^/vpn$", self.print_access_keys)
-    h(r"^/vpn(?:\s*|_)server$", self.print_server_info, is_admin)
-    h(r"^/vpn(?:\s*|_)server" + vpn_params, self.edit_server_info, is_admin)
-    h(r"^/vpn(?:\s*|_)add" + vpn_id + vpn_params, self.add_access_key, is_admin)
-    h(r"^/vpn(?:\s*|_)edit" + vpn_id + vpn_params, self.edit_access_keys, is_admin)
-    h(r"^/vpn(?:\s*|_)remove" + vpn_id, self.remove_access_keys, is_admin)
+    vpn_period = r"(?:\s+over\s+(?P<period>(?:\d*\.\d+|\d+)\s*\S*))?$"
+    h("vpn", r"^/vpn" + vpn_period, self.print_access_keys)
+    h("vpn", r"^/vpn(?:\s*|_)server" + vpn_period, self.print_server_info, is_admin)
+    h("vpn", r"^/vpn(?:\s*|_)server" + vpn_params, self.edit_server_info, is_admin)
+    vpn_user = r"(?:#[\w-]+|@?[\w-]+)"
+    vpn_users = r"\s+(?P<users>#[\w-]+|" + vpn_user + r"(?:\s*,\s*" + vpn_user + r")+)"
+    h("vpn", r"^/vpn(?:\s*|_)add" + vpn_users + vpn_params, self.add_access_keys, is_admin)
+    h("vpn", r"^/vpn(?:\s*|_)add" + vpn_id + vpn_params, self.add_access_key, is_admin)
+    h("vpn", r"^/vpn(?:\s*|_)edit" + vpn_id + vpn_params, self.edit_access_keys, is_admin)
+    h("vpn", r"^/vpn(?:\s*|_)remove" + vpn_id, self.remove_access_keys, is_admin)
+    h("vpn", (
+      r"^/vpn(?:\s*|_)rotate\s+@?(?P<user>\*|[\w-]+)(?::(?P<id>[\w-]+))?"
+      r"(?:\s+at\s*(?P<port>\d{1,5}))?(?:\s+using\s+(?P<method>[\w-]+))?$"
+    ), self.rotate_access_keys, is_admin)
+    h("vpn", r"^/vpn(?:\s*|_)top(?:\s+(?P<count>\d{1,3}))?" + vpn_period, self.print_top_usage, is_admin)
+    h("vpn", r"^/vpn(?:\s*|_)reconcile(?:\s+(?P<fix>fix))?$", self.reconcile_access_keys, is_admin)
 
     # User Management
-    h(r"^/user\s+@?(?P<user>[\w-]+)$", self.print_user, is_admin)
-    h(r"^/users$", self.print_users, is_admin)
-    h(r"^/nickname\s+@?(?P<user>[\w-]+)\s+@?(?P<nickname>[\w-]+)$", self.set_nickname, is_admin)
+    h("user", r"^/user\s+@?(?P<user>[\w-]+)$", self.print_user, is_admin)
+    h("users", r"^/users$", self.print_users, is_admin)
+    h("nickname", r"^/nickname\s+@?(?P<user>[\w-]+)\s+@?(?P<nickname>[\w-]+)$", self.set_nickname, is_admin)
 
     # Admin & Moderation
-    h(r"^/ascend\s+(?P<token>\S+)$", dict(_=self.add_tag_self, tag=Tag.ADMIN))
-    h(r"^/op\s+@?(?P<user>[\w-]+)$", dict(_=self.add_tag, tag=Tag.ADMIN), is_admin)
-    h(r"^/deop\s+@?(?P<user>[\w-]+)$", dict(_=self.remove_tag, tag=Tag.ADMIN), is_admin)
-    h(r"^/ban\s+@?(?P<user>[\w-]+)$", dict(_=self.add_tag, tag=Tag.BANNED), is_admin)
-    h(r"^/pardon\s+@?(?P<user>[\w-]+)$", dict(_=self.remove_tag, tag=Tag.BANNED), is_admin)
+    h("ascend", r"^/ascend\s+(?P<token>\S+)$", dict(_=self.add_tag_self, tag=Tag.ADMIN))
+    h("op", r"^/op\s+@?(?P<user>[\w-]+)$", dict(_=self.add_tag, tag=Tag.ADMIN), is_admin)
+    h("deop", r"^/deop\s+@?(?P<user>[\w-]+)$", dict(_=self.remove_tag, tag=Tag.ADMIN), is_admin)
+    h("ban", r"^/ban\s+@?(?P<user>[\w-]+)$", dict(_=self.add_tag, tag=Tag.BANNED), is_admin)
+    h("pardon", r"^/pardon\s+@?(?P<user>[\w-]+)$", dict(_=self.remove_tag, tag=Tag.BANNED), is_admin)
 
     # Maintenance
-    h(r"^/cleanup$", self.cleanup, is_admin)
+    h("cleanup", r"^/cleanup$", self.cleanup, is_admin)
+    h("trace", r"^/trace(?:\s+(?P<count>\d{1,2}))?$", self.print_traces, is_admin)
 
     # Help
-    h(is_admin, self.help_admin)
-    h(filters.ALL, self.help)
+    router.add_fallback(None, prepare_handler(self.help_admin, scheduler=self.scheduler), tag=is_admin)
+    router.add_fallback(None, prepare_handler(self.help, scheduler=self.scheduler))
 
+    app.add_handler(MessageHandler(filters.ALL, router))
     return app
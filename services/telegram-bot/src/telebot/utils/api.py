@@ -0,0 +1,395 @@
+from datetime import datetime, timezone
+from typing import Any, Callable
+from utils.db import DB, Tag, User
+from utils.metrics import counter
+from utils.outline import HTTPError
+from utils.units import DataSpan
+from utils.vpn import AccessKey, AccessKeyPatch, AccessKeyRequest, VPNManager
+
+_API_REQUESTS = counter(
+  "telebot_api_requests_total", "Admin API requests by resource, method, and status code.",
+  ("resource", "method", "status"),
+)
+
+API_PATH = "/_/api"
+
+_DEFAULT_PAGE_SIZE = 100
+_MAX_PAGE_SIZE = 1000
+_MAX_BATCH_SIZE = 1000
+_RESERVED_TAGS = (Tag.ADMIN, Tag.BANNED)
+
+class APIError(Exception):
+  def __init__(self, message: str, code: int = 400) -> None:
+    super().__init__(message)
+    self.code = code
+
+BatchResult = tuple[list[dict | None], list[dict]]
+
+
+def _parse_int(value: Any, name: str) -> int:
+  if isinstance(value, bool) or not isinstance(value, (int, str)):
+    raise ValueError(f"invalid {name}: '{value}'")
+  try:
+    return int(value)
+  except ValueError:
+    raise ValueError(f"invalid {name}: '{value}'") from None
+
+def _parse_str(value: Any, name: str) -> str:
+  if not isinstance(value, str) or not value:
+    raise ValueError(f"invalid {name}: '{value}'")
+  return value
+
+def _parse_date(value: Any, name: str) -> datetime | None:
+  if value is None:
+    return None
+  try:
+    date = datetime.fromisoformat(_parse_str(value, name))
+  except ValueError:
+    raise ValueError(f"invalid {name}: '{value}'") from None
+  return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+def _parse_data_limit(value: Any) -> int | None:
+  if value is None:
+    return None
+  try:
+    data_limit = int(DataSpan(value if isinstance(value, str) else _parse_int(value, "data limit")))
+  except ValueError:
+    raise ValueError(f"invalid data limit: '{value}'") from None
+  if data_limit < 0:
+    raise ValueError(f"invalid data limit: '{value}'")
+  return data_limit
+
+def _parse_access_key_cursor(cursor: str) -> tuple[int, str]:
+  user, _, id = cursor.partition(":")
+  return int(user), _parse_str(id, "cursor")
+
+def _format_date(date: datetime | None) -> str | None:
+  return date and date.astimezone(timezone.utc).replace(microsecond=0).isoformat()
+
+def _serialize_user(user: User, tags: list[str]) -> dict:
+  return {
+    "id": user.id,
+    "nickname": user.nickname,
+    "joined_at": _format_date(user.joined_at),
+    "tags": tags,
+  }
+
+def _serialize_tag(tag: Tag, users: list[int]) -> dict:
+  return {"id": tag.id, "name": tag.name, "users": users}
+
+def _serialize_access_key(access_key: AccessKey) -> dict:
+  return {
+    "id": access_key.id,
+    "outline_id": access_key.outline_id,
+    "user_id": access_key.owner and access_key.owner.id,
+    "user": access_key.owner and access_key.owner.nickname,
+    "name": access_key.name,
+    "port": access_key.port,
+    "method": access_key.method,
+    "access_url": access_key.access_url,
+    "data_usage": int(access_key.data_usage),
+    "data_limit": int(access_key.data_limit) if access_key.data_limit is not None else None,
+    "expires_at": _format_date(access_key.expires_at),
+    "server": access_key.server,
+  }
+
+
+class AdminAPI:
+  def __init__(self, db: DB, vpn: VPNManager = None) -> None:
+    self.db = db
+    self.vpn = vpn
+    self._routes: dict[str, dict[str, Callable]] = {
+      "users": {
+        "GET": self.list_users, "POST": self.create_users,
+        "PATCH": self.patch_users, "DELETE": self.delete_users,
+      },
+      "tags": {
+        "GET": self.list_tags, "POST": self.create_tags,
+        "PATCH": self.patch_tags, "DELETE": self.delete_tags,
+      },
+      "access-keys": {
+        "GET": self.list_access_keys, "POST": self.create_access_keys,
+        "PATCH": self.patch_access_keys, "DELETE": self.delete_access_keys,
+      },
+    }
+
+  async def handle(self, path: str, method: str, query: dict[str, str], body: Any) -> tuple[dict, int]:
+    resource = path.removeprefix(API_PATH).strip("/")
+    try:
+      result, code = await self._handle(resource, method, query, body), 200
+    except APIError as e:
+      result, code = {"error": str(e)}, e.code
+    except (ValueError, TypeError, KeyError) as e:
+      result, code = {"error": str(e) or type(e).__name__}, 400
+    except (HTTPError, OSError) as e:
+      result, code = {"error": f"the Outline Server is unavailable: {e}"}, 502
+
+    _API_REQUESTS.inc(resource if resource in self._routes else "unknown", method, str(code))
+    return result, code
+
+  async def _handle(self, resource: str, method: str, query: dict[str, str], body: Any) -> dict:
+    handlers = self._routes.get(resource)
+    if handlers is None:
+      raise APIError(f"unknown resource: '{resource}'", 404)
+
+    handler = handlers.get(method)
+    if handler is None:
+      raise APIError(f"method not allowed: '{method}'", 405)
+
+    if resource == "access-keys" and not self.vpn:
+      raise APIError("the Outline Server is not configured", 503)
+
+    if method == "GET":
+      return await handler(query.get("cursor") or None, self._get_page_size(query))
+
+    items = body.get("items") if isinstance(body, dict) else None
+    if not isinstance(items, list) or not all(isinstance(x, dict) for x in items):
+      raise APIError("the request body must be an object with an 'items' array of objects")
+    if len(items) > _MAX_BATCH_SIZE:
+      raise APIError(f"too many items: at most {_MAX_BATCH_SIZE} are allowed per batch", 413)
+
+    results, errors = await handler(items)
+    return {"items": results, "errors": errors}
+
+  def _get_page_size(self, query: dict[str, str]) -> int:
+    try:
+      limit = _parse_int(query.get("limit", _DEFAULT_PAGE_SIZE), "limit")
+    except ValueError as e:
+      raise APIError(str(e)) from None
+    return min(max(limit, 1), _MAX_PAGE_SIZE)
+
+  def _parse_cursor(self, cursor: str | None, parse: Callable[[str], Any]) -> Any:
+    try:
+      return cursor and parse(cursor)
+    except ValueError:
+      raise APIError(f"invalid cursor: '{cursor}'") from None
+
+  def _get_user_tags(self, ids: list[int]) -> dict[int, list[str]]:
+    tag_names = {x.id: x.name for x in self.db.tags.get_all()}
+    user_tags = {x: [] for x in ids}
+    for user_tag in self.db.user_tags.get_all_by_users(ids):
+      user_tags[user_tag.user_id].append(tag_names[user_tag.tag_id])
+    return user_tags
+
+  async def list_users(self, cursor: str | None, limit: int) -> dict:
+    users = self.db.users.get_page(self._parse_cursor(cursor, int), limit)
+    user_tags = self._get_user_tags([x.id for x in users])
+    return {
+      "items": [_serialize_user(x, user_tags[x.id]) for x in users],
+      "cursor": str(users[-1].id) if len(users) == limit else None,
+    }
+
+  async def create_users(self, items: list[dict]) -> BatchResult:
+    results, errors = [None] * len(items), []
+    with self.db.transaction():
+      for i, item in enumerate(items):
+        try:
+          id = _parse_int(item.get("id"), "user id")
+          nickname = _parse_str(item.get("nickname", str(id)), "nickname")
+          joined_at = _parse_date(item.get("joined_at"), "date")
+          if id <= 0 or self.db.users.get(id):
+            raise ValueError(f"invalid user: '{id}'")
+          if self.db.users.get(nickname):
+            raise ValueError(f"nickname is already taken: '{nickname}'")
+        except ValueError as e:
+          errors.append({"index": i, "error": str(e)})
+          continue
+
+        results[i] = _serialize_user(self.db.users.create(id, nickname, joined_at), [])
+    return results, errors
+
+  async def patch_users(self, items: list[dict]) -> BatchResult:
+    results, errors = [None] * len(items), []
+    with self.db.transaction():
+      for i, item in enumerate(items):
+        try:
+          user = self.db.users.get(item.get("user"))
+          nickname = item.get("nickname") and _parse_str(item["nickname"], "nickname")
+          joined_at = _parse_date(item.get("joined_at"), "date")
+          if not user:
+            raise ValueError(f"invalid user: '{item.get('user')}'")
+          taken_by = nickname and self.db.users.get(nickname)
+          if taken_by and taken_by.id != user.id:
+            raise ValueError(f"nickname is already taken: '{nickname}'")
+        except ValueError as e:
+          errors.append({"index": i, "error": str(e)})
+          continue
+
+        self.db.users.update(user.id, nickname=nickname, joined_at=joined_at)
+        results[i] = _serialize_user(self.db.users.get(user.id), [])
+
+      user_tags = self._get_user_tags([x["id"] for x in results if x])
+      for result in filter(None, results):
+        result["tags"] = user_tags[result["id"]]
+    return results, errors
+
+  async def delete_users(self, items: list[dict]) -> BatchResult:
+    results, errors, users, user_ids = [None] * len(items), [], {}, set()
+    for i, item in enumerate(items):
+      user = self.db.users.get(item.get("user"))
+      if not user or user.id <= 0:
+        errors.append({"index": i, "error": f"invalid user: '{item.get('user')}'"})
+      elif user.id in user_ids:
+        errors.append({"index": i, "error": f"duplicate user: '{item.get('user')}'"})
+      else:
+        users[i] = user
+        user_ids.add(user.id)
+
+    def delete_users() -> None:
+      for i, user in users.items():
+        self.db.users.delete(user.id)
+        results[i] = {"id": user.id, "nickname": user.nickname}
+
+    if self.vpn:
+      db_keys = [y for x in users.values() for y in self.db.access_keys.get_all_by_user(x.id)]
+      await self.vpn.delete_access_key_batch([(x.user_id, x.id) for x in db_keys], before_commit=delete_users)
+    else:
+      with self.db.transaction():
+        delete_users()
+    return results, errors
+
+  async def list_tags(self, cursor: str | None, limit: int) -> dict:
+    tags = self.db.tags.get_page(self._parse_cursor(cursor, int), limit)
+    return {
+      "items": [_serialize_tag(x, [y.user_id for y in self.db.user_tags.get_all_by_tag(x.id)]) for x in tags],
+      "cursor": str(tags[-1].id) if len(tags) == limit else None,
+    }
+
+  async def create_tags(self, items: list[dict]) -> BatchResult:
+    results, errors = [None] * len(items), []
+    with self.db.transaction():
+      for i, item in enumerate(items):
+        try:
+          name = _parse_str(item.get("name"), "tag")
+          users = self._get_user_ids(item.get("users", []))
+          if self.db.tags.get(name):
+            raise ValueError(f"tag already exists: '{name}'")
+        except ValueError as e:
+          errors.append({"index": i, "error": str(e)})
+          continue
+
+        tag = self.db.tags.create(name)
+        for user in users:
+          self.db.user_tags.create(user, tag.id)
+        results[i] = _serialize_tag(tag, users)
+    return results, errors
+
+  async def patch_tags(self, items: list[dict]) -> BatchResult:
+    results, errors = [None] * len(items), []
+    with self.db.transaction():
+      for i, item in enumerate(items):
+        try:
+          tag = self.db.tags.get(_parse_str(item.get("name"), "tag"))
+          added_users = self._get_user_ids(item.get("add", []))
+          removed_users = self._get_user_ids(item.get("remove", []))
+          if not tag:
+            raise ValueError(f"invalid tag: '{item.get('name')}'")
+        except ValueError as e:
+          errors.append({"index": i, "error": str(e)})
+          continue
+
+        for user in added_users:
+          self.db.user_tags.create(user, tag.id)
+        for user in removed_users:
+          self.db.user_tags.delete(user, tag.id)
+        results[i] = _serialize_tag(tag, [x.user_id for x in self.db.user_tags.get_all_by_tag(tag.id)])
+    return results, errors
+
+  async def delete_tags(self, items: list[dict]) -> BatchResult:
+    results, errors = [None] * len(items), []
+    with self.db.transaction():
+      for i, item in enumerate(items):
+        tag = self.db.tags.get(item.get("name"))
+        if not tag or tag.name in _RESERVED_TAGS:
+          errors.append({"index": i, "error": f"invalid tag: '{item.get('name')}'"})
+          continue
+
+        self.db.tags.delete(tag.id)
+        results[i] = {"id": tag.id, "name": tag.name}
+    return results, errors
+
+  def _get_user_ids(self, users: Any) -> list[int]:
+    if not isinstance(users, list):
+      raise ValueError(f"invalid user list: '{users}'")
+
+    ids = [self.db.users.get_id(x) if isinstance(x, (int, str)) else None for x in users]
+    invalid_user = next((x for x, y in zip(users, ids) if y is None or not self.db.users.get(y)), None)
+    if invalid_user is not None:
+      raise ValueError(f"invalid user: '{invalid_user}'")
+    return list(dict.fromkeys(ids))
+
+  async def list_access_keys(self, cursor: str | None, limit: int) -> dict:
+    after = self._parse_cursor(cursor, _parse_access_key_cursor)
+    access_keys, next_cursor = await self.vpn.get_access_key_page(after, limit)
+    return {
+      "items": [_serialize_access_key(x) for x in access_keys],
+      "cursor": next_cursor and f"{next_cursor[0]}:{next_cursor[1]}",
+    }
+
+  async def create_access_keys(self, items: list[dict]) -> BatchResult:
+    results, errors, requests = [None] * len(items), [], {}
+    for i, item in enumerate(items):
+      try:
+        user = self.db.users.get(item.get("user", "_"))
+        if not user:
+          raise ValueError(f"invalid user: '{item.get('user')}'")
+        requests[i] = AccessKeyRequest(
+          user=user,
+          name=item.get("name") and _parse_str(item["name"], "name"),
+          password=item.get("password") and _parse_str(item["password"], "password"),
+          port=item.get("port") and _parse_int(item["port"], "port"),
+          method=item.get("method") and _parse_str(item["method"], "method"),
+          data_limit=_parse_data_limit(item.get("data_limit")),
+          expires_at=_parse_date(item.get("expires_at"), "date"),
+        )
+      except ValueError as e:
+        errors.append({"index": i, "error": str(e)})
+
+    access_keys = await self.vpn.create_access_key_batch(list(requests.values()))
+    for i, access_key in zip(requests, access_keys):
+      if access_key:
+        results[i] = _serialize_access_key(access_key)
+      else:
+        errors.append({"index": i, "error": "could not create the access key on the Outline Server"})
+    errors.sort(key=lambda x: x["index"])
+    return results, errors
+
+  async def patch_access_keys(self, items: list[dict]) -> BatchResult:
+    results, errors, patches = [None] * len(items), [], {}
+    for i, item in enumerate(items):
+      try:
+        patches[i] = AccessKeyPatch(
+          user=item.get("user", "_"),
+          id=_parse_str(item.get("id"), "access key"),
+          name=item.get("name") and _parse_str(item["name"], "name"),
+          data_limit=_parse_data_limit(item.get("data_limit")),
+          expires_at=_parse_date(item["expires_at"], "date") if "expires_at" in item else ...,
+        )
+      except ValueError as e:
+        errors.append({"index": i, "error": str(e)})
+
+    patched = await self.vpn.patch_access_key_batch(list(patches.values()))
+    for (i, patch), success in zip(patches.items(), patched):
+      if success:
+        results[i] = {"user": patch.user, "id": patch.id}
+      else:
+        errors.append({"index": i, "error": f"invalid access key: '{patch.user}:{patch.id}'"})
+    errors.sort(key=lambda x: x["index"])
+    return results, errors
+
+  async def delete_access_keys(self, items: list[dict]) -> BatchResult:
+    results, errors, keys = [None] * len(items), [], {}
+    for i, item in enumerate(items):
+      try:
+        keys[i] = (item.get("user", "_"), _parse_str(item.get("id"), "access key"))
+      except ValueError as e:
+        errors.append({"index": i, "error": str(e)})
+
+    deleted = await self.vpn.delete_access_key_batch(list(keys.values()))
+    for (i, (user, id)), success in zip(keys.items(), deleted):
+      if success:
+        results[i] = {"user": user, "id": id}
+      else:
+        errors.append({"index": i, "error": f"invalid access key: '{user}:{id}'"})
+    errors.sort(key=lambda x: x["index"])
+    return results, errors
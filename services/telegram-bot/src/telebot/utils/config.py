@@ -18,9 +18,21 @@ class BotConfig(BaseConfig):
   api_url: str = ""
   api_address: str = ""
   api_port: int = 80
+  api_token: str = ""
   webhook_url: str = ""
   webhook_address: str = ""
   webhook_port: int = 8080
+  telegram_api_url: str = ""
+  concurrent_updates: int = 16
+  trace_sample_rate: float = 0.1
+  trace_threshold: float = 1.0
+
+@dataclass
+class OutlineServerConfig(BaseConfig):
+  name: str = ""
+  api_url: str = ""
+  cert_sha256: str = ""
+  access_config: str = ""
 
 @dataclass
 class OutlineConfig(BaseConfig):
@@ -28,6 +40,15 @@ class OutlineConfig(BaseConfig):
   cert_sha256: str = ""
   access_config: str = ""
   prefer_localhost: bool = True
+  reconcile_interval: int = 60 * 60
+  reconcile_fix: bool = False
+  transfer_sample_interval: int = 60
+  data_limit_action: str = "notify"
+  data_limit_extension: str = "10 GB"
+  servers: list[OutlineServerConfig] = None
+
+  def __post_init__(self) -> None:
+    self.servers = [OutlineServerConfig.from_dict(x) for x in self.servers or []]
 
 @dataclass
 class MailConfig(BaseConfig):
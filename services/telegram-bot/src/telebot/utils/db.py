@@ -1,9 +1,20 @@
+import asyncio
 import base64
+import json
 import sqlite3
+import threading
 import uuid
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Any, ClassVar
+from utils.metrics import histogram
+from utils.trace import span
+
+_QUERY_DURATION = histogram(
+  "telebot_db_query_duration_seconds", "Time spent executing SQLite queries.", ("operation",),
+  buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
 
 def _unwrap(value: int | str | Any) -> int | str:
   if isinstance(value, int):
@@ -23,6 +34,12 @@ def _format_date(date: datetime | None) -> str | None:
     return None
   return date.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
+def _current_task() -> asyncio.Task | None:
+  try:
+    return asyncio.current_task()
+  except RuntimeError:
+    return None
+
 def _parse_date(date: str | datetime | None) -> datetime | None:
   if date is None:
     return None
@@ -34,31 +51,79 @@ class DB:
   def __init__(self, database: str) -> None:
     self.connection = sqlite3.connect(database, check_same_thread=False)
     self.connection.row_factory = sqlite3.Row
+    self._lock = threading.RLock()
+    self._depth = 0
+    self._owner: asyncio.Task | None = None
     self.users = self._repository(UserRepository)
     self.tags = self._repository(TagRepository)
     self.user_tags = self._repository(UserTagRepository)
     self.access_keys = self._repository(AccessKeyRepository)
+    self.mirrors = self._repository(MirrorRepository)
+    self.outbox = self._repository(OutboxRepository)
+    self.transfer = self._repository(TransferRepository)
+    self.usage_alerts = self._repository(UsageAlertRepository)
 
   def _repository(self, cls):
     repository = cls(self)
     repository.initialize()
     return repository
 
+  # Tasks share the thread, and thus the lock, so a transaction body must never await.
+  def _check_owner(self) -> None:
+    if self._depth and self._owner is not _current_task():
+      raise RuntimeError("the database is used by another task in the middle of a transaction")
+
+  @contextmanager
+  def transaction(self):
+    with self._lock:
+      self._check_owner()
+      self._depth += 1
+      self._owner = _current_task()
+      try:
+        yield self
+      except:
+        if self._depth == 1:
+          self.connection.rollback()
+        raise
+      else:
+        if self._depth == 1:
+          self.connection.commit()
+      finally:
+        self._depth -= 1
+
   def exec(self, query: str, params: tuple = ()) -> int:
-    cursor = self.connection.execute(query, params)
-    cursor.connection.commit()
-    return cursor.rowcount
+    with span("db.exec"), self._lock, _QUERY_DURATION.time("exec"):
+      self._check_owner()
+      cursor = self.connection.execute(query, params)
+      if not self._depth:
+        cursor.connection.commit()
+      return cursor.rowcount
+
+  def exec_many(self, query: str, params: list[tuple]) -> int:
+    with span("db.exec_many"), self._lock, _QUERY_DURATION.time("exec_many"):
+      self._check_owner()
+      cursor = self.connection.executemany(query, params)
+      if not self._depth:
+        cursor.connection.commit()
+      return cursor.rowcount
 
   def get(self, query: str, params: tuple = (), cls = dict):
-    cursor = self.connection.execute(query, params)
-    row = cursor.fetchone()
+    with span("db.get"), self._lock, _QUERY_DURATION.time("get"):
+      self._check_owner()
+      cursor = self.connection.execute(query, params)
+      row = cursor.fetchone()
     return cls(**row) if row is not None else None
 
   def get_all(self, query: str, params: tuple = (), cls = dict):
-    cursor = self.connection.execute(query, params)
-    rows = cursor.fetchall()
+    with span("db.get_all"), self._lock, _QUERY_DURATION.time("get_all"):
+      self._check_owner()
+      cursor = self.connection.execute(query, params)
+      rows = cursor.fetchall()
     return [cls(**row) for row in rows]
 
+  def ping(self) -> bool:
+    return self.get("SELECT 1 AS ok") is not None
+
   def close(self) -> None:
     self.connection.close()
 
@@ -70,6 +135,17 @@ class Repository:
   def initialize(self) -> None:
     pass
 
+  def _get_columns(self, table: str) -> set[str]:
+    return {x["name"] for x in self.db.get_all(f'PRAGMA table_info("{table}")')}
+
+  def _rebuild_table(self, table: str, schema: str) -> None:
+    columns = ", ".join(f'"{x}"' for x in self._get_columns(table))
+    with self.db.transaction():
+      self.db.exec(f'ALTER TABLE "{table}" RENAME TO "{table}_old"')
+      self.db.exec(schema)
+      self.db.exec(f'INSERT INTO "{table}" ({columns}) SELECT {columns} FROM "{table}_old"')
+      self.db.exec(f'DROP TABLE "{table}_old"')
+
 
 @dataclass
 class User:
@@ -118,6 +194,12 @@ class UserRepository(Repository):
       ids, User
     )
 
+  def get_page(self, after: int | None = None, limit: int = 100) -> list[User]:
+    return self.db.get_all(
+      "SELECT * FROM users WHERE id > ? ORDER BY id LIMIT ?",
+      (after if after is not None else -2**63, limit), User
+    )
+
   def get_id(self, user: UserLike) -> int | None:
     user = _unwrap(user)
     if isinstance(user, int):
@@ -142,6 +224,30 @@ class UserRepository(Repository):
       (nickname, _format_date(joined_at), current_user.id)
     ) > 0
 
+  def upsert_all(self, users: list[User]) -> int:
+    if not users:
+      return 0
+
+    pattern = ",".join("?" * len(users))
+    taken_nicknames = {
+      x.nickname: x.id for x in self.db.get_all(
+        f"SELECT * FROM users WHERE nickname IN ({pattern})",
+        [x.nickname for x in users], User
+      )
+    }
+    return self.db.exec_many(
+      """
+        INSERT INTO users (id, nickname, joined_at) VALUES (?, ?, ?)
+        ON CONFLICT("id") DO UPDATE SET nickname = excluded.nickname, joined_at = excluded.joined_at
+      """,
+      [
+        (
+          x.id, x.nickname if taken_nicknames.get(x.nickname, x.id) == x.id else str(x.id),
+          _format_date(x.joined_at or datetime.now(timezone.utc)),
+        ) for x in users
+      ]
+    )
+
   def delete(self, user: UserLike) -> bool:
     user = _unwrap(user)
     column = "id" if isinstance(user, int) else "nickname"
@@ -192,6 +298,22 @@ class TagRepository(Repository):
   def get_all(self) -> list[Tag]:
     return self.db.get_all("SELECT * FROM tags", (), Tag)
 
+  def get_page(self, after: int | None = None, limit: int = 100) -> list[Tag]:
+    return self.db.get_all(
+      "SELECT * FROM tags WHERE id > ? ORDER BY id LIMIT ?",
+      (after if after is not None else -2**63, limit), Tag
+    )
+
+  def get_all_by_user(self, user: UserLike) -> list[Tag]:
+    uid = self.db.users.get_id(user)
+    if uid is None:
+      return []
+
+    return self.db.get_all(
+      "SELECT tags.* FROM tags JOIN user_tags ON user_tags.tag_id = tags.id WHERE user_tags.user_id = ?",
+      (uid,), Tag
+    )
+
   def delete(self, tag: TagLike) -> bool:
     tag = _unwrap(tag)
     column = "id" if isinstance(tag, int) else "name"
@@ -240,16 +362,35 @@ class UserTagRepository(Repository):
       (uid, tid), UserTag
     )
 
-  def get_all_by_tag(self, tag: TagLike) -> list[UserTag]:
+  def get_all_by_tag(self, tag: TagLike) -> list[UserTag] | None:
     tid = self.db.tags.get_id(tag)
     if tid is None:
-      return False
+      return None
 
     return self.db.get_all(
       "SELECT * FROM user_tags WHERE tag_id = ?",
       (tid,), UserTag
     )
 
+  def get_all_by_users(self, ids: list[int]) -> list[UserTag]:
+    pattern = ",".join("?" * len(ids))
+    return self.db.get_all(
+      f"SELECT * FROM user_tags WHERE user_id IN ({pattern})",
+      ids, UserTag
+    )
+
+  def get_page(self, after: tuple[int, int] | None = None, limit: int = 100) -> list[UserTag]:
+    return self.db.get_all(
+      "SELECT * FROM user_tags WHERE (user_id, tag_id) > (?, ?) ORDER BY user_id, tag_id LIMIT ?",
+      (*(after or (-2**63, -2**63)), limit), UserTag
+    )
+
+  def create_all(self, user_tags: list[UserTag]) -> int:
+    return self.db.exec_many(
+      "INSERT OR IGNORE INTO user_tags (user_id, tag_id) VALUES (?, ?)",
+      [(x.user_id, x.tag_id) for x in user_tags]
+    )
+
   def exists(self, user: UserLike, tag: TagLike) -> bool:
     uid = self.db.users.get_id(user)
     tid = self.db.tags.get_id(tag)
@@ -279,6 +420,8 @@ class AccessKey:
   user_id: int
   outline_id: str
   expires_at: datetime | None
+  server: str = ""
+  updated_at: datetime | None = None
 
   @property
   def is_expired(self) -> bool:
@@ -288,6 +431,7 @@ class AccessKey:
 
   def __post_init__(self):
     self.expires_at = _parse_date(self.expires_at)
+    self.updated_at = _parse_date(self.updated_at)
 
 class AccessKeyRepository(Repository):
   def initialize(self) -> None:
@@ -297,20 +441,30 @@ class AccessKeyRepository(Repository):
         "user_id" INTEGER NOT NULL,
         "outline_id" TEXT NOT NULL,
         "expires_at" TEXT DEFAULT NULL,
+        "server" TEXT NOT NULL DEFAULT '',
+        "updated_at" TEXT DEFAULT NULL,
         PRIMARY KEY("id","user_id"),
         FOREIGN KEY("user_id") REFERENCES "users"("id")
           ON DELETE CASCADE ON UPDATE CASCADE
       )
     """)
+    columns = self._get_columns("access_keys")
+    if "server" not in columns:
+      self.db.exec('ALTER TABLE "access_keys" ADD COLUMN "server" TEXT NOT NULL DEFAULT \'\'')
+    if "updated_at" not in columns:
+      self.db.exec('ALTER TABLE "access_keys" ADD COLUMN "updated_at" TEXT DEFAULT NULL')
 
-  def create(self, user: UserLike, outline_id: str, expires_at: datetime = None) -> AccessKey:
+  def create(self, user: UserLike, outline_id: str, expires_at: datetime = None, server: str = "") -> AccessKey:
     id = base64.b64encode(uuid.uuid4().bytes, b"-_")[:22].decode("utf-8")
     uid = self.db.users.get_id(user)
+    updated_at = datetime.now(timezone.utc)
     self.db.exec(
-      "INSERT INTO access_keys (id, user_id, outline_id, expires_at) VALUES (?, ?, ?, ?)",
-      (id, uid, outline_id, _format_date(expires_at))
+      "INSERT INTO access_keys (id, user_id, outline_id, expires_at, server, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+      (id, uid, outline_id, _format_date(expires_at), server, _format_date(updated_at))
+    )
+    return AccessKey(
+      id=id, user_id=uid, outline_id=outline_id, expires_at=expires_at, server=server, updated_at=updated_at,
     )
-    return AccessKey(id=id, user_id=uid, outline_id=outline_id, expires_at=expires_at)
 
   def get(self, user: UserLike, id: str) -> AccessKey | None:
     uid = self.db.users.get_id(user)
@@ -328,6 +482,12 @@ class AccessKeyRepository(Repository):
       (), AccessKey
     )
 
+  def get_page(self, after: tuple[int, str] | None = None, limit: int = 100) -> list[AccessKey]:
+    return self.db.get_all(
+      "SELECT * FROM access_keys WHERE (user_id, id) > (?, ?) ORDER BY user_id, id LIMIT ?",
+      (*(after or (-2**63, "")), limit), AccessKey
+    )
+
   def get_all_by_user(self, user: UserLike) -> list[AccessKey]:
     uid = self.db.users.get_id(user)
     if uid is None:
@@ -338,6 +498,22 @@ class AccessKeyRepository(Repository):
       (uid,), AccessKey
     )
 
+  def get_by_outline_id(self, server: str, outline_id: str) -> AccessKey | None:
+    return self.db.get(
+      "SELECT * FROM access_keys WHERE server = ? AND outline_id = ?",
+      (server, outline_id), AccessKey
+    )
+
+  def get_all_by_outline_ids(self, outline_ids: list[tuple[str, str]]) -> list[AccessKey]:
+    if not outline_ids:
+      return []
+
+    pattern = ",".join(["(?, ?)"] * len(outline_ids))
+    return self.db.get_all(
+      f"SELECT * FROM access_keys WHERE (server, outline_id) IN (VALUES {pattern})",
+      tuple(y for x in outline_ids for y in x), AccessKey
+    )
+
   def get_all_expired(self) -> list[AccessKey]:
     return self.db.get_all(
       "SELECT * FROM access_keys WHERE expires_at <= CURRENT_TIMESTAMP",
@@ -366,3 +542,319 @@ class AccessKeyRepository(Repository):
       "DELETE FROM access_keys WHERE id = ? and user_id = ?",
       (id, uid)
     ) > 0
+
+  def upsert_all(self, access_keys: list[AccessKey]) -> int:
+    return self.db.exec_many(
+      """
+        INSERT INTO access_keys (id, user_id, outline_id, expires_at, server, updated_at)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT("id", "user_id") DO UPDATE SET
+          outline_id = excluded.outline_id, expires_at = excluded.expires_at, server = excluded.server,
+          updated_at = excluded.updated_at
+      """,
+      [(x.id, x.user_id, x.outline_id, _format_date(x.expires_at), x.server) for x in access_keys]
+    )
+
+  def update_outline_ids(self, outline_ids: dict[tuple[str, str], str]) -> int:
+    return self.db.exec_many(
+      "UPDATE access_keys SET outline_id = ?, updated_at = CURRENT_TIMESTAMP WHERE server = ? AND outline_id = ?",
+      [(new_id, server, old_id) for (server, old_id), new_id in outline_ids.items()]
+    )
+
+  def delete_all_by_outline_ids(self, outline_ids: list[tuple[str, str]]) -> int:
+    if not outline_ids:
+      return 0
+
+    pattern = ",".join(["(?, ?)"] * len(outline_ids))
+    return self.db.exec(
+      f"DELETE FROM access_keys WHERE (server, outline_id) IN (VALUES {pattern})",
+      tuple(y for x in outline_ids for y in x)
+    )
+
+  def set_default_server(self, server: str) -> int:
+    return self.db.exec("UPDATE access_keys SET server = ? WHERE server = ''", (server,))
+
+
+@dataclass
+class Mirror:
+  address: str
+  url: str
+  fetched_at: datetime
+  accessed_at: datetime
+
+  def __post_init__(self):
+    self.fetched_at = _parse_date(self.fetched_at)
+    self.accessed_at = _parse_date(self.accessed_at)
+
+class MirrorRepository(Repository):
+  def initialize(self) -> None:
+    self.db.exec("""
+      CREATE TABLE IF NOT EXISTS "mirrors" (
+        "address" TEXT NOT NULL UNIQUE,
+        "url" TEXT NOT NULL,
+        "fetched_at" TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        "accessed_at" TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY("address")
+      )
+    """)
+
+  def set(self, address: str, url: str, fetched_at: datetime = None) -> Mirror:
+    fetched_at = fetched_at or datetime.now(timezone.utc)
+    self.db.exec(
+      "INSERT INTO mirrors (address, url, fetched_at, accessed_at) VALUES (?, ?, ?, ?) "
+      "ON CONFLICT (address) DO UPDATE SET url = excluded.url, fetched_at = excluded.fetched_at",
+      (address, url, _format_date(fetched_at), _format_date(fetched_at))
+    )
+    return self.get(address)
+
+  def get(self, address: str) -> Mirror | None:
+    return self.db.get("SELECT * FROM mirrors WHERE address = ?", (address,), Mirror)
+
+  def get_all_stale(self, fetched_before: datetime, accessed_after: datetime) -> list[Mirror]:
+    return self.db.get_all(
+      "SELECT * FROM mirrors WHERE fetched_at <= ? AND accessed_at >= ? ORDER BY fetched_at",
+      (_format_date(fetched_before), _format_date(accessed_after)), Mirror
+    )
+
+  def touch(self, address: str, accessed_at: datetime = None) -> bool:
+    accessed_at = accessed_at or datetime.now(timezone.utc)
+    return self.db.exec(
+      "UPDATE mirrors SET accessed_at = ? WHERE address = ?",
+      (_format_date(accessed_at), address)
+    ) > 0
+
+  def trim(self, max_count: int) -> int:
+    return self.db.exec(
+      "DELETE FROM mirrors WHERE address NOT IN (SELECT address FROM mirrors ORDER BY accessed_at DESC, rowid DESC LIMIT ?)",
+      (max_count,)
+    )
+
+  def delete(self, address: str) -> bool:
+    return self.db.exec("DELETE FROM mirrors WHERE address = ?", (address,)) > 0
+
+
+@dataclass
+class OutboxEntry:
+  CREATE_ACCESS_KEY: ClassVar[str] = "create_access_key"
+  PATCH_ACCESS_KEY: ClassVar[str] = "patch_access_key"
+  DELETE_ACCESS_KEY: ClassVar[str] = "delete_access_key"
+
+  id: int
+  operation: str
+  target: str
+  payload: dict
+  attempts: int
+  available_at: datetime
+  last_error: str | None
+
+  def __post_init__(self):
+    self.available_at = _parse_date(self.available_at)
+    if isinstance(self.payload, str):
+      self.payload = json.loads(self.payload)
+
+class OutboxRepository(Repository):
+  def initialize(self) -> None:
+    self.db.exec("""
+      CREATE TABLE IF NOT EXISTS "outbox" (
+        "id" INTEGER NOT NULL UNIQUE,
+        "operation" TEXT NOT NULL,
+        "target" TEXT NOT NULL,
+        "payload" TEXT NOT NULL DEFAULT '{}',
+        "attempts" INTEGER NOT NULL DEFAULT 0,
+        "available_at" TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        "last_error" TEXT DEFAULT NULL,
+        PRIMARY KEY("id" AUTOINCREMENT)
+      )
+    """)
+
+  def create(self, operation: str, target: str, payload: dict = None, available_at: datetime = None) -> OutboxEntry:
+    payload = payload or {}
+    available_at = available_at or datetime.now(timezone.utc)
+    with self.db.transaction():
+      self.db.exec(
+        "INSERT INTO outbox (operation, target, payload, available_at) VALUES (?, ?, ?, ?)",
+        (operation, target, json.dumps(payload), _format_date(available_at))
+      )
+      id = self.db.get("SELECT last_insert_rowid() AS id")["id"]
+    return OutboxEntry(
+      id=id, operation=operation, target=target, payload=payload,
+      attempts=0, available_at=available_at, last_error=None,
+    )
+
+  def get_all_available(self, limit: int = 100) -> list[OutboxEntry]:
+    return self.db.get_all(
+      "SELECT * FROM outbox WHERE available_at <= ? AND NOT EXISTS "
+      "(SELECT 1 FROM outbox AS previous WHERE previous.target = outbox.target AND previous.id < outbox.id) "
+      "ORDER BY id LIMIT ?",
+      (_format_date(datetime.now(timezone.utc)), limit), OutboxEntry
+    )
+
+  def get_targets(self, operation: str) -> set[tuple[str, str]]:
+    rows = self.db.get_all("SELECT target, payload FROM outbox WHERE operation = ?", (operation,))
+    return {(json.loads(x["payload"]).get("server") or "", x["target"]) for x in rows}
+
+  def count(self) -> int:
+    return self.db.get("SELECT COUNT(*) AS count FROM outbox")["count"]
+
+  def exists(self, id: int) -> bool:
+    return self.db.get("SELECT 1 FROM outbox WHERE id = ?", (id,)) is not None
+
+  def reschedule(self, id: int, available_at: datetime, error: str = None) -> bool:
+    return self.db.exec(
+      "UPDATE outbox SET attempts = attempts + 1, available_at = ?, last_error = ? WHERE id = ?",
+      (_format_date(available_at), error, id)
+    ) > 0
+
+  def delete(self, id: int) -> bool:
+    return self.db.exec("DELETE FROM outbox WHERE id = ?", (id,)) > 0
+
+
+class TransferRepository(Repository):
+  MINUTE: ClassVar[int] = 60
+  HOUR: ClassVar[int] = 60 * 60
+  DAY: ClassVar[int] = 24 * 60 * 60
+  RETENTION: ClassVar[dict[int, int]] = {MINUTE: 2 * DAY, HOUR: 35 * DAY, DAY: 400 * DAY}
+
+  def __init__(self, db: DB) -> None:
+    super().__init__(db)
+    self._counters: dict[tuple[str, str], int] | None = None
+
+  def initialize(self) -> None:
+    counters_schema = """
+      CREATE TABLE IF NOT EXISTS "transfer_counters" (
+        "server" TEXT NOT NULL DEFAULT '',
+        "outline_id" TEXT NOT NULL,
+        "bytes" INTEGER NOT NULL,
+        "sampled_at" INTEGER NOT NULL,
+        PRIMARY KEY("server","outline_id")
+      ) WITHOUT ROWID
+    """
+    usage_schema = """
+      CREATE TABLE IF NOT EXISTS "transfer_usage" (
+        "resolution" INTEGER NOT NULL,
+        "server" TEXT NOT NULL DEFAULT '',
+        "outline_id" TEXT NOT NULL,
+        "bucket" INTEGER NOT NULL,
+        "bytes" INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY("resolution","server","outline_id","bucket")
+      ) WITHOUT ROWID
+    """
+    for table, schema in (("transfer_counters", counters_schema), ("transfer_usage", usage_schema)):
+      self.db.exec(schema)
+      if "server" not in self._get_columns(table):
+        self._rebuild_table(table, schema)
+
+  def record(
+      self, counters: dict[tuple[str, str], int],
+      sampled_at: datetime = None) -> dict[tuple[str, str], int]:
+    timestamp = int((sampled_at or datetime.now(timezone.utc)).timestamp())
+    previous = self._get_counters()
+    changed = {x: int(y) for x, y in counters.items() if previous.get(x) != int(y)}
+    deltas = []
+    for key, value in changed.items():
+      last_value = previous.get(key)
+      if last_value is None:
+        continue
+      delta = value - last_value if value >= last_value else value
+      if delta > 0:
+        deltas.append((*key, delta))
+
+    with self.db.transaction():
+      self.db.exec_many(
+        "INSERT INTO transfer_counters (server, outline_id, bytes, sampled_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (server, outline_id) DO UPDATE SET bytes = excluded.bytes, sampled_at = excluded.sampled_at",
+        [(server, outline_id, value, timestamp) for (server, outline_id), value in changed.items()]
+      )
+      self.db.exec_many(
+        "INSERT INTO transfer_usage (resolution, server, outline_id, bucket, bytes) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (resolution, server, outline_id, bucket) DO UPDATE SET bytes = bytes + excluded.bytes",
+        [
+          (resolution, server, outline_id, timestamp - timestamp % resolution, delta)
+            for resolution in self.RETENTION
+            for server, outline_id, delta in deltas
+        ]
+      )
+    previous.update(changed)
+    return changed
+
+  def _get_counters(self) -> dict[tuple[str, str], int]:
+    if self._counters is None:
+      rows = self.db.get_all("SELECT server, outline_id, bytes FROM transfer_counters")
+      self._counters = {(x["server"], x["outline_id"]): x["bytes"] for x in rows}
+    return self._counters
+
+  def rename(self, outline_ids: dict[tuple[str, str], str]) -> int:
+    return self.db.exec_many(
+      "UPDATE transfer_usage SET outline_id = ? WHERE server = ? AND outline_id = ?",
+      [(new_id, server, old_id) for (server, old_id), new_id in outline_ids.items()]
+    )
+
+  def set_default_server(self, server: str) -> int:
+    self._counters = None
+    count = self.db.exec("UPDATE transfer_counters SET server = ? WHERE server = ''", (server,))
+    return count + self.db.exec("UPDATE transfer_usage SET server = ? WHERE server = ''", (server,))
+
+  def get_usage(self, since: datetime, until: datetime = None) -> dict[tuple[str, str], int]:
+    since_timestamp = int(since.timestamp())
+    until_timestamp = int((until or datetime.now(timezone.utc)).timestamp())
+    period = until_timestamp - since_timestamp
+    resolution = next((x for x, retention in self.RETENTION.items() if period <= retention), self.DAY)
+    rows = self.db.get_all(
+      "SELECT server, outline_id, SUM(bytes) AS bytes FROM transfer_usage "
+      "WHERE resolution = ? AND bucket >= ? AND bucket < ? GROUP BY server, outline_id",
+      (resolution, since_timestamp - since_timestamp % resolution, until_timestamp)
+    )
+    return {(x["server"], x["outline_id"]): x["bytes"] for x in rows}
+
+  def prune(self, now: datetime = None) -> int:
+    timestamp = int((now or datetime.now(timezone.utc)).timestamp())
+    with self.db.transaction():
+      count = self.db.exec_many(
+        "DELETE FROM transfer_usage WHERE resolution = ? AND bucket < ?",
+        [(resolution, timestamp - retention) for resolution, retention in self.RETENTION.items()]
+      )
+      expired = self.db.exec(
+        "DELETE FROM transfer_counters WHERE sampled_at < ?",
+        (timestamp - self.RETENTION[self.DAY],)
+      )
+    if expired:
+      self._counters = None
+    return count + expired
+
+
+class UsageAlertRepository(Repository):
+  def initialize(self) -> None:
+    schema = """
+      CREATE TABLE IF NOT EXISTS "usage_alerts" (
+        "server" TEXT NOT NULL DEFAULT '',
+        "outline_id" TEXT NOT NULL,
+        "level" INTEGER NOT NULL,
+        PRIMARY KEY("server","outline_id")
+      ) WITHOUT ROWID
+    """
+    self.db.exec(schema)
+    if "server" not in self._get_columns("usage_alerts"):
+      self._rebuild_table("usage_alerts", schema)
+
+  def get_all(self) -> dict[tuple[str, str], int]:
+    rows = self.db.get_all("SELECT server, outline_id, level FROM usage_alerts")
+    return {(x["server"], x["outline_id"]): x["level"] for x in rows}
+
+  def set(self, server: str, outline_id: str, level: int) -> None:
+    if level > 0:
+      self.db.exec(
+        "INSERT INTO usage_alerts (server, outline_id, level) VALUES (?, ?, ?) "
+        "ON CONFLICT (server, outline_id) DO UPDATE SET level = excluded.level",
+        (server, outline_id, level)
+      )
+    else:
+      self.delete(server, outline_id)
+
+  def set_default_server(self, server: str) -> int:
+    return self.db.exec("UPDATE usage_alerts SET server = ? WHERE server = ''", (server,))
+
+  def delete(self, server: str, outline_id: str) -> bool:
+    return self.db.exec(
+      "DELETE FROM usage_alerts WHERE server = ? AND outline_id = ?",
+      (server, outline_id)
+    ) > 0
@@ -0,0 +1,180 @@
+import asyncio
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, TextIO, TypeVar
+from utils.db import DB, AccessKey, User, UserTag
+from utils.outline import OutlineAPIClient, OutlinePool, AccessKey as OutlineAccessKey, DataLimit, HTTPError
+
+T = TypeVar("T")
+
+USER = "user"
+USER_TAG = "user_tag"
+ACCESS_KEY = "access_key"
+
+_RECORD_TYPES = (USER, USER_TAG, ACCESS_KEY)
+_REQUIRED_FIELDS = {
+  USER: ("id", "nickname"),
+  USER_TAG: ("user_id", "tag"),
+  ACCESS_KEY: ("id", "user_id", "outline_id"),
+}
+_BATCH_SIZE = 500
+_RECREATE_CONCURRENCY = 8
+
+@dataclass
+class ImportReport:
+  users: int = 0
+  user_tags: int = 0
+  access_keys: int = 0
+  recreated: int = 0
+  skipped: int = 0
+
+
+def _paginate(get_page: Callable[..., list[T]], get_cursor: Callable[[T], object], batch_size: int) -> Iterator[T]:
+  after = None
+  while True:
+    page = get_page(after, batch_size)
+    yield from page
+    if len(page) < batch_size:
+      return
+    after = get_cursor(page[-1])
+
+def _format_date(date: datetime | None) -> str | None:
+  return date and date.isoformat()
+
+def export_records(
+    db: DB, *, users: set[int] = None,
+    outline_keys: dict[tuple[str, str], OutlineAccessKey] = None,
+    batch_size: int = _BATCH_SIZE) -> Iterator[dict]:
+  selected = (lambda x: x in users) if users is not None else (lambda _: True)
+
+  for user in _paginate(db.users.get_page, lambda x: x.id, batch_size):
+    if selected(user.id):
+      yield {"type": USER, "id": user.id, "nickname": user.nickname, "joined_at": _format_date(user.joined_at)}
+
+  tag_names = {x.id: x.name for x in db.tags.get_all()}
+  for user_tag in _paginate(db.user_tags.get_page, lambda x: (x.user_id, x.tag_id), batch_size):
+    if selected(user_tag.user_id) and user_tag.tag_id in tag_names:
+      yield {"type": USER_TAG, "user_id": user_tag.user_id, "tag": tag_names[user_tag.tag_id]}
+
+  for access_key in _paginate(db.access_keys.get_page, lambda x: (x.user_id, x.id), batch_size):
+    if not selected(access_key.user_id):
+      continue
+
+    record = {
+      "type": ACCESS_KEY, "id": access_key.id, "user_id": access_key.user_id,
+      "outline_id": access_key.outline_id, "expires_at": _format_date(access_key.expires_at),
+      "server": access_key.server,
+    }
+    outline_key = outline_keys and outline_keys.get((access_key.server, access_key.outline_id))
+    if outline_key:
+      record.update({
+        "name": outline_key.name, "password": outline_key.password,
+        "port": outline_key.port, "method": outline_key.method,
+        "data_limit": outline_key.data_limit.bytes if outline_key.data_limit else None,
+      })
+    yield record
+
+def write_records(records: Iterable[dict], file: TextIO) -> int:
+  count = 0
+  for record in records:
+    file.write(json.dumps(record, ensure_ascii=False))
+    file.write("\n")
+    count += 1
+  return count
+
+def read_records(file: TextIO) -> Iterator[dict]:
+  for line_number, line in enumerate(file, 1):
+    line = line.strip()
+    if not line:
+      continue
+
+    try:
+      record = json.loads(line)
+    except ValueError:
+      raise ValueError(f"invalid record on line {line_number}") from None
+    if not isinstance(record, dict) or record.get("type") not in _RECORD_TYPES:
+      raise ValueError(f"invalid record on line {line_number}")
+    if any(record.get(x) is None for x in _REQUIRED_FIELDS[record["type"]]):
+      raise ValueError(f"incomplete record on line {line_number}")
+    yield record
+
+
+class Importer:
+  def __init__(
+      self, db: DB, outline: OutlineAPIClient | OutlinePool = None, *, recreate=False,
+      batch_size: int = _BATCH_SIZE, concurrency: int = _RECREATE_CONCURRENCY) -> None:
+    self.db = db
+    self.outline = outline if outline is None or isinstance(outline, OutlinePool) else OutlinePool({"": outline})
+    self.recreate = recreate and outline is not None
+    self.batch_size = max(batch_size, 1)
+    self.concurrency = max(concurrency, 1)
+    self.report = ImportReport()
+    self._batches: dict[str, list[dict]] = {x: [] for x in _RECORD_TYPES}
+    self._outline_ids: set[tuple[str, str]] = set()
+    self._tag_ids: dict[str, int] = {}
+
+  async def run(self, records: Iterable[dict]) -> ImportReport:
+    if self.recreate:
+      self._outline_ids = {(x.server, x.id) for x in await self.outline.get_access_keys()}
+
+    for record in records:
+      batch = self._batches[record["type"]]
+      batch.append(record)
+      if len(batch) >= self.batch_size:
+        await self.flush()
+    await self.flush()
+    return self.report
+
+  async def flush(self) -> None:
+    users, user_tags, access_keys = (self._batches[x] for x in _RECORD_TYPES)
+    self._batches = {x: [] for x in _RECORD_TYPES}
+
+    with self.db.transaction():
+      self.report.users += self.db.users.upsert_all([self._to_user(x) for x in users])
+      self.report.user_tags += self.db.user_tags.create_all([self._to_user_tag(x) for x in user_tags])
+      self.report.access_keys += self.db.access_keys.upsert_all([self._to_access_key(x) for x in access_keys])
+
+    if self.recreate:
+      await self._recreate([x for x in access_keys if (self._get_server(x), x["outline_id"]) not in self._outline_ids])
+
+  async def _recreate(self, records: list[dict]) -> None:
+    semaphore = asyncio.Semaphore(self.concurrency)
+    async def create(record: dict) -> bool:
+      data_limit = record.get("data_limit")
+      outline_key = OutlineAccessKey(
+        id=record["outline_id"], name=record.get("name"), password=record.get("password"),
+        port=record.get("port"), method=record.get("method"),
+        data_limit=DataLimit(int(data_limit)) if data_limit is not None else None,
+      )
+      async with semaphore:
+        try:
+          return bool(await self.outline.create_access_key(outline_key, self._get_server(record)))
+        except HTTPError:
+          return False
+
+    created = await asyncio.gather(*(create(x) for x in records))
+    self._outline_ids.update((self._get_server(x), x["outline_id"]) for x, y in zip(records, created) if y)
+    self.report.recreated += sum(created)
+    self.report.skipped += len(created) - sum(created)
+
+  def _get_server(self, record: dict) -> str:
+    server = record.get("server") or ""
+    if self.outline is None or server in self.outline.clients:
+      return server
+    return self.outline.primary
+
+  def _to_user(self, record: dict) -> User:
+    return User(id=int(record["id"]), nickname=str(record["nickname"]), joined_at=record.get("joined_at"))
+
+  def _to_user_tag(self, record: dict) -> UserTag:
+    name = str(record["tag"])
+    if name not in self._tag_ids:
+      self._tag_ids[name] = self.db.tags.create(name).id
+    return UserTag(user_id=int(record["user_id"]), tag_id=self._tag_ids[name])
+
+  def _to_access_key(self, record: dict) -> AccessKey:
+    return AccessKey(
+      id=str(record["id"]), user_id=int(record["user_id"]), outline_id=str(record["outline_id"]),
+      expires_at=record.get("expires_at"), server=self._get_server(record),
+    )
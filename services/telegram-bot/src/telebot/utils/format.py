@@ -1,8 +1,17 @@
+import _string
 import html
 import itertools
 import numbers
 import re
 from collections.abc import Iterable, Sized
+from functools import lru_cache
+from operator import attrgetter
+from typing import Any, Callable
+
+_MISSING = object()
+_ESCAPE_PATTERN = re.compile(r"<>(.*?)</>")
+_TYPE_NAMES: dict[type, frozenset[str] | None] = {}
+_ACCESSORS: dict[tuple[type, str, bool], Callable[[Any], Any]] = {}
 
 def _len(obj) -> int:
   if isinstance(obj, numbers.Number):
@@ -13,18 +22,181 @@ def _len(obj) -> int:
     return itertools.count(obj)
   return 1 if obj else 0
 
+def _type_names(cls: type) -> frozenset[str] | None:
+  names = _TYPE_NAMES.get(cls, _MISSING)
+  if names is _MISSING:
+    is_default_dir = cls.__dir__ is object.__dir__
+    names = frozenset(x for x in dir(cls) if not x.startswith("_")) if is_default_dir else None
+    _TYPE_NAMES[cls] = names
+  return names
+
+def _public_names(obj) -> frozenset[str] | set[str]:
+  names = _type_names(type(obj))
+  if names is None:
+    return set(x for x in dir(obj) if not x.startswith("_"))
+
+  instance_names = getattr(obj, "__dict__", None)
+  if instance_names:
+    return names.union(x for x in instance_names if not x.startswith("_"))
+  return names
+
 def _to_dict(obj) -> dict:
   if obj is None or isinstance(obj, (str, numbers.Number)):
     return {}
   if isinstance(obj, dict):
     return obj
-  return dict((x, getattr(obj, x)) for x in dir(obj) if not x.startswith("_"))
+  return dict((x, getattr(obj, x)) for x in _public_names(obj))
 
 def _to_map(obj) -> "FormatMap":
   it = {"_": obj}
   it.update(_to_dict(obj))
   return FormatMap(it)
 
+def _create_accessor(cls: type, key: str, nested: bool) -> Callable[[Any], Any]:
+  if issubclass(cls, dict):
+    if nested and key == "_":
+      return lambda obj: obj.get(key, obj)
+    return lambda obj: obj.get(key, _MISSING)
+
+  if nested and key == "_":
+    return lambda obj: obj
+
+  if cls is type(None) or issubclass(cls, (str, numbers.Number)) or key.startswith("_"):
+    return lambda _: _MISSING
+
+  names = _type_names(cls)
+  if names is None:
+    return lambda obj: getattr(obj, key) if key in dir(obj) else _MISSING
+  if key in names:
+    return attrgetter(key)
+  return lambda obj: getattr(obj, key) if key in getattr(obj, "__dict__", ()) else _MISSING
+
+def _lookup(obj, key: str, nested: bool):
+  accessor = _ACCESSORS.get((type(obj), key, nested))
+  if accessor is None:
+    accessor = _ACCESSORS[(type(obj), key, nested)] = _create_accessor(type(obj), key, nested)
+  return accessor(obj)
+
+
+Renderer = Callable[[Any, bool], str]
+
+def _compile_field(field_name: str, format_spec: str, depth: int = 1) -> Renderer | None:
+  key, path = _string.formatter_field_name_split(field_name)
+  attributes = []
+  for is_attribute, name in path:
+    if not is_attribute or name == "value" or name.startswith("_"):
+      return None
+    attributes.append(name)
+
+  if not isinstance(key, str) or not key:
+    return None
+
+  spec_parts = _compile_parts(format_spec, depth - 1) if format_spec else ()
+  if spec_parts is None:
+    return None
+  elif all(isinstance(x, str) for x in spec_parts):
+    render_value = _compile_format_spec("".join(spec_parts))
+    render_spec = None
+  else:
+    render_value = None
+    render_spec = _join_parts(spec_parts)
+
+  if key.endswith("(#)"):
+    fallback_key, fallback = key[:-3], lambda x: _len(x)
+  elif key.endswith("(s?)"):
+    fallback_key, fallback = key[:-4], lambda x: _len(x) != 1
+  else:
+    fallback_key, fallback = None, None
+
+  def render(obj, nested: bool) -> str:
+    value = _lookup(obj, key, nested)
+    if value is _MISSING and fallback_key is not None:
+      value = _lookup(obj, fallback_key, nested)
+      value = fallback(0 if value is _MISSING else value)
+    elif value is _MISSING:
+      value = ""
+
+    for attribute in attributes:
+      value = getattr(value, attribute, "")
+
+    if render_spec is not None:
+      return _compile_format_spec(render_spec(obj, nested))(value)
+    return render_value(value)
+
+  return render
+
+def _compile_parts(template: str, depth: int) -> tuple[str | Renderer, ...] | None:
+  parts = []
+  for literal, field_name, format_spec, conversion in _string.formatter_parser(template):
+    if literal:
+      parts.append(literal)
+    if field_name is None:
+      continue
+
+    field = depth > 0 and not conversion and _compile_field(field_name, format_spec, depth)
+    if not field:
+      return None
+    parts.append(field)
+  return tuple(parts)
+
+def _join_parts(parts: tuple[str | Renderer, ...]) -> Renderer:
+  if all(isinstance(x, str) for x in parts):
+    text = "".join(parts)
+    return lambda _, __: text
+
+  def render(obj, nested: bool) -> str:
+    return "".join(x if isinstance(x, str) else x(obj, nested) for x in parts)
+  return render
+
+@lru_cache(maxsize=1024)
+def _compile_template(template: str) -> Renderer:
+  try:
+    parts = _compile_parts(template, 2)
+  except ValueError:
+    parts = None
+
+  if parts is None:
+    return lambda obj, nested: template.format_map(_to_map(obj) if nested else FormatMap(obj))
+  return _join_parts(parts)
+
+@lru_cache(maxsize=1024)
+def _compile_format_spec(format_spec: str) -> Callable[[Any], str]:
+  if not format_spec:
+    return str
+
+  custom_format = format_spec[0]
+
+  if custom_format == "?":
+    render = _compile_template(format_spec[1:])
+    return lambda x: render(x, True) if x else ""
+
+  elif custom_format == "!":
+    render = _compile_template(format_spec[1:])
+    return lambda x: render(x, True) if not x else ""
+
+  elif custom_format == ":":
+    formats = format_spec[1:].split(":", maxsplit=1)
+    render_truthy = _compile_template(formats[0])
+    render_falsy = _compile_template(formats[1] if len(formats) > 1 else "")
+    return lambda x: (render_truthy if x else render_falsy)(x, True)
+
+  elif custom_format == "*":
+    format_end = (format_spec.find("*", 1) + 1) or 1
+    separator = format_spec[1:format_end - 1]
+    render = _compile_template(format_spec[format_end:])
+    return lambda x: separator.join(render(y, True) for y in (x if isinstance(x, Iterable) else [x]))
+
+  elif custom_format == "\\":
+    render = _compile_format_spec(format_spec[1:])
+    return lambda x: _ESCAPE_PATTERN.sub(lambda y: html.escape(y[1]), render(x))
+
+  elif custom_format == "~":
+    format_spec = format_spec[1:]
+    return lambda x: format(x, format_spec)
+
+  else:
+    return lambda x: format(x, format_spec)
+
 
 class Formattable:
   def __init__(self, value) -> None:
@@ -37,42 +209,7 @@ class Formattable:
       return Formattable("")
 
   def __format__(self, format_spec: str) -> str:
-    if not format_spec:
-      return str(self.value)
-
-    custom_format = format_spec[0]
-
-    if custom_format == "?":
-      format = format_spec[1:]
-      return format.format_map(_to_map(self.value)) if self.value else ""
-
-    elif custom_format == "!":
-      format = format_spec[1:]
-      return format.format_map(_to_map(self.value)) if not self.value else ""
-
-    elif custom_format == ":":
-      formats = format_spec[1:].split(":", maxsplit=1)
-      truthy_format = formats[0]
-      falsy_format = formats[1] if len(formats) > 1 else ""
-      map_value = _to_map(self.value)
-      return (truthy_format if self.value else falsy_format).format_map(map_value)
-
-    elif custom_format == "*":
-      format_end = (format_spec.find("*", 1) + 1) or 1
-      separator = format_spec[1:format_end - 1]
-      format = format_spec[format_end:]
-      values = self.value if isinstance(self.value, Iterable) else [self.value]
-      return separator.join(format.format_map(_to_map(x)) for x in values)
-
-    elif custom_format == "\\":
-      str_value = f"{self:{format_spec[1:]}}"
-      return re.sub(r"<>(.*?)</>", lambda x: html.escape(x[1]), str_value)
-
-    elif custom_format == "~":
-      return f"{self.value:{format_spec[1:]}}"
-
-    else:
-      return f"{self.value:{format_spec}}"
+    return _compile_format_spec(format_spec)(self.value)
 
 
 class FormatMap(dict):
@@ -92,3 +229,13 @@ class FormatMap(dict):
       return Formattable(_len(value) != 1)
 
     return Formattable("")
+
+
+class Template(str):
+  def __new__(cls, value: str) -> "Template":
+    template = super().__new__(cls, value)
+    template._render = _compile_template(str(value))
+    return template
+
+  def render(self, obj=None) -> str:
+    return self._render(obj, False)
@@ -2,47 +2,60 @@ import glob
 import json
 from os import path
 from typing import TypedDict
+from utils.format import Template
 
 DEFAULT_LANGUAGE_CODE = "en"
 
 class L10nTable(TypedDict):
-  FEATURE_DISABLED: str
-  HELP: str
-  HELP_ADMIN: str
-  CLEANUP_SUCCESS: str
-  INVALID_TOKEN: str
-  USER_SELF_TAG_ADD_SUCCESS: str
-  USER_SELF_TAG_ADD_FAILURE: str
-  USER_TAG_ADD_SUCCESS: str
-  USER_TAG_ADD_FAILURE: str
-  USER_TAG_REMOVE_SUCCESS: str
-  USER_TAG_REMOVE_FAILURE: str
-  USER_NICKNAME_SET_SUCCESS: str
-  USER_NICKNAME_SET_FAILURE: str
-  TELEGRAM_USER_INFO: str
-  TELEGRAM_USER_INFO_MISSING: str
-  INVALID_USER: str
-  USER_INFO: str
-  ALL_USERS_INFO: str
-  MIRROR_FETCH_IN_PROGRESS: str
-  MIRROR_FETCH_FAILURE: str
-  MIRROR_FETCH_SUCCESS: str
-  SERVER_INFO: str
-  SERVER_INFO_UPDATE_SUCCESS: str
-  SERVER_INFO_UPDATE_FAILURE: str
-  ACCESS_INFO: str
-  ACCESS_KEYS_ADD_SUCCESS: str
-  ACCESS_KEYS_ADD_FAILURE: str
-  ACCESS_KEYS_ADD_NOTIFICATION: str
-  ACCESS_KEYS_EDIT_SUCCESS: str
-  ACCESS_KEYS_EDIT_FAILURE: str
-  ACCESS_KEYS_REMOVE_SUCCESS: str
-  ACCESS_KEYS_REMOVE_FAILURE: str
-  ACCESS_KEYS_REMOVE_NOTIFICATION: str
+  FEATURE_DISABLED: Template
+  HELP: Template
+  HELP_ADMIN: Template
+  CLEANUP_SUCCESS: Template
+  INVALID_TOKEN: Template
+  USER_SELF_TAG_ADD_SUCCESS: Template
+  USER_SELF_TAG_ADD_FAILURE: Template
+  USER_TAG_ADD_SUCCESS: Template
+  USER_TAG_ADD_FAILURE: Template
+  USER_TAG_REMOVE_SUCCESS: Template
+  USER_TAG_REMOVE_FAILURE: Template
+  USER_NICKNAME_SET_SUCCESS: Template
+  USER_NICKNAME_SET_FAILURE: Template
+  TELEGRAM_USER_INFO: Template
+  TELEGRAM_USER_INFO_MISSING: Template
+  INVALID_USER: Template
+  USER_INFO: Template
+  ALL_USERS_INFO: Template
+  MIRROR_FETCH_IN_PROGRESS: Template
+  MIRROR_FETCH_FAILURE: Template
+  MIRROR_FETCH_SUCCESS: Template
+  SERVER_INFO: Template
+  SERVER_INFO_UPDATE_SUCCESS: Template
+  SERVER_INFO_UPDATE_FAILURE: Template
+  ACCESS_INFO: Template
+  ACCESS_KEYS_ADD_SUCCESS: Template
+  ACCESS_KEYS_ADD_FAILURE: Template
+  ACCESS_KEYS_ADD_PARTIAL_FAILURE: Template
+  ACCESS_KEYS_ADD_NOTIFICATION: Template
+  ACCESS_KEYS_EDIT_SUCCESS: Template
+  ACCESS_KEYS_EDIT_PENDING: Template
+  ACCESS_KEYS_EDIT_FAILURE: Template
+  ACCESS_KEYS_REMOVE_SUCCESS: Template
+  ACCESS_KEYS_REMOVE_FAILURE: Template
+  ACCESS_KEYS_ROTATE_SUCCESS: Template
+  ACCESS_KEYS_ROTATE_FAILURE: Template
+  ACCESS_KEYS_REMOVE_NOTIFICATION: Template
+  TOP_USAGE: Template
+  ACCESS_KEYS_RECONCILE_REPORT: Template
+  ACCESS_KEYS_RECONCILE_FIX_SUCCESS: Template
+  DATA_LIMIT_NOTIFICATION: Template
+  TRACE_REPORT: Template
+
+def _compile_l10n_table(table: dict[str, str]) -> L10nTable:
+  return {k: Template(v) if isinstance(v, str) else v for k, v in table.items()}
 
 def load_l10n_table(lang: str | L10nTable = None) -> L10nTable:
   if (isinstance(lang, dict)):
-    return lang
+    return _compile_l10n_table(lang)
 
   lang = lang or DEFAULT_LANGUAGE_CODE
   root_dir = path.dirname(path.dirname(path.abspath(__file__)))
@@ -55,7 +68,7 @@ def load_l10n_table(lang: str | L10nTable = None) -> L10nTable:
 
   if path.isfile(lang_filename):
     with open(lang_filename, "r") as lang_file:
-      return json.load(lang_file)
+      return _compile_l10n_table(json.load(lang_file))
 
   if lang != DEFAULT_LANGUAGE_CODE:
     return load_l10n_table(DEFAULT_LANGUAGE_CODE)
@@ -1,13 +1,21 @@
 import asyncio
-from aioimaplib import IMAP4_SSL
-from aiosmtplib import SMTP
+import re
 from datetime import datetime
 from email import message_from_bytes
+from email.message import Message as EmailMessage
+from email.parser import BytesFeedParser
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from typing import Iterable
+from typing import Iterable, TYPE_CHECKING
 from utils.url import extract_url
 
+if TYPE_CHECKING:
+  from aioimaplib import IMAP4_SSL
+  from aiosmtplib import SMTP
+
+_HEADER_FIELDS = ("FROM", "TO", "SUBJECT", "DATE", "MIME-VERSION", "CONTENT-TYPE", "CONTENT-TRANSFER-ENCODING")
+_FETCH_ID_PATTERN = re.compile(rb"^(\d+) FETCH ")
+
 class Message:
   def __init__(
       self, sender="", to: str | Iterable[str] = "", subject="",
@@ -21,9 +29,19 @@ class Message:
 
   @staticmethod
   def from_bytes(bytes: bytes | bytearray) -> "Message":
-    msg = message_from_bytes(bytes)
-    sender = msg["From"]
-    to = msg["To"]
+    return Message.from_email(message_from_bytes(bytes))
+
+  @staticmethod
+  def from_chunks(chunks: Iterable[bytes | bytearray]) -> "Message":
+    parser = BytesFeedParser()
+    for chunk in chunks:
+      parser.feed(chunk)
+    return Message.from_email(parser.close())
+
+  @staticmethod
+  def from_email(msg: EmailMessage) -> "Message":
+    sender = msg["From"] or ""
+    to = msg["To"] or ""
     subject = msg["Subject"]
     try:
       date = datetime.strptime(msg["Date"], "%a, %d %b %Y %H:%M:%S %z")
@@ -37,11 +55,11 @@ class Message:
         content_type = part.get_content_type()
         content_disposition = part.get_content_disposition()
         if content_type == "text/plain" and not content_disposition:
-          body += part.get_payload(decode=True).decode("utf-8")
+          body += part.get_payload(decode=True).decode("utf-8", "replace")
         elif content_type == "text/html" and not content_disposition:
-          html_body += part.get_payload(decode=True).decode("utf-8")
+          html_body += part.get_payload(decode=True).decode("utf-8", "replace")
     else:
-      body = msg.get_payload(decode=True).decode("utf-8")
+      body = msg.get_payload(decode=True).decode("utf-8", "replace")
 
     return Message(sender, to, subject, body, html_body, date)
 
@@ -49,7 +67,7 @@ class Mail:
   def __init__(
       self, user="", password="", host="", *,
       smtp_user="", smtp_password="", smtp_host="", smtp_port=587,
-      imap_user="", imap_password="", imap_host="", imap_port=993) -> None:
+      imap_user="", imap_password="", imap_host="", imap_port=993, max_text_size=64 * 1024) -> None:
     host = user.split("@")[1] if "@" in user else ""
 
     smtp_user = smtp_user or user or ""
@@ -65,6 +83,11 @@ class Mail:
     self.imap_password = imap_password or password or ""
     self.imap_host = imap_host or (f"imap.{imap_base}" if imap_base else "")
     self.imap_port = imap_port
+    self.max_text_size = max_text_size
+
+    self._smtp: "SMTP | None" = None
+    self._smtp_lock = asyncio.Lock()
+    self._mailboxes: dict[str, _Mailbox] = {}
 
   async def send(self, message: Message) -> None:
     msg = MIMEMultipart()
@@ -77,41 +100,186 @@ class Mail:
     if message.body or not message.html_body:
       msg.attach(MIMEText(message.body or "", "plain", "utf-8"))
 
+    from aiosmtplib import SMTPServerDisconnected
+
+    async with self._smtp_lock:
+      try:
+        smtp = await self._connect_smtp()
+        await smtp.send_message(msg)
+      except (SMTPServerDisconnected, ConnectionError):
+        self._smtp = None
+        smtp = await self._connect_smtp()
+        await smtp.send_message(msg)
+
+  async def _connect_smtp(self) -> "SMTP":
+    from aiosmtplib import SMTP
+
+    if self._smtp and self._smtp.is_connected:
+      return self._smtp
+
+    self._smtp = None
     smtp = SMTP()
     await smtp.connect(hostname=self.smtp_host, port=self.smtp_port)
     await smtp.login(self.smtp_user, self.smtp_password) if self.smtp_user else None
-    await smtp.send_message(msg)
-    await smtp.quit()
+    self._smtp = smtp
+    return smtp
 
   async def receive(self, *criteria: str, mailbox="INBOX", delete=True, timeout=300.0) -> list[Message]:
-    return await asyncio.wait_for(self._receive(*criteria, mailbox=mailbox, delete=delete), timeout=timeout)
+    box = self._mailboxes.get(mailbox)
+    if box is None:
+      box = self._mailboxes[mailbox] = _Mailbox(self, mailbox)
+    return await asyncio.wait_for(box.receive(criteria, delete), timeout=timeout)
+
+  async def _connect_imap(self, mailbox: str) -> "IMAP4_SSL":
+    from aioimaplib import IMAP4_SSL
 
-  async def _receive(self, *criteria: str, mailbox: str, delete: bool) -> list[Message]:
     imap = IMAP4_SSL(host=self.imap_host, port=self.imap_port)
     await imap.wait_hello_from_server()
     await imap.login(self.imap_user, self.imap_password) if self.imap_user else ""
     await imap.select(mailbox)
+    return imap
+
+  async def close(self) -> None:
+    for box in list(self._mailboxes.values()):
+      await box.close()
+    self._mailboxes.clear()
+
+    async with self._smtp_lock:
+      smtp, self._smtp = self._smtp, None
+      if smtp and smtp.is_connected:
+        try:
+          await smtp.quit()
+        except:
+          smtp.close()
+
+class _Mailbox:
+  def __init__(self, mail: Mail, name: str, *, idle_interval=10.0, keepalive=300.0, retry_delay=5.0) -> None:
+    self.mail = mail
+    self.name = name
+    self.idle_interval = idle_interval
+    self.keepalive = keepalive
+    self.retry_delay = retry_delay
+    self._waiters: dict[tuple[str, ...], list[tuple[asyncio.Future, bool]]] = {}
+    self._imap: "IMAP4_SSL | None" = None
+    self._wakeup = asyncio.Event()
+    self._task: asyncio.Task | None = None
+
+  async def receive(self, criteria: tuple[str, ...], delete: bool) -> list[Message]:
+    future = asyncio.get_running_loop().create_future()
+    waiter = (future, delete)
+    self._waiters.setdefault(criteria, []).append(waiter)
+    self._wakeup.set()
+    if self._task is None or self._task.done():
+      self._task = asyncio.get_running_loop().create_task(self._run())
 
+    try:
+      return await future
+    finally:
+      waiters = self._waiters.get(criteria, [])
+      waiter in waiters and waiters.remove(waiter)
+      if not waiters:
+        self._waiters.pop(criteria, None)
+
+  async def close(self) -> None:
+    task, self._task = self._task, None
+    if task:
+      task.cancel()
+      await asyncio.gather(task, return_exceptions=True)
+    await self._disconnect()
+
+  async def _run(self) -> None:
+    idle_since = None
     while True:
+      loop = asyncio.get_running_loop()
+      if self._waiters:
+        idle_since = None
+      elif idle_since is None:
+        idle_since = loop.time()
+      elif loop.time() - idle_since >= self.keepalive:
+        await self._disconnect()
+        if not self._waiters:
+          return
+
+      try:
+        self._imap = self._imap or await self.mail._connect_imap(self.name)
+        self._wakeup.clear()
+        await self._dispatch(self._imap)
+        await self._idle(self._imap)
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        await self._disconnect()
+        await asyncio.sleep(self.retry_delay)
+
+  async def _dispatch(self, imap: "IMAP4_SSL") -> None:
+    for criteria, waiters in list(self._waiters.items()):
+      waiters = [x for x in waiters if not x[0].done()]
+      if not waiters:
+        continue
+
       status, id_data = await imap.search(*criteria)
       ids: list[str] = id_data[0].decode("utf-8").split() if status == "OK" else []
-      if ids:
-        break
-
-      idle = await imap.idle_start(timeout=10)
-      await imap.wait_server_push()
-      imap.idle_done()
-      await asyncio.wait_for(idle, 10)
-
-    messages: list[Message] = []
-    for id in ids:
-      status, msg_data = await imap.fetch(id, "(RFC822)")
-      if status != "OK": continue
-      if delete: await imap.store(id, "+FLAGS", "\\Deleted")
-      messages.append(Message.from_bytes(msg_data[1]))
-
-    await imap.logout()
-    return messages
+      if not ids:
+        continue
+
+      future, delete = waiters[0]
+      try:
+        messages = await self._fetch(imap, ids)
+        flags = "(\\Seen \\Deleted)" if delete else "(\\Seen)"
+        await imap.store(",".join(ids), "+FLAGS", flags)
+        if delete: await imap.expunge()
+      except Exception as e:
+        future.done() or future.set_exception(e)
+        raise
+      future.done() or future.set_result(messages)
+
+  async def _fetch(self, imap: "IMAP4_SSL", ids: list[str]) -> list[Message]:
+    items = f"(BODY.PEEK[HEADER.FIELDS ({' '.join(_HEADER_FIELDS)})] BODY.PEEK[TEXT]<0.{self.mail.max_text_size}>)"
+    status, lines = await imap.fetch(",".join(ids), items)
+    if status != "OK":
+      return []
+
+    parts: dict[str, dict[str, bytearray]] = {}
+    id, section = None, None
+    for line in lines:
+      if isinstance(line, bytearray):
+        if id is not None and section is not None:
+          parts.setdefault(id, {})[section] = line
+        section = None
+        continue
+
+      match = _FETCH_ID_PATTERN.match(line)
+      id = match[1].decode("utf-8") if match else id
+      header_index, text_index = line.rfind(b"BODY[HEADER"), line.rfind(b"BODY[TEXT]")
+      section = None if header_index == text_index else "header" if header_index > text_index else "text"
+
+    return [
+      Message.from_chunks((parts[id].get("header", b""), parts[id].get("text", b"")))
+        for id in ids if id in parts
+    ]
+
+  async def _idle(self, imap: "IMAP4_SSL") -> None:
+    if self._wakeup.is_set():
+      return
+
+    idle = await imap.idle_start(timeout=self.idle_interval)
+    push = asyncio.ensure_future(imap.wait_server_push(timeout=self.idle_interval))
+    wakeup = asyncio.ensure_future(self._wakeup.wait())
+    try:
+      await asyncio.wait((push, wakeup), timeout=self.idle_interval, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+      push.cancel()
+      wakeup.cancel()
+    imap.idle_done()
+    await asyncio.wait_for(idle, self.idle_interval)
+
+  async def _disconnect(self) -> None:
+    imap, self._imap = self._imap, None
+    if imap:
+      try:
+        await asyncio.wait_for(imap.logout(), 5)
+      except Exception:
+        pass
 
 async def request_url(mail: Mail, address: str, timeout: int) -> str | None:
   try:
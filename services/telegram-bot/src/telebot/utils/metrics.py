@@ -0,0 +1,132 @@
+import bisect
+import time
+from typing import Iterable
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value) -> str:
+  return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+  labels = [f"{name}=\"{_escape(value)}\"" for name, value in zip(names, values)]
+  labels += [extra] if extra else []
+  return "{" + ",".join(labels) + "}" if labels else ""
+
+def _sort_key(item: tuple) -> tuple[str, ...]:
+  return tuple(str(x) for x in item[0])
+
+def _format_value(value: float) -> str:
+  if value == float("inf"):
+    return "+Inf"
+  return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+  type = "untyped"
+
+  def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+    self.name = name
+    self.documentation = documentation
+    self.labels = tuple(labels)
+    self._values = {}
+
+  def clear(self) -> None:
+    self._values.clear()
+
+  def collect(self) -> Iterable[str]:
+    yield f"# HELP {self.name} {_escape(self.documentation)}"
+    yield f"# TYPE {self.name} {self.type}"
+    for labels, value in sorted(self._values.items(), key=_sort_key):
+      yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Counter(Metric):
+  type = "counter"
+
+  def inc(self, *labels, amount: float = 1.0) -> None:
+    self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(Metric):
+  type = "gauge"
+
+  def set(self, value: float, *labels) -> None:
+    self._values[labels] = value
+
+  def inc(self, *labels, amount: float = 1.0) -> None:
+    self._values[labels] = self._values.get(labels, 0.0) + amount
+
+  def dec(self, *labels, amount: float = 1.0) -> None:
+    self._values[labels] = self._values.get(labels, 0.0) - amount
+
+
+class _Timer:
+  __slots__ = ("histogram", "labels", "start")
+
+  def __init__(self, histogram: "Histogram", labels: tuple) -> None:
+    self.histogram = histogram
+    self.labels = labels
+
+  def __enter__(self) -> "_Timer":
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *_) -> None:
+    self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+class Histogram(Metric):
+  type = "histogram"
+
+  def __init__(
+      self, name: str, documentation: str, labels: Iterable[str] = (),
+      buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+    super().__init__(name, documentation, labels)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value: float, *labels) -> None:
+    state = self._values.get(labels)
+    if state is None:
+      state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+    state[0][bisect.bisect_left(self.buckets, value)] += 1
+    state[1] += value
+    state[2] += 1
+
+  def time(self, *labels) -> _Timer:
+    return _Timer(self, labels)
+
+  def collect(self) -> Iterable[str]:
+    yield f"# HELP {self.name} {_escape(self.documentation)}"
+    yield f"# TYPE {self.name} {self.type}"
+    bounds = [*self.buckets, float("inf")]
+    for labels, (counts, total, count) in sorted(self._values.items(), key=_sort_key):
+      cumulative = 0
+      for bound, bucket_count in zip(bounds, counts):
+        cumulative += bucket_count
+        bucket_labels = _format_labels(self.labels, labels, f"le=\"{_format_value(bound)}\"")
+        yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+      yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}"
+      yield f"{self.name}_count{_format_labels(self.labels, labels)} {count}"
+
+
+class Registry:
+  def __init__(self) -> None:
+    self.metrics: dict[str, Metric] = {}
+
+  def register(self, metric: Metric) -> Metric:
+    return self.metrics.setdefault(metric.name, metric)
+
+  def render(self) -> str:
+    return "\n".join(line for x in self.metrics.values() for line in x.collect()) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+  return REGISTRY.register(Counter(name, documentation, labels))
+
+def gauge(name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+  return REGISTRY.register(Gauge(name, documentation, labels))
+
+def histogram(
+    name: str, documentation: str, labels: Iterable[str] = (),
+    buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+  return REGISTRY.register(Histogram(name, documentation, labels, buckets))
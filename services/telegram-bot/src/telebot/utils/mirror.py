@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+from utils.db import DB, Mirror
+from utils.mail import Mail, request_url
+from utils.tasks import SingleFlight
+
+class MirrorCache:
+  def __init__(
+      self, db: DB, mail: Mail, *, ttl=timedelta(hours=6), refresh_ahead=timedelta(hours=1),
+      max_size=256, timeout=120) -> None:
+    self.db = db
+    self.mail = mail
+    self.ttl = ttl
+    self.refresh_ahead = refresh_ahead
+    self.max_size = max_size
+    self.timeout = timeout
+    self._requests = SingleFlight()
+
+  def get(self, address: str) -> Mirror | None:
+    mirror = self.db.mirrors.get(address)
+    if mirror:
+      self.db.mirrors.touch(address)
+    return mirror
+
+  def is_fresh(self, mirror: Mirror | None) -> bool:
+    return bool(mirror) and datetime.now(timezone.utc) - mirror.fetched_at < self.ttl
+
+  def is_fetching(self, address: str) -> bool:
+    return address in self._requests
+
+  async def fetch(self, address: str) -> str | None:
+    return await self._requests.run(address, lambda: self._fetch(address))
+
+  async def _fetch(self, address: str) -> str | None:
+    url = await request_url(self.mail, address, timeout=self.timeout)
+    if url:
+      self.db.mirrors.set(address, url)
+      self.db.mirrors.trim(self.max_size)
+    return url
+
+  async def refresh(self) -> None:
+    now = datetime.now(timezone.utc)
+    stale_mirrors = self.db.mirrors.get_all_stale(
+      fetched_before=now - (self.ttl - self.refresh_ahead),
+      accessed_after=now - self.ttl,
+    )
+    for mirror in stale_mirrors:
+      await self.fetch(mirror.address)
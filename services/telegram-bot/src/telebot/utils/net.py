@@ -1,4 +1,5 @@
 import hashlib
+import hmac
 import inspect
 import json
 import ssl
@@ -45,10 +46,15 @@ class DelegateRequestHandler(RequestHandler):
     return None
 
   async def prepare(self) -> None:
-    result = self.delegate(self.request.path, self.request.method)
+    result = self.call_delegate()
     if inspect.isawaitable(result):
       result = await result
+    self.respond(result)
 
+  def call_delegate(self) -> Any:
+    return self.delegate(self.request.path, self.request.method)
+
+  def respond(self, result: Any) -> None:
     if isinstance(result, tuple):
       response_value = result[0] if len(result) > 0 else ""
       response_code = int(result[1]) if len(result) > 1 else 0
@@ -70,7 +76,32 @@ class DelegateRequestHandler(RequestHandler):
     self.write(bytes(content, "utf8"))
     self.finish()
 
-def create_http_server(handler: Callable[[str, str], Any]) -> HTTPServer:
+class JSONRequestHandler(DelegateRequestHandler):
+  def initialize(self, delegate: Callable[[str, str, dict[str, str], Any], Any], token: str = "") -> None:
+    super().initialize(delegate)
+    self.token = token
+
+  def call_delegate(self) -> Any:
+    authorization = self.request.headers.get("Authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if not (self.token and scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), self.token.encode())):
+      return {"error": "unauthorized"}, 401
+
+    try:
+      body = json.loads(self.request.body) if self.request.body else None
+    except ValueError:
+      return {"error": "invalid JSON body"}, 400
+
+    query = {x: y[-1].decode("utf-8", "replace") for x, y in self.request.query_arguments.items()}
+    return self.delegate(self.request.path, self.request.method, query, body)
+
+def create_http_server(
+    handler: Callable[[str, str], Any],
+    routes: dict[str, Callable[[str, str], Any]] = None,
+    json_routes: dict[str, Callable[[str, str, dict[str, str], Any], Any]] = None,
+    token: str = "") -> HTTPServer:
   return HTTPServer(Application([
+    *((path, JSONRequestHandler, dict(delegate=x, token=token)) for path, x in (json_routes or {}).items()),
+    *((path, DelegateRequestHandler, dict(delegate=x)) for path, x in (routes or {}).items()),
     (AnyMatches(), DelegateRequestHandler, dict(delegate=handler)),
   ]))
@@ -1,11 +1,37 @@
+import asyncio
 import json
 import re
+import time
 from dataclasses import dataclass, field, fields
 from datetime import datetime
 from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+from typing import Any, Awaitable, Callable
 from urllib.parse import urlparse
 from urllib.request import Request, urlopen
+from utils.metrics import counter, gauge, histogram
 from utils.net import create_ssl_context
+from utils.trace import span
+
+_REQUEST_DURATION = histogram(
+  "telebot_outline_request_duration_seconds", "Outline Management API call latency.", ("method", "endpoint"),
+)
+_REQUEST_ERRORS = counter(
+  "telebot_outline_request_errors_total", "Failed Outline Management API calls.", ("method", "endpoint"),
+)
+_SERVER_ACCESS_KEYS = gauge(
+  "telebot_outline_server_access_keys", "Access keys hosted by each Outline Server.", ("server",),
+)
+_SERVER_TRANSFERRED_BYTES = gauge(
+  "telebot_outline_server_transferred_bytes", "Bytes transferred by each Outline Server's keys.", ("server",),
+)
+_SERVER_ERRORS = counter(
+  "telebot_outline_server_errors_total", "Pooled Outline calls that failed on one of the servers.", ("server",),
+)
+
+_LOAD_RETRY_INTERVAL = 30
+
+def _normalize_endpoint(path: str) -> str:
+  return re.sub(r"^/access-keys/[^/]+", "/access-keys/:id", path)
 
 def _snake_to_camel(name: str) -> str:
   if not name:
@@ -35,6 +61,7 @@ class AccessKey:
   method: str = None
   access_url: str = None
   data_limit: DataLimit | None = None
+  server: str = None
 
 @dataclass
 class ServerInfo:
@@ -53,11 +80,13 @@ class ServerInfo:
 
 
 class OutlineAPIClient:
-  def __init__(self, base_url: str, fingerprint: str | bytes = None) -> None:
+  def __init__(self, base_url: str, fingerprint: str | bytes = None, local_url: str = None) -> None:
     self.base_url = base_url.rstrip("/")
+    self.local_url = local_url and local_url.rstrip("/")
     self.http_client = AsyncHTTPClient(defaults=dict(allow_nonstandard_methods=True))
     self.headers = {"Content-Type": "application/json"}
     self.ssl_context = create_ssl_context(fingerprint=fingerprint)
+    self._local_probe: asyncio.Future | None = None
 
   @staticmethod
   def from_url(url: str, fingerprint: str | bytes = None, prefer_localhost=True) -> "OutlineAPIClient":
@@ -68,11 +97,7 @@ class OutlineAPIClient:
     parsed_url = urlparse(public_api_url)
     local_netloc = "localhost".join(parsed_url.netloc.rsplit(parsed_url.hostname, 1))
     local_api_url = parsed_url._replace(netloc=local_netloc).geturl()
-    local_client = OutlineAPIClient(local_api_url, fingerprint=fingerprint)
-    if local_client.is_available():
-      return local_client
-
-    return OutlineAPIClient(public_api_url, fingerprint=fingerprint)
+    return OutlineAPIClient(public_api_url, fingerprint=fingerprint, local_url=local_api_url)
 
   @staticmethod
   def from_access_config(path: str, prefer_localhost=True) -> "OutlineAPIClient":
@@ -99,11 +124,37 @@ class OutlineAPIClient:
       return _dict_to_class(obj, AccessKey)
     return obj
 
+  async def _resolve_base_url(self) -> str:
+    if self.local_url:
+      if self._local_probe is None:
+        self._local_probe = asyncio.ensure_future(self._probe_local_url())
+      await asyncio.shield(self._local_probe)
+    return self.base_url
+
+  async def _probe_local_url(self) -> None:
+    request = HTTPRequest(
+      f"{self.local_url}/metrics/enabled", headers=self.headers,
+      ssl_options=self.ssl_context, request_timeout=5,
+    )
+    try:
+      response = await self.http_client.fetch(request)
+      if response.code == 200:
+        self.base_url = self.local_url
+    except:
+      pass
+    self.local_url = None
+
   async def _request(self, path: str, method: str = "GET", payload=None):
-    url = f"{self.base_url}{path}"
+    url = f"{await self._resolve_base_url()}{path}"
     body = json.dumps(payload).encode("utf-8") if payload else None
     request = HTTPRequest(url, method, self.headers, body, ssl_options=self.ssl_context)
-    response = await self.http_client.fetch(request)
+    endpoint = _normalize_endpoint(path)
+    try:
+      with _REQUEST_DURATION.time(method, endpoint), span(f"outline {method} {endpoint}"):
+        response = await self.http_client.fetch(request)
+    except:
+      _REQUEST_ERRORS.inc(method, endpoint)
+      raise
     if response.code not in (200, 201):
       return None
     return json.loads(response.body, object_hook=OutlineAPIClient._parse)
@@ -116,6 +167,12 @@ class OutlineAPIClient:
     except:
       return False
 
+  async def ping(self, timeout: float = 5.0) -> bool:
+    try:
+      return await asyncio.wait_for(self._request("/server"), timeout) is not None
+    except:
+      return False
+
   async def is_telemetry_enabled(self) -> bool:
     server: ServerInfo = await self._request("/metrics/enabled")
     return server.telemetry_enabled
@@ -187,3 +244,147 @@ class OutlineAPIClient:
       return await self._request(f"/access-keys/{key.id}", "PUT", data)
     else:
       return await self._request("/access-keys", "POST", data)
+
+
+@dataclass
+class ServerLoad:
+  access_keys: int = 0
+  transferred_bytes: int = 0
+  access_keys_updated_at: float = 0.0
+  transferred_bytes_updated_at: float = 0.0
+  failed_at: float = 0.0
+
+  @property
+  def updated_at(self) -> float:
+    return min(self.access_keys_updated_at, self.transferred_bytes_updated_at)
+
+  @property
+  def is_available(self) -> bool:
+    return self.failed_at <= self.updated_at
+
+
+class OutlinePool:
+  def __init__(self, clients: dict[str, OutlineAPIClient], load_ttl: float = 5 * 60) -> None:
+    if not clients:
+      raise ValueError("at least one Outline Server is required")
+    self.clients = dict(clients)
+    self.primary = next(iter(self.clients))
+    self.load_ttl = load_ttl
+    self._load = {x: ServerLoad() for x in self.clients}
+
+  def get(self, server: str = None) -> OutlineAPIClient:
+    client = self.clients.get(server or self.primary)
+    if client is None:
+      raise ValueError(f"unknown Outline Server: '{server}'")
+    return client
+
+  def is_available(self) -> bool:
+    return all(x.is_available() for x in self.clients.values())
+
+  async def ping(self, timeout: float = 5.0) -> bool:
+    return all(await asyncio.gather(*(x.ping(timeout) for x in self.clients.values())))
+
+  async def get_server_info(self, server: str = None) -> ServerInfo:
+    return await self.get(server).get_server_info()
+
+  async def get_server_infos(self) -> dict[str, ServerInfo]:
+    return await self._gather(None, lambda x: x.get_server_info())
+
+  async def patch_server_info(self, server: ServerInfo | None) -> None:
+    await self._gather(None, lambda x: x.patch_server_info(server))
+
+  async def get_transfer_metrics(self, servers: list[str] = None) -> dict[tuple[str, str], int]:
+    results = await self._gather(servers, lambda x: x.get_transfer_metrics())
+    transfer_metrics = {}
+    for server, result in results.items():
+      self._set_load(server, transferred_bytes=sum(result.values()))
+      transfer_metrics.update(((server, x), y) for x, y in result.items())
+    return transfer_metrics
+
+  async def get_access_keys(self, servers: list[str] = None) -> list[AccessKey]:
+    results = await self.get_access_keys_by_server(servers)
+    return [x for access_keys in results.values() for x in access_keys]
+
+  async def get_access_keys_by_server(self, servers: list[str] = None) -> dict[str, list[AccessKey]]:
+    results = await self._gather(servers, lambda x: x.get_access_keys())
+    for server, result in results.items():
+      self._set_load(server, access_keys=len(result))
+      for access_key in result:
+        access_key.server = server
+    return results
+
+  async def get_access_key(self, id: str, server: str = None) -> AccessKey | None:
+    access_key = await self.get(server).get_access_key(id)
+    if access_key:
+      access_key.server = server or self.primary
+    return access_key
+
+  async def delete_access_key(self, id: str, server: str = None) -> bool:
+    return await self.get(server).delete_access_key(id)
+
+  async def patch_access_key(self, key: AccessKey, server: str = None) -> bool:
+    return await self.get(server).patch_access_key(key)
+
+  async def create_access_key(self, key: AccessKey = None, server: str = None) -> AccessKey:
+    access_key = await self.get(server).create_access_key(key)
+    if access_key:
+      access_key.server = server or self.primary
+    return access_key
+
+  async def select_server(self) -> str:
+    if len(self.clients) == 1:
+      return self.primary
+
+    now = time.monotonic()
+    stale_servers = [
+      x for x, y in self._load.items()
+        if now - y.updated_at >= self.load_ttl and (y.is_available or now - y.failed_at >= _LOAD_RETRY_INTERVAL)
+    ]
+    if stale_servers:
+      await asyncio.gather(*(self._refresh_load(x) for x in stale_servers))
+
+    servers = [x for x, y in self._load.items() if y.is_available]
+    if not servers:
+      return self.primary
+
+    total_keys = sum(self._load[x].access_keys for x in servers) or 1
+    total_bytes = sum(self._load[x].transferred_bytes for x in servers) or 1
+    server = min(servers, key=lambda x: (
+      self._load[x].access_keys / total_keys + self._load[x].transferred_bytes / total_bytes,
+      self._load[x].access_keys,
+    ))
+    self._load[server].access_keys += 1
+    return server
+
+  async def _refresh_load(self, server: str) -> None:
+    try:
+      await asyncio.gather(self.get_access_keys([server]), self.get_transfer_metrics([server]))
+    except Exception:
+      self._load[server].failed_at = time.monotonic()
+
+  async def _gather(
+      self, servers: list[str] | None,
+      call: Callable[[OutlineAPIClient], Awaitable[Any]]) -> dict[str, Any]:
+    servers = list(self.clients) if servers is None else servers
+    results = await asyncio.gather(*(call(self.get(x)) for x in servers), return_exceptions=True)
+    errors = [x for x in results if isinstance(x, BaseException)]
+    if errors and (len(errors) == len(results) or any(not isinstance(x, Exception) for x in errors)):
+      raise errors[0]
+
+    succeeded = {}
+    for server, result in zip(servers, results):
+      if isinstance(result, Exception):
+        self._load[server].failed_at = time.monotonic()
+        _SERVER_ERRORS.inc(server)
+      else:
+        succeeded[server] = result
+    return succeeded
+
+  def _set_load(self, server: str, **kwargs) -> None:
+    load = self._load[server]
+    now = time.monotonic()
+    for name, value in kwargs.items():
+      setattr(load, name, value)
+      setattr(load, f"{name}_updated_at", now)
+    _SERVER_ACCESS_KEYS.set(load.access_keys, server)
+    _SERVER_TRANSFERRED_BYTES.set(load.transferred_bytes, server)
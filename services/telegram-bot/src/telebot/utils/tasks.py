@@ -0,0 +1,28 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+async def periodic(interval: float, func: Callable[[], Awaitable[Any]], *, delay: float = 0.0) -> None:
+  await asyncio.sleep(delay)
+  while True:
+    try:
+      await func()
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      pass
+    await asyncio.sleep(interval)
+
+
+class SingleFlight:
+  def __init__(self) -> None:
+    self._calls: dict[Hashable, asyncio.Future] = {}
+
+  def __contains__(self, key: Hashable) -> bool:
+    return key in self._calls
+
+  async def run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+    call = self._calls.get(key)
+    if call is None:
+      call = self._calls[key] = asyncio.ensure_future(func())
+      call.add_done_callback(lambda x: self._calls.get(key) is x and self._calls.pop(key))
+    return await asyncio.shield(call)
@@ -1,33 +1,313 @@
+import asyncio
+import heapq
+import itertools
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
 from functools import partial
 from inspect import Parameter, signature, isawaitable, isgenerator, isasyncgen
-from telegram import Message, Update, User
-from telegram.ext import CallbackContext
+from telegram import Bot, Message, Update, User
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import BaseUpdateProcessor, CallbackContext, filters
+from typing import Any, Awaitable, Callable, Collection
+from utils.metrics import counter, gauge, histogram
+from utils.trace import span, trace
 
-async def reply(update: Update, message) -> None:
+_HANDLER_DURATION = histogram(
+  "telebot_handler_duration_seconds", "Time spent handling Telegram commands, including the reply.", ("handler",),
+)
+_HANDLER_ERRORS = counter(
+  "telebot_handler_errors_total", "Telegram command handlers that raised an exception.", ("handler",),
+)
+_OUTBOUND_MESSAGES = counter(
+  "telebot_outbound_messages_total", "Outbound Telegram messages by priority and result.", ("priority", "result"),
+)
+_OUTBOUND_QUEUE_SIZE = gauge(
+  "telebot_outbound_queue_size", "Outbound Telegram messages waiting to be sent.",
+)
+
+MAX_MESSAGE_LENGTH = 4096
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+class _TokenBucket:
+  def __init__(self, rate: float, capacity: float) -> None:
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated_at = time.monotonic()
+
+  def _refill(self, now: float) -> None:
+    self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+    self.updated_at = now
+
+  def delay(self, now: float) -> float:
+    self._refill(now)
+    return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+  def is_full(self, now: float) -> bool:
+    self._refill(now)
+    return self.tokens >= self.capacity
+
+  def take(self, now: float) -> None:
+    self._refill(now)
+    self.tokens -= 1
+
+@dataclass(order=True)
+class _OutboundMessage:
+  priority: int
+  order: int
+  send: Callable[[], Awaitable[Any]] | None = field(compare=False, default=None)
+  text: str | None = field(compare=False, default=None)
+  kwargs: dict = field(compare=False, default_factory=dict)
+  futures: list[asyncio.Future] = field(compare=False, default_factory=list)
+  attempts: int = field(compare=False, default=0)
+
+class _OutboundChat:
+  def __init__(self, rate: float, capacity: float) -> None:
+    self.queue: list[_OutboundMessage] = []
+    self.bucket = _TokenBucket(rate, capacity)
+    self.is_busy = False
+
+class MessageScheduler:
+  def __init__(
+      self, bot: Bot = None, *, rate: float = 30.0, burst: float = 30.0,
+      chat_rate: float = 1.0, chat_burst: float = 3.0, max_attempts: int = 5) -> None:
+    self.bot = bot
+    self.chat_rate = chat_rate
+    self.chat_burst = chat_burst
+    self.max_attempts = max_attempts
+    self._bucket = _TokenBucket(rate, burst)
+    self._chats: dict[int, _OutboundChat] = {}
+    self._paused_until = 0.0
+    self._order = itertools.count()
+    self._wakeup: asyncio.Event | None = None
+    self._worker: asyncio.Task | None = None
+    self._size = 0
+
+  def submit(self, chat_id: int, send: Callable[[], Awaitable[Any]], *, priority: int = INTERACTIVE) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    self._push(chat_id, _OutboundMessage(priority, next(self._order), send=send, futures=[future]))
+    return future
+
+  def notify(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(lambda x: x.cancelled() or x.exception())
+
+    chat = self._chats.get(chat_id)
+    for message in chat.queue if chat else ():
+      can_merge = (
+        message.priority == BACKGROUND and message.text is not None and message.kwargs == kwargs
+        and len(message.text) + len(text) + 2 <= MAX_MESSAGE_LENGTH
+      )
+      if can_merge:
+        message.text = f"{message.text}\n\n{text}"
+        message.futures.append(future)
+        return future
+
+    self._push(chat_id, _OutboundMessage(BACKGROUND, next(self._order), text=text, kwargs=kwargs, futures=[future]))
+    return future
+
+  async def stop(self) -> None:
+    worker, self._worker = self._worker, None
+    if worker:
+      worker.cancel()
+      await asyncio.gather(worker, return_exceptions=True)
+
+  def _push(self, chat_id: int, message: _OutboundMessage) -> None:
+    chat = self._chats.get(chat_id)
+    if chat is None:
+      chat = self._chats[chat_id] = _OutboundChat(self.chat_rate, self.chat_burst)
+    heapq.heappush(chat.queue, message)
+    self._size += 1
+    _OUTBOUND_QUEUE_SIZE.set(self._size)
+
+    if self._worker is None or self._worker.done():
+      self._wakeup = asyncio.Event()
+      self._worker = asyncio.get_running_loop().create_task(self._run())
+    self._wakeup.set()
+
+  def _next(self, now: float) -> tuple[int | None, float | None]:
+    if self._paused_until > now:
+      return None, self._paused_until - now
+
+    delay = self._bucket.delay(now)
+    if delay > 0:
+      return None, delay
+
+    best_id, best_message, min_delay = None, None, None
+    for chat_id, chat in list(self._chats.items()):
+      if not chat.queue:
+        if not chat.is_busy and chat.bucket.is_full(now):
+          del self._chats[chat_id]
+        continue
+      if chat.is_busy:
+        continue
+
+      delay = chat.bucket.delay(now)
+      if delay > 0:
+        min_delay = delay if min_delay is None else min(min_delay, delay)
+      elif best_message is None or chat.queue[0] < best_message:
+        best_id, best_message = chat_id, chat.queue[0]
+
+    return best_id, min_delay
+
+  async def _run(self) -> None:
+    while True:
+      self._wakeup.clear()
+      now = time.monotonic()
+      chat_id, delay = self._next(now)
+      if chat_id is None:
+        try:
+          await asyncio.wait_for(self._wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+          pass
+        continue
+
+      chat = self._chats[chat_id]
+      message = heapq.heappop(chat.queue)
+      self._size -= 1
+      _OUTBOUND_QUEUE_SIZE.set(self._size)
+      self._bucket.take(now)
+      chat.bucket.take(now)
+      chat.is_busy = True
+      asyncio.get_running_loop().create_task(self._deliver(chat_id, chat, message))
+
+  async def _deliver(self, chat_id: int, chat: _OutboundChat, message: _OutboundMessage) -> None:
+    priority = "interactive" if message.priority == INTERACTIVE else "background"
+    try:
+      if message.send:
+        result = await message.send()
+      else:
+        result = await self.bot.send_message(chat_id, message.text, **message.kwargs)
+    except RetryAfter as e:
+      self._paused_until = max(self._paused_until, time.monotonic() + float(e.retry_after))
+      self._retry(chat_id, message, priority, e, count_attempt=False)
+    except BadRequest as e:
+      self._resolve(message, priority, error=e)
+    except NetworkError as e:
+      self._retry(chat_id, message, priority, e)
+    except Exception as e:
+      self._resolve(message, priority, error=e)
+    else:
+      self._resolve(message, priority, result=result)
+    finally:
+      chat.is_busy = False
+      self._wakeup and self._wakeup.set()
+
+  def _retry(self, chat_id: int, message: _OutboundMessage, priority: str, error: Exception, count_attempt=True) -> None:
+    message.attempts += 1 if count_attempt else 0
+    if message.attempts >= self.max_attempts:
+      self._resolve(message, priority, error=error)
+      return
+
+    _OUTBOUND_MESSAGES.inc(priority, "retried")
+    self._push(chat_id, message)
+
+  def _resolve(self, message: _OutboundMessage, priority: str, result=None, error: Exception = None) -> None:
+    _OUTBOUND_MESSAGES.inc(priority, "failed" if error else "sent")
+    for future in message.futures:
+      if future.done():
+        continue
+      if error:
+        future.set_exception(error)
+      else:
+        future.set_result(result)
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+  chunks = []
+  while len(text) > limit:
+    end = text.rfind("\n\n", 0, limit + 1)
+    end = end if end > 0 else text.rfind("\n", 0, limit + 1)
+    end = end if end > 0 else limit
+    chunks.append(text[:end])
+    text = text[end:].lstrip("\n")
+  chunks.append(text)
+  return chunks
+
+async def _send(update: Update, scheduler: MessageScheduler | None, send: Callable[[], Awaitable[Any]]):
+  with span("telegram.send"):
+    return await (scheduler.submit(update.message.chat_id, send) if scheduler else send())
+
+class _ProgressiveReply:
+  def __init__(self, update: Update, scheduler: MessageScheduler = None) -> None:
+    self.update = update
+    self.scheduler = scheduler
+    self.messages: list[Message] = []
+    self.texts: list[str] = []
+    self._pending: str | None = None
+    self._task: asyncio.Task | None = None
+
+  def push(self, text: str) -> None:
+    self._pending = text
+    if self._task is None or self._task.done():
+      self._task = asyncio.get_running_loop().create_task(self._drain())
+
+  async def flush(self) -> None:
+    while self._task and not self._task.done():
+      await self._task
+    if self._task:
+      self._task.result()
+
+  async def _drain(self) -> None:
+    while self._pending is not None:
+      text, self._pending = self._pending, None
+      await self._render(split_message(text))
+
+  async def _render(self, chunks: list[str]) -> None:
+    for i, chunk in enumerate(chunks):
+      if i >= len(self.messages):
+        self.messages.append(await _send(self.update, self.scheduler, partial(self.update.message.reply_text, chunk)))
+        self.texts.append(chunk)
+      elif self.texts[i] != chunk:
+        await _send(self.update, self.scheduler, partial(self.messages[i].edit_text, chunk))
+        self.texts[i] = chunk
+
+    while len(self.messages) > len(chunks):
+      message = self.messages.pop()
+      self.texts.pop()
+      await _send(self.update, self.scheduler, message.delete)
+
+async def reply(update: Update, message, scheduler: MessageScheduler = None) -> None:
   while isawaitable(message):
     message = await message
 
   if isgenerator(message) or isinstance(message, list):
     for part in message:
-      await reply(update, part)
+      await reply(update, part, scheduler)
     return
 
   if isasyncgen(message):
+    progress = _ProgressiveReply(update, scheduler)
     async for part in message:
-      await reply(update, part)
+      while isawaitable(part):
+        part = await part
+
+      if not (part and update and update.message):
+        continue
+      elif isinstance(part, str):
+        progress.push(part)
+      else:
+        await progress.flush()
+        await reply(update, part, scheduler)
+    await progress.flush()
     return
 
   if not (message and update and update.message):
     return
 
   if isinstance(message, str):
-    await update.message.reply_text(message)
+    for chunk in split_message(message):
+      await _send(update, scheduler, partial(update.message.reply_text, chunk))
     return
 
   raise ValueError("could not determine a suitable method to send the message")
 
 
-def create_parameter_factory(parameter: Parameter):
+def create_parameter_factory(parameter: Parameter, groups: Collection[str] = None):
   hint = parameter.annotation
   parameter_type = hint if isinstance(hint, type) else type(hint)
 
@@ -48,28 +328,66 @@ def create_parameter_factory(parameter: Parameter):
   elif issubclass(parameter_type, User):
     return lambda u, _: u and u.message and u.message.from_user
 
+  elif groups is not None and parameter.name not in groups:
+    if parameter.default is Parameter.empty:
+      raise ValueError(f"parameter '{parameter.name}' has no matching group in the pattern and no default value")
+    return None
+
+  elif parameter_type is str:
+    factory = lambda n, d: lambda _, c: d if not (c and c.match) or (x := c.match[n]) is None else x
+    return factory(parameter.name, parameter.default)
+
   else:
-    factory = lambda n, d, t: lambda _, c: t(c.match[n]) if c and c.match and c.match[n] is not None else d
+    factory = lambda n, d, t: lambda _, c: d if not (c and c.match) or (x := c.match[n]) is None else t(x)
     return factory(parameter.name, parameter.default, parameter_type)
 
+def _bind_handler(handler, positional_factories, keyword_factories):
+  positional_factories = tuple(positional_factories)
+  keyword_factories = tuple(keyword_factories.items())
+
+  if not positional_factories and not keyword_factories:
+    return lambda _, __: handler()
+
+  if not keyword_factories:
+    return lambda u, c: handler(*[f(u, c) for f in positional_factories])
 
-def wrap_handler(handler, positional_factories, keyword_factories):
+  if not positional_factories:
+    return lambda u, c: handler(**{k: f(u, c) for k, f in keyword_factories})
+
+  return lambda u, c: handler(
+    *[f(u, c) for f in positional_factories],
+    **{k: f(u, c) for k, f in keyword_factories},
+  )
+
+
+def wrap_handler(handler, positional_factories, keyword_factories, name: str = None, scheduler: MessageScheduler = None):
+  name = name or getattr(handler, "__name__", "") or "handler"
+  invoke = _bind_handler(handler, positional_factories, keyword_factories)
   async def wrapper(update: Update, context: CallbackContext):
-    result = handler(
-      *(f(update, context) for f in positional_factories),
-      **{k: f(update, context) for k, f in keyword_factories.items()}
-    )
-    await reply(update, result)
+    with _HANDLER_DURATION.time(name), trace(name):
+      try:
+        with span("handler"):
+          message = invoke(update, context)
+          while isawaitable(message):
+            message = await message
+        with span("reply"):
+          await reply(update, message, scheduler)
+      except:
+        _HANDLER_ERRORS.inc(name)
+        raise
   return wrapper
 
-def prepare_handler(handler):
+def prepare_handler(handler, name: str = None, scheduler: MessageScheduler = None, pattern: str | re.Pattern = None):
   keyword_args = {}
   if isinstance(handler, tuple):
+    name = name or handler[0].__name__
     handler = partial(handler[0], *handler[1:])
   elif isinstance(handler, dict):
     keyword_args = {k: v for k, v in handler.items() if k != "_"}
+    name = name or handler["_"].__name__
     handler = partial(handler["_"], **keyword_args)
 
+  groups = None if pattern is None else re.compile(pattern).groupindex
   sig = signature(handler)
   is_positional = (Parameter.POSITIONAL_ONLY,)
   positional_factories = [
@@ -79,8 +397,122 @@ def prepare_handler(handler):
   ]
   is_keyword = (Parameter.POSITIONAL_OR_KEYWORD, Parameter.KEYWORD_ONLY)
   keyword_factories = {
-    p.name: create_parameter_factory(p)
+    p.name: create_parameter_factory(p, groups)
       for p in sig.parameters.values()
       if p.kind in is_keyword and p.name not in keyword_args
   }
-  return wrap_handler(handler, positional_factories, keyword_factories)
+  keyword_factories = {k: v for k, v in keyword_factories.items() if v}
+  return wrap_handler(handler, positional_factories, keyword_factories, name, scheduler)
+
+
+HandlerCallback = Callable[[Update, CallbackContext], Any]
+
+PermissionResolver = Callable[[User], Collection[str]]
+
+@dataclass
+class _Route:
+  order: int
+  callback: HandlerCallback
+  pattern: re.Pattern | None = None
+  filter: filters.BaseFilter | None = None
+  tag: str | None = None
+
+  def matches(self, update: Update, tags: Collection[str]):
+    if self.tag is not None and self.tag not in tags:
+      return None
+    if self.filter is not None and not self.filter.check_update(update):
+      return None
+    if self.pattern is None:
+      return True
+    message = update.effective_message
+    return message and message.text and self.pattern.search(message.text)
+
+@dataclass
+class _RouteNode:
+  children: dict[str, "_RouteNode"] = field(default_factory=dict)
+  routes: list[_Route] = field(default_factory=list)
+
+class CommandRouter:
+  def __init__(self, resolve_permissions: PermissionResolver = None, *, blocked_tag: str = None) -> None:
+    self.resolve_permissions = resolve_permissions or (lambda _: ())
+    self.blocked_tag = blocked_tag
+    self.root = _RouteNode()
+    self.fallbacks: list[_Route] = []
+    self._order = 0
+
+  def add(self, command: str, pattern: str, callback: HandlerCallback, *, tag: str = None) -> None:
+    node = self.root
+    for char in command.lstrip("/"):
+      node = node.children.setdefault(char, _RouteNode())
+    node.routes.append(_Route(self._order, callback, pattern=re.compile(pattern), tag=tag))
+    self._order += 1
+
+  def add_fallback(self, filter: filters.BaseFilter | None, callback: HandlerCallback, *, tag: str = None) -> None:
+    self.fallbacks.append(_Route(self._order, callback, filter=filter, tag=tag))
+    self._order += 1
+
+  def find_routes(self, text: str | None) -> list[_Route]:
+    routes: list[_Route] = []
+    node = self.root if text and text.startswith("/") else None
+    for char in text[1:] if node else "":
+      node = node.children.get(char)
+      if node is None:
+        break
+      routes += node.routes
+
+    return sorted((*routes, *self.fallbacks), key=lambda x: x.order)
+
+  async def __call__(self, update: Update, context: CallbackContext) -> None:
+    message = update.effective_message
+    user = message and message.from_user
+    tags = self.resolve_permissions(user) if user else ()
+    if self.blocked_tag is not None and self.blocked_tag in tags:
+      return
+
+    for route in self.find_routes(message and message.text):
+      match = route.matches(update, tags)
+      if not match:
+        continue
+
+      context.matches = [match] if isinstance(match, re.Match) else None
+      await route.callback(update, context)
+      return
+
+
+class ChatUpdateProcessor(BaseUpdateProcessor):
+  def __init__(self, max_concurrent_updates: int) -> None:
+    super().__init__(max_concurrent_updates)
+    self._chats: dict[int, deque[Awaitable[Any]]] = {}
+
+  async def initialize(self) -> None:
+    pass
+
+  async def shutdown(self) -> None:
+    pass
+
+  async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+    chat = isinstance(update, Update) and update.effective_chat
+    if not chat:
+      await coroutine
+      return
+
+    queue = self._chats.get(chat.id)
+    if queue is not None:
+      queue.append(coroutine)
+      return
+
+    queue = self._chats[chat.id] = deque((coroutine,))
+    error = None
+    try:
+      while queue:
+        try:
+          await queue[0]
+        except Exception as e:
+          error = error or e
+        queue.popleft()
+    finally:
+      del self._chats[chat.id]
+      for pending in queue:
+        hasattr(pending, "close") and pending.close()
+    if error:
+      raise error
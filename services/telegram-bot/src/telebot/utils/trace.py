@@ -0,0 +1,179 @@
+import heapq
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import wraps
+from utils.metrics import counter
+
+_SLOW_TRACES = counter(
+  "telebot_slow_traces_total", "Sampled requests slower than the tracing threshold.", ("trace",),
+)
+
+DEFAULT_SAMPLE_RATE = 0.1
+DEFAULT_THRESHOLD = 1.0
+DEFAULT_CAPACITY = 100
+
+@dataclass(eq=False)
+class Span:
+  name: str
+  start: float
+  end: float = 0.0
+  children: list["Span"] = field(default_factory=list)
+
+  @property
+  def duration(self) -> float:
+    return max(self.end - self.start, 0.0)
+
+  @property
+  def self_duration(self) -> float:
+    busy, cursor = 0.0, self.start
+    for child in sorted(self.children, key=lambda x: x.start):
+      start, end = max(child.start, cursor), min(child.end, self.end)
+      if end > start:
+        busy += end - start
+        cursor = end
+    return max(self.duration - busy, 0.0)
+
+@dataclass
+class Trace:
+  root: Span
+  started_at: datetime
+
+  @property
+  def name(self) -> str:
+    return self.root.name
+
+  @property
+  def duration(self) -> float:
+    return self.root.duration
+
+@dataclass
+class CriticalPathEntry:
+  depth: int
+  name: str
+  duration: float
+  self_duration: float
+
+  @property
+  def indent(self) -> str:
+    return "    " * (self.depth - 1) + "└ " if self.depth else ""
+
+@dataclass
+class TraceSummary:
+  name: str
+  started_at: datetime
+  duration: float
+  path: list[CriticalPathEntry]
+
+@dataclass
+class TraceReport:
+  traces: list[TraceSummary]
+  sample_rate: float
+  threshold: float
+
+
+_CURRENT: ContextVar[Span | None] = ContextVar("telebot_trace_span", default=None)
+
+class _NullSpan:
+  __slots__ = ()
+
+  def __enter__(self) -> None:
+    return None
+
+  def __exit__(self, *_) -> None:
+    pass
+
+_NULL_SPAN = _NullSpan()
+
+class _ActiveSpan:
+  __slots__ = ("span", "parent", "token", "tracer")
+
+  def __init__(self, name: str, parent: Span | None, tracer: "Tracer" = None) -> None:
+    self.span = Span(name, 0.0)
+    self.parent = parent
+    self.tracer = tracer
+
+  def __enter__(self) -> Span:
+    self.span.start = time.perf_counter()
+    if self.parent is not None:
+      self.parent.children.append(self.span)
+    self.token = _CURRENT.set(self.span)
+    return self.span
+
+  def __exit__(self, *_) -> None:
+    self.span.end = time.perf_counter()
+    _CURRENT.reset(self.token)
+    if self.tracer is not None:
+      self.tracer.record(self.span)
+
+def span(name: str) -> _ActiveSpan | _NullSpan:
+  parent = _CURRENT.get()
+  return _NULL_SPAN if parent is None or parent.end else _ActiveSpan(name, parent)
+
+def traced(name: str = None):
+  def decorator(func):
+    span_name = name or func.__qualname__
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+      with span(span_name):
+        return await func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def _get_critical_path(root: Span, depth: int = 0):
+  yield CriticalPathEntry(depth, root.name, root.duration * 1000, root.self_duration * 1000)
+
+  path, cursor = [], root.end
+  for child in sorted(root.children, key=lambda x: x.end, reverse=True):
+    if child.end <= cursor:
+      path.append(child)
+      cursor = child.start
+  for child in reversed(path):
+    yield from _get_critical_path(child, depth + 1)
+
+
+class Tracer:
+  def __init__(
+      self, sample_rate: float = DEFAULT_SAMPLE_RATE, threshold: float = DEFAULT_THRESHOLD,
+      capacity: int = DEFAULT_CAPACITY) -> None:
+    self.sample_rate = sample_rate
+    self.threshold = threshold
+    self.traces: deque[Trace] = deque(maxlen=max(capacity, 1))
+    self._random = random.Random()
+
+  def trace(self, name: str) -> _ActiveSpan | _NullSpan:
+    parent = _CURRENT.get()
+    if parent is not None and not parent.end:
+      return _ActiveSpan(name, parent)
+    if self.sample_rate <= 0 or self._random.random() >= self.sample_rate:
+      return _NULL_SPAN
+    return _ActiveSpan(name, None, self)
+
+  def record(self, root: Span) -> None:
+    if root.duration < self.threshold:
+      return
+
+    _SLOW_TRACES.inc(root.name)
+    started_at = datetime.now(timezone.utc).timestamp() - (time.perf_counter() - root.start)
+    self.traces.append(Trace(root, datetime.fromtimestamp(started_at, timezone.utc)))
+
+  def get_slowest(self, count: int = 5) -> list[Trace]:
+    return heapq.nlargest(count, self.traces, key=lambda x: x.duration)
+
+  def get_report(self, count: int = 5) -> TraceReport:
+    traces = [
+      TraceSummary(x.name, x.started_at, x.duration * 1000, list(_get_critical_path(x.root))[1:])
+        for x in self.get_slowest(count)
+    ]
+    return TraceReport(traces, self.sample_rate, self.threshold)
+
+  def clear(self) -> None:
+    self.traces.clear()
+
+TRACER = Tracer()
+
+def trace(name: str) -> _ActiveSpan | _NullSpan:
+  return TRACER.trace(name)
@@ -1,8 +1,19 @@
 import datetime
 import re
+from functools import cache
 
 Unit = tuple[tuple[tuple[str, ...], float], ...]
 
+_UNIT_PATTERN = re.compile(r"^\s*([-+]?(?:\d*\.\d+|\d+))\s*(\S*)\s*$")
+
+@cache
+def _unit_factors(unit: Unit) -> dict[str, float]:
+  factors = {}
+  for names, factor in unit:
+    for name in names:
+      factors.setdefault(name.casefold(), factor)
+  return factors
+
 def format_unit(value: float, unit: Unit, format_spec: str = None) -> str:
   format_spec = format_spec or ""
   abs_value = abs(value)
@@ -21,11 +32,8 @@ def format_unit(value: float, unit: Unit, format_spec: str = None) -> str:
 
 def parse_unit(format: str, unit: Unit) -> float:
   try:
-    match = re.match(r"^\s*([-+]?(?:\d*\.\d+|\d+))\s*(\S*)\s*$", format)
-    value = float(match[1])
-    unit_name = match[2].casefold()
-    chosen_unit = next((u for u in unit if unit_name in (n.casefold() for n in u[0])))
-    return value * chosen_unit[1]
+    match = _UNIT_PATTERN.match(format)
+    return float(match[1]) * _unit_factors(unit)[match[2].casefold()]
   except:
     raise ValueError("could not convert string to the specified unit")
 
@@ -0,0 +1,144 @@
+import asyncio
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from inspect import isawaitable
+from typing import Any, Callable
+from utils.metrics import counter
+from utils.units import DataSpan
+from utils.vpn import AccessKey, VPNManager
+
+_USAGE_ALERTS = counter(
+  "telebot_usage_alerts_total", "Access keys that crossed a data limit threshold, by threshold and action.",
+  ("threshold", "action"),
+)
+
+DEFAULT_THRESHOLDS = (0.8, 0.95, 1.0)
+
+@dataclass
+class UsageAlert:
+  access_key: AccessKey
+  threshold: float
+  data_usage: DataSpan
+  data_limit: DataSpan
+  extended_limit: DataSpan | None = None
+  revoked: bool = False
+
+  @property
+  def percentage(self) -> int:
+    return round(self.threshold * 100)
+
+UsageAlertCallback = Callable[[list[UsageAlert]], Any]
+
+
+class UsageWatcher:
+  def __init__(
+      self, vpn: VPNManager, *, thresholds: tuple[float, ...] = DEFAULT_THRESHOLDS,
+      extension: int = None, revoke=False, limits_ttl=10 * 60,
+      on_alerts: UsageAlertCallback = None) -> None:
+    self.vpn = vpn
+    self.thresholds = tuple(sorted(thresholds))
+    self.extension = extension
+    self.revoke = revoke
+    self.limits_ttl = limits_ttl
+    self.on_alerts = on_alerts
+    self._limits: dict[tuple[str, str], int] = {}
+    self._pending_limits: dict[tuple[str, str], int] = {}
+    self._limits_loaded_at = 0.0
+    self._levels: dict[tuple[str, str], int] | None = None
+    self._bands: dict[tuple[str, str], tuple[int, float]] = {}
+
+  def invalidate(self) -> None:
+    self._limits_loaded_at = 0.0
+    self._bands.clear()
+
+  async def evaluate(self, counters: dict[tuple[str, str], int]) -> list[UsageAlert]:
+    if not counters:
+      return []
+
+    limits = await self._get_limits()
+    levels = self._get_levels()
+    crossed: list[tuple[tuple[str, str], int, int, int]] = []
+    for key, value in counters.items():
+      limit = limits.get(key)
+      if limit is None:
+        continue
+
+      band = self._bands.get(key)
+      if band is None:
+        band = self._bands[key] = self._get_band(levels.get(key, 0), limit)
+      if band[0] <= value < band[1]:
+        continue
+
+      level = bisect_right([x * limit for x in self.thresholds], value)
+      previous_level = levels.get(key, 0)
+      self._set_level(key, level)
+      self._bands[key] = self._get_band(level, limit)
+      if level > previous_level:
+        crossed.append((key, level, value, limit))
+
+    alerts = [x for x in [await self._process(*x) for x in crossed] if x]
+    callback_result = alerts and self.on_alerts and self.on_alerts(alerts)
+    if isawaitable(callback_result):
+      await callback_result
+    return alerts
+
+  async def _process(self, key: tuple[str, str], level: int, value: int, limit: int) -> UsageAlert | None:
+    db_key = self.vpn.db.access_keys.get_by_outline_id(*key)
+    access_key = db_key and await self.vpn.get_access_key(db_key.user_id, db_key.id, allow_expired=True)
+    if not access_key:
+      return None
+
+    alert = UsageAlert(access_key, self.thresholds[level - 1], DataSpan(value), DataSpan(limit))
+    if level == len(self.thresholds) and self.extension:
+      alert.extended_limit = DataSpan(limit + self.extension)
+      await self.vpn.patch_access_key(db_key.user_id, db_key.id, data_limit=int(alert.extended_limit))
+      self._limits[key] = self._pending_limits[key] = int(alert.extended_limit)
+      self._set_level(key, bisect_right([x * alert.extended_limit for x in self.thresholds], value))
+      self._bands.pop(key, None)
+    elif level == len(self.thresholds) and self.revoke:
+      alert.revoked = True
+      await self.vpn.delete_access_key(db_key.user_id, db_key.id)
+      self._limits.pop(key, None)
+      self._pending_limits.pop(key, None)
+      self._set_level(key, 0)
+      self._bands.pop(key, None)
+
+    action = "extend" if alert.extended_limit else "revoke" if alert.revoked else "notify"
+    _USAGE_ALERTS.inc(f"{alert.threshold:g}", action)
+    return alert
+
+  async def _get_limits(self) -> dict[tuple[str, str], int]:
+    if time.monotonic() - self._limits_loaded_at < self.limits_ttl:
+      return self._limits
+
+    server_infos, outline_keys = await asyncio.gather(
+      self.vpn.outline.get_server_infos(),
+      self.vpn.outline.get_access_keys(),
+    )
+    default_limits = {x: y.data_limit.bytes if y.data_limit else -1 for x, y in server_infos.items()}
+    limits = {(x.server, x.id): x.data_limit.bytes if x.data_limit else default_limits.get(x.server, -1) for x in outline_keys}
+    pending_patches = self.vpn.get_pending_patches() if self._pending_limits else set()
+    self._pending_limits = {x: y for x, y in self._pending_limits.items() if x in pending_patches and x in limits}
+    limits.update(self._pending_limits)
+    self._limits = {x: y for x, y in limits.items() if y > 0}
+    self._limits_loaded_at = time.monotonic()
+    self._bands.clear()
+    return self._limits
+
+  def _get_levels(self) -> dict[tuple[str, str], int]:
+    if self._levels is None:
+      self._levels = self.vpn.db.usage_alerts.get_all()
+    return self._levels
+
+  def _set_level(self, key: tuple[str, str], level: int) -> None:
+    levels = self._get_levels()
+    if levels.get(key, 0) == level:
+      return
+    levels[key] = level
+    self.vpn.db.usage_alerts.set(*key, level)
+
+  def _get_band(self, level: int, limit: int) -> tuple[int, float]:
+    lower = self.thresholds[level - 1] * limit if level > 0 else 0
+    upper = self.thresholds[level] * limit if level < len(self.thresholds) else float("inf")
+    return lower, upper
@@ -1,11 +1,17 @@
 import asyncio
+import heapq
+import re
+import uuid
 from dataclasses import dataclass, asdict
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from inspect import isawaitable
 from random import Random
 from typing import Any, Callable
-from utils.db import DB, UserLike, User as DBUser
-from utils.outline import OutlineAPIClient, AccessKey as OutlineAccessKey, ServerInfo as OutlineServerInfo, DataLimit
+from utils.db import DB, OutboxEntry, UserLike, AccessKey as DBAccessKey, User as DBUser
+from utils.metrics import counter, gauge, histogram
+from utils.outline import OutlineAPIClient, OutlinePool, AccessKey as OutlineAccessKey, ServerInfo as OutlineServerInfo, DataLimit, HTTPError
+from utils.trace import traced
 from utils.units import DataSpan
 from utils.url import append_url_parameter
 
@@ -22,6 +28,7 @@ class AccessKey:
   data_usage: DataSpan
   data_limit: DataSpan | None
   expires_at: datetime | None
+  server: str = ""
 
   @property
   def is_expired(self) -> bool:
@@ -29,6 +36,24 @@ class AccessKey:
       return False
     return self.expires_at <= datetime.now(timezone.utc)
 
+@dataclass
+class AccessKeyRequest:
+  user: UserLike
+  name: str | None = None
+  password: str | None = None
+  port: int | None = None
+  method: str | None = None
+  data_limit: int | None = None
+  expires_at: datetime | None = None
+
+@dataclass
+class AccessKeyPatch:
+  user: UserLike
+  id: str
+  name: str | None = None
+  data_limit: int | None = None
+  expires_at: datetime | None = ...
+
 @dataclass
 class ServerInfo:
   id: str
@@ -40,30 +65,113 @@ class ServerInfo:
   telemetry_enabled: bool
   data_limit: DataSpan | None
   access_keys: list[AccessKey]
+  period: timedelta | None = None
 
   @property
   def data_usage(self) -> DataSpan:
     return DataSpan(sum(x.data_usage for x in self.access_keys))
 
+_EXPIRY_SWEEP_DURATION = histogram(
+  "telebot_expiry_sweep_duration_seconds", "Time spent revoking expired access keys.",
+)
+_EXPIRED_ACCESS_KEYS = counter(
+  "telebot_expired_access_keys_total", "Access keys revoked because they have expired.",
+)
+_TRANSFER_SAMPLE_DURATION = histogram(
+  "telebot_transfer_sample_duration_seconds", "Time spent sampling and rolling up Outline transfer metrics.",
+)
+_ROTATED_ACCESS_KEYS = counter(
+  "telebot_rotated_access_keys_total", "Access keys re-issued on the Outline Server under the same ID.",
+)
+_OUTBOX_OPERATIONS = counter(
+  "telebot_outbox_operations_total", "Outline operations applied from the outbox by operation and result.",
+  ("operation", "result"),
+)
+_OUTBOX_SIZE = gauge(
+  "telebot_outbox_size", "Outline operations waiting in the outbox.",
+)
+
+_RECONCILE_DURATION = histogram(
+  "telebot_reconcile_duration_seconds", "Time spent reconciling access keys with the Outline Server.",
+)
+_ORPHANED_ACCESS_KEYS = gauge(
+  "telebot_orphaned_access_keys", "Access keys that exist only on one side, by the side they exist on.", ("side",),
+)
+_RECONCILED_ACCESS_KEYS = counter(
+  "telebot_reconciled_access_keys_total", "Orphaned access keys removed by reconciliation, by side.", ("side",),
+)
+
+_RECONCILE_BATCH_SIZE = 500
+_RECONCILE_GRACE_PERIOD = 10 * 60
+# The bot creates every Outline key with a UUID hex ID, unlike the numeric IDs assigned by the Outline Manager.
+_MANAGED_OUTLINE_ID = re.compile(r"[0-9a-f]{32}")
+
+_OUTBOX_OPERATION_NAMES = (
+  OutboxEntry.CREATE_ACCESS_KEY, OutboxEntry.PATCH_ACCESS_KEY, OutboxEntry.DELETE_ACCESS_KEY,
+)
+_OUTBOX_BATCH_SIZE = 50
+_OUTBOX_POLL_INTERVAL = 30.0
+_OUTBOX_MAX_BACKOFF = 15 * 60
+_OUTBOX_INLINE_TIMEOUT = 60
+_CREATE_CONCURRENCY = 8
+
+@dataclass
+class AccessKeyUsage:
+  rank: int
+  id: str | None
+  outline_id: str
+  name: str
+  owner: DBUser | None
+  data_usage: DataSpan
+  server: str = ""
+
+@dataclass
+class PatchReport:
+  applied: int = 0
+  queued: int = 0
+
+@dataclass
+class UserUsage:
+  rank: int
+  user: DBUser
+  access_keys: int
+  data_usage: DataSpan
+
+@dataclass
+class UsageReport:
+  access_keys: list[AccessKeyUsage]
+  users: list[UserUsage]
+  period: timedelta | None
+
+@dataclass
+class ReconciliationReport:
+  outline_keys: list[str]
+  access_keys: list[str]
+  fixed: bool
+
 AccessUrlProvider = Callable[[AccessKey], str]
 
 AccessKeyCallback = Callable[[AccessKey], Any]
 
 
+def _format_outline_id(server: str, outline_id: str) -> str:
+  return f"{server}:{outline_id}" if server else outline_id
+
 def _get_prefixed_access_url(
     outline_key: OutlineAccessKey,
-    prefix_map: dict[int, list[str]]) -> str:
-  access_url = outline_key.access_url
-  prefixes = prefix_map.get(outline_key.port, [])
+    prefix_map: dict[int, tuple[str, ...]]) -> str:
+  prefixes = prefix_map.get(outline_key.port)
+  if not prefixes:
+    return outline_key.access_url
+  return _prefix_access_url(outline_key.access_url, prefixes)
+
+@lru_cache(maxsize=16384)
+def _prefix_access_url(access_url: str, prefixes: tuple[str, ...]) -> str:
   if len(prefixes) > 1:
     prefix = Random(access_url).choice(prefixes)
   else:
-    prefix = prefixes[0] if prefixes else ""
-
-  if prefix:
-    return append_url_parameter(access_url, "prefix", prefix)
-  else:
-    return access_url
+    prefix = prefixes[0]
+  return append_url_parameter(access_url, "prefix", prefix)
 
 def _create_prefix_map(map_entries) -> dict[int, list[str]]:
   return {
@@ -101,25 +209,53 @@ DEFAULT_PREFIX_MAP = _create_prefix_map([
 
 class VPNManager:
   def __init__(
-      self, db: DB, outline: OutlineAPIClient, *,
+      self, db: DB, outline: OutlineAPIClient | OutlinePool, *,
       prefix_map: dict[int, list[str]] = None,
       access_url_provider: AccessUrlProvider = None,
       on_access_key_created: AccessKeyCallback = None,
-      on_access_key_deleted: AccessKeyCallback = None) -> None:
+      on_access_key_deleted: AccessKeyCallback = None,
+      on_access_keys_changed: Callable[[], Any] = None) -> None:
     self.db = db
-    self.outline = outline
-    self.prefix_map = DEFAULT_PREFIX_MAP if prefix_map is None else prefix_map
+    self.outline = outline if isinstance(outline, OutlinePool) else OutlinePool({"": outline})
+    self.prefix_map = prefix_map
     self.resolve_access_url = access_url_provider or (lambda x: x.access_url)
     self.on_access_key_created = on_access_key_created
     self.on_access_key_deleted = on_access_key_deleted
+    self.on_access_keys_changed = on_access_keys_changed
+    self._outbox_wakeup = asyncio.Event()
+    self._rotating_outline_ids: set[tuple[str, str]] = set()
+    self._transfer_pruned_bucket = None
+    if self.outline.primary:
+      with self.db.transaction():
+        for repository in (self.db.access_keys, self.db.transfer, self.db.usage_alerts):
+          repository.set_default_server(self.outline.primary)
+
+  @property
+  def prefix_map(self) -> dict[int, tuple[str, ...]]:
+    return self._prefix_map
+
+  @prefix_map.setter
+  def prefix_map(self, prefix_map: dict[int, list[str]] | None) -> None:
+    prefix_map = DEFAULT_PREFIX_MAP if prefix_map is None else prefix_map
+    self._prefix_map = {x: tuple(y) for x, y in prefix_map.items()}
 
   def is_available(self) -> bool:
     return self.outline.is_available()
 
-  async def get_server_info(self) -> ServerInfo:
+  def _resolve_server(self, server: str | None) -> str:
+    return server or self.outline.primary
+
+  def _get_outbox_targets(self, operation: str) -> set[tuple[str, str]]:
+    return {(self._resolve_server(x), y) for x, y in self.db.outbox.get_targets(operation)}
+
+  def get_pending_patches(self) -> set[tuple[str, str]]:
+    return self._get_outbox_targets(OutboxEntry.PATCH_ACCESS_KEY)
+
+  @traced()
+  async def get_server_info(self, period: timedelta = None) -> ServerInfo:
     server_info, access_keys = await asyncio.gather(
       self.outline.get_server_info(),
-      self.get_access_keys(allow_expired=True),
+      self.get_access_keys(allow_expired=True, period=period),
     )
 
     byte_limit = server_info.data_limit.bytes if server_info.data_limit else -1
@@ -128,8 +264,10 @@ class VPNManager:
       **asdict(server_info),
       "data_limit": data_limit,
       "access_keys": access_keys,
+      "period": period,
     })
 
+  @traced()
   async def patch_server_info(
       self, *, name: str = None, hostname: str = None, port: int = None,
       telemetry_enabled: bool = None, data_limit: int = None) -> None:
@@ -141,45 +279,78 @@ class VPNManager:
       data_limit=DataLimit(int(data_limit)) if data_limit is not None else None,
     ))
 
+  @traced()
   async def create_access_key(
       self, user: UserLike, *, name: str = None, password: str = None,
       port: int = None, method: str = None, data_limit: int = None,
       expires_at: datetime = None) -> AccessKey:
-    owner = self.db.users.get(user)
-    if not owner:
-      raise ValueError(f"invalid user: '{user}'")
-
-    outline_key = await self.outline.create_access_key(OutlineAccessKey(
-      name=name, port=port,
-      method=method, password=password,
-      data_limit=DataLimit(int(data_limit)) if data_limit is not None else None,
-    ))
-    if not outline_key:
-      raise ValueError(f"got an invalid response from the Outline Server")
-
-    db_key = self.db.access_keys.create(
-      user=owner,
-      outline_id=outline_key.id,
-      expires_at=expires_at,
+    access_keys = await self.create_access_keys(
+      [user], names=[name], password=password, port=port,
+      method=method, data_limit=data_limit, expires_at=expires_at,
     )
-    if not outline_key:
-      raise ValueError(f"could not create a new access key entry")
-
-    access_key = await self.get_access_key(db_key.user_id, db_key.id, allow_expired=True)
-    if not access_key:
-      raise ValueError("could not find the access key")
-
-    callback_result = self.on_access_key_created and self.on_access_key_created(access_key)
-    if isawaitable(callback_result):
-      await callback_result
-
-    return access_key
+    if not access_keys:
+      raise ValueError("could not create the access key on the Outline Server")
+    return access_keys[0]
 
+  @traced()
+  async def create_access_keys(
+      self, users: list[UserLike], *, names: list[str | None] = None, password: str = None,
+      port: int = None, method: str = None, data_limit: int = None,
+      expires_at: datetime = None, concurrency: int = _CREATE_CONCURRENCY) -> list[AccessKey]:
+    requests = [
+      AccessKeyRequest(
+        user=user, name=name, password=password, port=port,
+        method=method, data_limit=data_limit, expires_at=expires_at,
+      ) for user, name in zip(users, names or [None] * len(users))
+    ]
+    access_keys = await self.create_access_key_batch(requests, concurrency)
+    return [x for x in access_keys if x]
+
+  @traced()
+  async def create_access_key_batch(
+      self, requests: list[AccessKeyRequest],
+      concurrency: int = _CREATE_CONCURRENCY) -> list[AccessKey | None]:
+    owners = [self.db.users.get(x.user) for x in requests]
+    invalid_request = next((x for x, y in zip(requests, owners) if not y), None)
+    if invalid_request is not None:
+      raise ValueError(f"invalid user: '{invalid_request.user}'")
+
+    servers = [await self.outline.select_server() for _ in owners]
+    available_at = datetime.now(timezone.utc) + timedelta(seconds=_OUTBOX_INLINE_TIMEOUT)
+    db_keys, entries = [], []
+    with self.db.transaction():
+      for request, owner, server in zip(requests, owners, servers):
+        db_key = self.db.access_keys.create(
+          user=owner,
+          outline_id=uuid.uuid4().hex,
+          expires_at=request.expires_at,
+          server=server,
+        )
+        payload = {
+          "name": request.name, "port": request.port, "method": request.method,
+          "password": request.password, "data_limit": request.data_limit, "server": server,
+        }
+        db_keys.append(db_key)
+        entries.append(self.db.outbox.create(OutboxEntry.CREATE_ACCESS_KEY, db_key.outline_id, payload, available_at))
+
+    applied = await self._apply_outbox_entries(entries, concurrency, retry=False)
+    created_keys = [x for x, y in zip(db_keys, applied) if y]
+    access_keys = {(x.server, x.outline_id): x for x in await self._get_access_keys(created_keys, allow_expired=True)}
+    for access_key in access_keys.values():
+      callback_result = self.on_access_key_created and self.on_access_key_created(access_key)
+      if isawaitable(callback_result):
+        await callback_result
+    return [access_keys.get((x.server, x.outline_id)) for x in db_keys]
+
+  @traced()
   async def get_access_key(self, user: UserLike, id: str, allow_expired=False) -> AccessKey | None:
     access_keys = await self.get_access_keys(user, id, allow_expired)
     return access_keys[0] if access_keys else None
 
-  async def get_access_keys(self, user: UserLike = None, id: str = None, allow_expired=False) -> list[AccessKey]:
+  @traced()
+  async def get_access_keys(
+      self, user: UserLike = None, id: str = None,
+      allow_expired=False, period: timedelta = None) -> list[AccessKey]:
     if id:
       db_key = self.db.access_keys.get(user, id)
       db_keys = [db_key] if db_key else []
@@ -190,40 +361,64 @@ class VPNManager:
     else:
       db_keys = self.db.access_keys.get_all()
 
-    if not (user or id or allow_expired is ...):
+    fetch_all = not (user or id or allow_expired is ...)
+    return await self._get_access_keys(db_keys, fetch_all=fetch_all, allow_expired=allow_expired, period=period)
+
+  @traced()
+  async def get_access_key_page(
+      self, after: tuple[int, str] = None, limit: int = 100) -> tuple[list[AccessKey], tuple[int, str] | None]:
+    db_keys = self.db.access_keys.get_page(after, limit)
+    access_keys = await self._get_access_keys(db_keys, allow_expired=True)
+    cursor = (db_keys[-1].user_id, db_keys[-1].id) if len(db_keys) == limit else None
+    return access_keys, cursor
+
+  async def _get_access_keys(
+      self, db_keys: list[DBAccessKey], *, fetch_all=False,
+      allow_expired=False, period: timedelta = None) -> list[AccessKey]:
+    if fetch_all:
       outline_keys = await self.outline.get_access_keys()
+      pending_deletes = self._get_outbox_targets(OutboxEntry.DELETE_ACCESS_KEY)
+      outline_keys = [x for x in outline_keys if (x.server, x.id) not in pending_deletes]
     elif db_keys and len(db_keys) > 1:
-      outline_keys = await self.outline.get_access_keys()
-      outline_keys = [x for x in outline_keys if any(x.id == y.outline_id for y in db_keys)]
+      outline_ids = {(self._resolve_server(x.server), x.outline_id) for x in db_keys}
+      outline_keys = await self.outline.get_access_keys(list({self._resolve_server(x.server) for x in db_keys}))
+      outline_keys = [x for x in outline_keys if (x.server, x.id) in outline_ids]
     elif db_keys:
-      outline_key = await self.outline.get_access_key(db_keys[0].outline_id)
+      outline_key = await self.outline.get_access_key(db_keys[0].outline_id, db_keys[0].server)
       outline_keys = [outline_key] if outline_key else []
     else:
       outline_keys = []
 
-    if outline_keys:
-      transfer_metrics = await self.outline.get_transfer_metrics()
+    if outline_keys and period:
+      transfer_metrics = self.db.transfer.get_usage(datetime.now(timezone.utc) - period)
+    elif outline_keys:
+      transfer_metrics = await self.outline.get_transfer_metrics(list({x.server for x in outline_keys}))
     else:
-      transfer_metrics: dict[str, int] = {}
+      transfer_metrics: dict[tuple[str, str], int] = {}
 
-    owners = self.db.users.get_all(list(set(x.user_id for x in db_keys)))
+    owners = {x.id: x for x in self.db.users.get_all(list(set(x.user_id for x in db_keys)))}
+    db_keys_by_outline_id = {(self._resolve_server(x.server), x.outline_id): x for x in db_keys}
     access_keys: list[AccessKey] = []
 
     for outline_key in outline_keys:
-      db_key = next((x for x in db_keys if x.outline_id == outline_key.id), None)
-      owner = db_key and next((x for x in owners if x.id == db_key.user_id), None)
-      data_usage = DataSpan(transfer_metrics.get(outline_key.id, 0))
+      db_key = db_keys_by_outline_id.get((outline_key.server, outline_key.id))
+      owner = db_key and owners.get(db_key.user_id)
       byte_limit = outline_key.data_limit.bytes if outline_key.data_limit else -1
-      data_limit = DataSpan(byte_limit) if byte_limit >= 0 else None
-      tmp_key = AccessKey(**{
-        **asdict(outline_key), "id": db_key and db_key.id,
-        "outline_id": outline_key.id, "owner": owner,
-        "data_usage": data_usage, "data_limit": data_limit,
-        "expires_at": db_key and db_key.expires_at,
-        "access_url": _get_prefixed_access_url(outline_key, self.prefix_map),
-      })
-      access_url = self.resolve_access_url(tmp_key)
-      access_key = AccessKey(**{**asdict(tmp_key), "owner": owner, "access_url": access_url})
+      access_key = AccessKey(
+        id=db_key and db_key.id,
+        outline_id=outline_key.id,
+        owner=owner,
+        name=outline_key.name,
+        password=outline_key.password,
+        port=outline_key.port,
+        method=outline_key.method,
+        access_url=_get_prefixed_access_url(outline_key, self._prefix_map),
+        data_usage=DataSpan(transfer_metrics.get((outline_key.server, outline_key.id), 0)),
+        data_limit=DataSpan(byte_limit) if byte_limit >= 0 else None,
+        expires_at=db_key and db_key.expires_at,
+        server=outline_key.server or "",
+      )
+      access_key.access_url = self.resolve_access_url(access_key)
       if not allow_expired and access_key.is_expired:
         await self._delete_access_key(access_key)
       else:
@@ -231,63 +426,415 @@ class VPNManager:
 
     return access_keys
 
+  @traced()
   async def patch_access_key(
       self, user: UserLike, id: str, *,
       name: str = None, data_limit: int = None) -> bool:
-    patched = await self.patch_access_keys(user, id, name=name, data_limit=data_limit)
-    return patched > 0
+    report = await self.patch_access_keys(user, id, name=name, data_limit=data_limit)
+    return report.applied + report.queued > 0
 
+  @traced()
   async def patch_access_keys(
       self, user: UserLike = None, id: str = None, *, name: str = None,
-      data_limit: int = None, expires_at: datetime | None = ...) -> int:
+      data_limit: int = None, expires_at: datetime | None = ...) -> PatchReport:
     access_keys = await self.get_access_keys(user, id, allow_expired=True)
-    count = 0
+    report = PatchReport()
     for access_key in access_keys:
-      success = await self._patch_access_key(
+      result = await self._patch_access_key(
         access_key, name=name, data_limit=data_limit, expires_at=expires_at
       )
-      count += 1 if success else 0
-    return count
+      report.applied += result.applied
+      report.queued += result.queued
+    return report
 
   async def _patch_access_key(
       self, access_key: AccessKey, *, name: str = None,
-      data_limit: int = None, expires_at: datetime | None = ...) -> bool:
-    outline_success = await self.outline.patch_access_key(OutlineAccessKey(
-      id=access_key.outline_id, name=name,
-      data_limit=DataLimit(int(data_limit)) if data_limit is not None else None,
-    ))
-    db_success = self.db.access_keys.update(
-      user=access_key.owner, id=access_key.id, expires_at=expires_at
-    )
-    return outline_success or db_success
-
+      data_limit: int = None, expires_at: datetime | None = ...) -> PatchReport:
+    available_at = datetime.now(timezone.utc) + timedelta(seconds=_OUTBOX_INLINE_TIMEOUT)
+    entry = None
+    with self.db.transaction():
+      db_success = self.db.access_keys.update(
+        user=access_key.owner, id=access_key.id, expires_at=expires_at
+      )
+      if name is not None or data_limit is not None:
+        payload = {"name": name, "data_limit": data_limit, "server": access_key.server}
+        entry = self.db.outbox.create(OutboxEntry.PATCH_ACCESS_KEY, access_key.outline_id, payload, available_at)
+
+    if entry and await self._apply_outbox_entry(entry, notify=False):
+      return PatchReport(applied=1)
+    if entry and self.db.outbox.exists(entry.id):
+      return PatchReport(queued=1)
+    return PatchReport(applied=1 if db_success else 0)
+
+  @traced()
+  async def patch_access_key_batch(
+      self, patches: list[AccessKeyPatch],
+      concurrency: int = _CREATE_CONCURRENCY) -> list[bool]:
+    db_keys = [self.db.access_keys.get(x.user, x.id) for x in patches]
+    available_at = datetime.now(timezone.utc) + timedelta(seconds=_OUTBOX_INLINE_TIMEOUT)
+    entries = []
+    with self.db.transaction():
+      for patch, db_key in zip(patches, db_keys):
+        if not db_key:
+          continue
+
+        self.db.access_keys.update(db_key.user_id, db_key.id, expires_at=patch.expires_at)
+        if patch.name is not None or patch.data_limit is not None:
+          payload = {"name": patch.name, "data_limit": patch.data_limit, "server": db_key.server}
+          entries.append(self.db.outbox.create(OutboxEntry.PATCH_ACCESS_KEY, db_key.outline_id, payload, available_at))
+
+    await self._apply_outbox_entries(entries, concurrency)
+    return [x is not None for x in db_keys]
+
+  @traced()
+  async def rotate_access_keys(
+      self, user: UserLike = None, id: str = None, *, port: int = None,
+      method: str = None, concurrency: int = _CREATE_CONCURRENCY) -> list[AccessKey]:
+    access_keys = await self.get_access_keys(user, id, allow_expired=True)
+    access_keys = [x for x in access_keys if x.id is not None and x.owner is not None]
+
+    new_ids = [uuid.uuid4().hex for _ in access_keys]
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    async def create(access_key: AccessKey, new_id: str) -> str | None:
+      data_limit = DataLimit(int(access_key.data_limit)) if access_key.data_limit is not None else None
+      outline_key = OutlineAccessKey(
+        id=new_id, name=access_key.name, port=port or access_key.port,
+        method=method or access_key.method, data_limit=data_limit,
+      )
+      async with semaphore:
+        try:
+          created_key = await self.outline.create_access_key(outline_key, access_key.server)
+        except Exception:
+          return None
+      return created_key and outline_key.id
+
+    rotating_ids = {(x.server, y) for x, y in zip(access_keys, new_ids)}
+    self._rotating_outline_ids.update(rotating_ids)
+    try:
+      created_ids = await asyncio.gather(*(create(x, y) for x, y in zip(access_keys, new_ids)))
+      rotated_keys = [(x, y) for x, y in zip(access_keys, created_ids) if y]
+      outline_ids = {(x.server, x.outline_id): y for x, y in rotated_keys}
+      with self.db.transaction():
+        self.db.access_keys.update_outline_ids(outline_ids)
+        self.db.transfer.rename(outline_ids)
+        for access_key, _ in rotated_keys:
+          self.db.usage_alerts.delete(access_key.server, access_key.outline_id)
+          payload = {"server": access_key.server}
+          self.db.outbox.create(OutboxEntry.DELETE_ACCESS_KEY, access_key.outline_id, payload)
+    finally:
+      self._rotating_outline_ids.difference_update(rotating_ids)
+
+    if rotated_keys:
+      self._outbox_wakeup.set()
+      await self._notify_access_keys_changed()
+    _ROTATED_ACCESS_KEYS.inc(amount=len(rotated_keys))
+    db_keys = [self.db.access_keys.get(x.owner.id, x.id) for x, _ in rotated_keys]
+    return await self._get_access_keys([x for x in db_keys if x], allow_expired=True)
+
+  @traced()
   async def delete_access_key(self, user: UserLike, id: str) -> AccessKey | None:
     access_keys = await self.delete_access_keys(user, id)
     return access_keys[0] if access_keys else None
 
+  @traced()
   async def delete_access_keys(self, user: UserLike = None, id: str = None) -> list[AccessKey]:
     access_keys = await self.get_access_keys(user, id, allow_expired=True)
     for access_key in access_keys:
       await self._delete_access_key(access_key)
     return access_keys
 
-  async def delete_expired_access_keys(self) -> list[AccessKey]:
-    access_keys = await self.get_access_keys(allow_expired=...)
+  @traced()
+  async def delete_access_key_batch(
+      self, keys: list[tuple[UserLike, str]], concurrency: int = _CREATE_CONCURRENCY,
+      *, before_commit: Callable[[], None] = None) -> list[bool]:
+    db_keys = [self.db.access_keys.get(user, id) for user, id in keys]
+    found_keys = list({(x.user_id, x.id): x for x in db_keys if x}.values())
+    access_keys = await self._get_access_keys(found_keys, allow_expired=True)
+    available_at = datetime.now(timezone.utc) + timedelta(seconds=_OUTBOX_INLINE_TIMEOUT)
+    entries = []
+    with self.db.transaction():
+      for db_key in found_keys:
+        self.db.access_keys.delete(db_key.user_id, db_key.id)
+        payload = {"server": db_key.server}
+        entries.append(self.db.outbox.create(OutboxEntry.DELETE_ACCESS_KEY, db_key.outline_id, payload, available_at))
+      before_commit and before_commit()
+
+    await self._apply_outbox_entries(entries, concurrency)
     for access_key in access_keys:
-      await self._delete_access_key(access_key)
+      callback_result = self.on_access_key_deleted and self.on_access_key_deleted(access_key)
+      if isawaitable(callback_result):
+        await callback_result
+    return [x is not None for x in db_keys]
+
+  @traced()
+  async def delete_expired_access_keys(self) -> list[AccessKey]:
+    with _EXPIRY_SWEEP_DURATION.time():
+      access_keys = await self.get_access_keys(allow_expired=...)
+      for access_key in access_keys:
+        await self._delete_access_key(access_key)
+    _EXPIRED_ACCESS_KEYS.inc(amount=len(access_keys))
     return access_keys
 
+  @traced()
+  async def get_top_usage(self, count: int = 10, period: timedelta = None) -> UsageReport:
+    if period:
+      transfer_metrics = self.db.transfer.get_usage(datetime.now(timezone.utc) - period)
+    else:
+      transfer_metrics = await self.outline.get_transfer_metrics()
+
+    db_keys = {(self._resolve_server(x.server), x.outline_id): x for x in self.db.access_keys.get_all()}
+    user_usage: dict[int, list[int]] = {}
+    for key, data_usage in transfer_metrics.items():
+      db_key = db_keys.get(key)
+      if db_key:
+        usage = user_usage.setdefault(db_key.user_id, [0, 0])
+        usage[0] += 1
+        usage[1] += data_usage
+
+    top_keys = heapq.nlargest(count, transfer_metrics.items(), key=lambda x: x[1])
+    top_users = heapq.nlargest(count, user_usage.items(), key=lambda x: x[1][1])
+    owner_ids = {db_keys[x].user_id for x, _ in top_keys if x in db_keys} | {x for x, _ in top_users}
+    owners = {x.id: x for x in self.db.users.get_all(list(owner_ids))}
+    outline_keys = await asyncio.gather(*(
+      self.outline.get_access_key(outline_id, server) for (server, outline_id), _ in top_keys
+    ), return_exceptions=True)
+
+    access_keys = []
+    for rank, (((server, outline_id), data_usage), outline_key) in enumerate(zip(top_keys, outline_keys), 1):
+      db_key = db_keys.get((server, outline_id))
+      name = outline_key.name if isinstance(outline_key, OutlineAccessKey) else ""
+      owner = db_key and owners.get(db_key.user_id)
+      access_keys.append(AccessKeyUsage(
+        rank, db_key and db_key.id, outline_id, name, owner, DataSpan(data_usage), server,
+      ))
+
+    users = [
+      UserUsage(rank, owners[user_id], key_count, DataSpan(data_usage))
+        for rank, (user_id, (key_count, data_usage)) in enumerate(top_users, 1)
+        if user_id in owners
+    ]
+    return UsageReport(access_keys, users, period)
+
+  @traced()
+  async def sample_transfer_metrics(self) -> dict[tuple[str, str], int]:
+    with _TRANSFER_SAMPLE_DURATION.time():
+      transfer_metrics = await self.outline.get_transfer_metrics()
+      now = datetime.now(timezone.utc)
+      changed = self.db.transfer.record(transfer_metrics, now)
+      bucket = int(now.timestamp()) // self.db.transfer.HOUR
+      if bucket != self._transfer_pruned_bucket:
+        self.db.transfer.prune(now)
+        self._transfer_pruned_bucket = bucket
+    return changed
+
+  @traced()
+  async def check_health(self, timeout: float = 5.0) -> bool:
+    return await self.outline.ping(timeout)
+
   async def _delete_access_key(self, access_key: AccessKey) -> None:
-    if access_key.outline_id is not None:
-      await self.outline.delete_access_key(access_key.outline_id)
+    with self.db.transaction():
+      if access_key.id is not None and access_key.owner is not None:
+        self.db.access_keys.delete(access_key.owner.id, access_key.id)
 
-    if access_key.id is not None and access_key.owner is not None:
-      self.db.access_keys.delete(access_key.owner.id, access_key.id)
+      if access_key.outline_id is not None:
+        payload = {"server": access_key.server}
+        self.db.outbox.create(OutboxEntry.DELETE_ACCESS_KEY, access_key.outline_id, payload)
+        self._outbox_wakeup.set()
 
     callback_result = self.on_access_key_deleted and self.on_access_key_deleted(access_key)
     if isawaitable(callback_result):
       await callback_result
 
+  @traced()
+  async def reconcile(self, fix=False) -> ReconciliationReport:
+    with _RECONCILE_DURATION.time():
+      updated_before = datetime.now(timezone.utc) - timedelta(seconds=_RECONCILE_GRACE_PERIOD)
+      db_keys = self.db.access_keys.get_all()
+      db_ids = {(self._resolve_server(x.server), x.outline_id) for x in db_keys}
+      recent_db_ids = {
+        (self._resolve_server(x.server), x.outline_id) for x in db_keys if not self._is_reconcilable(x, updated_before)
+      }
+      pending_creates = self._get_outbox_targets(OutboxEntry.CREATE_ACCESS_KEY)
+      pending_deletes = self._get_outbox_targets(OutboxEntry.DELETE_ACCESS_KEY)
+      outline_keys = await self.outline.get_access_keys_by_server()
+      outline_ids = {(x, y.id) for x, access_keys in outline_keys.items() for y in access_keys}
+
+      orphaned_outline_ids = sorted(outline_ids - db_ids - pending_creates - pending_deletes - self._rotating_outline_ids)
+      orphaned_db_ids = sorted(
+        x for x in db_ids - outline_ids - pending_creates - recent_db_ids if x[0] in outline_keys
+      )
+      _ORPHANED_ACCESS_KEYS.set(len(orphaned_outline_ids), "outline")
+      _ORPHANED_ACCESS_KEYS.set(len(orphaned_db_ids), "db")
+
+      if fix:
+        fixed_outline_ids, fixed_db_ids = [], []
+        for i in range(0, max(len(orphaned_outline_ids), len(orphaned_db_ids)), _RECONCILE_BATCH_SIZE):
+          outline_batch, db_batch = self._fix_orphans(
+            orphaned_outline_ids[i:i + _RECONCILE_BATCH_SIZE], orphaned_db_ids[i:i + _RECONCILE_BATCH_SIZE],
+            updated_before,
+          )
+          fixed_outline_ids.extend(outline_batch)
+          fixed_db_ids.extend(db_batch)
+        _RECONCILED_ACCESS_KEYS.inc("outline", amount=len(fixed_outline_ids))
+        _RECONCILED_ACCESS_KEYS.inc("db", amount=len(fixed_db_ids))
+        _ORPHANED_ACCESS_KEYS.set(len(orphaned_outline_ids) - len(fixed_outline_ids), "outline")
+        _ORPHANED_ACCESS_KEYS.set(len(orphaned_db_ids) - len(fixed_db_ids), "db")
+        orphaned_outline_ids, orphaned_db_ids = fixed_outline_ids, fixed_db_ids
+        orphaned_outline_ids and self._outbox_wakeup.set()
+
+    return ReconciliationReport(
+      [_format_outline_id(*x) for x in orphaned_outline_ids], [_format_outline_id(*x) for x in orphaned_db_ids], fix,
+    )
+
+  def _fix_orphans(
+      self, outline_ids: list[tuple[str, str]], db_ids: list[tuple[str, str]],
+      updated_before: datetime) -> tuple[list[tuple[str, str]], list[tuple[str, str]]]:
+    with self.db.transaction():
+      pending_creates = self._get_outbox_targets(OutboxEntry.CREATE_ACCESS_KEY)
+      pending_deletes = self._get_outbox_targets(OutboxEntry.DELETE_ACCESS_KEY)
+      known_ids = {(x.server, x.outline_id) for x in self.db.access_keys.get_all_by_outline_ids(outline_ids)}
+      outline_ids = [
+        x for x in outline_ids
+          if _MANAGED_OUTLINE_ID.fullmatch(x[1]) and x not in known_ids and x not in pending_creates
+          and x not in pending_deletes and x not in self._rotating_outline_ids
+      ]
+      db_keys = {(x.server, x.outline_id): x for x in self.db.access_keys.get_all_by_outline_ids(db_ids)}
+      db_ids = [
+        x for x in db_ids
+          if x in db_keys and x not in pending_creates and self._is_reconcilable(db_keys[x], updated_before)
+      ]
+
+      self.db.access_keys.delete_all_by_outline_ids(db_ids)
+      for server, outline_id in outline_ids:
+        self.db.outbox.create(OutboxEntry.DELETE_ACCESS_KEY, outline_id, {"server": server})
+    return outline_ids, db_ids
+
+  @staticmethod
+  def _is_reconcilable(access_key: DBAccessKey, updated_before: datetime) -> bool:
+    return access_key.updated_at is None or access_key.updated_at <= updated_before
+
+  async def run_outbox(self) -> None:
+    while True:
+      self._outbox_wakeup.clear()
+      try:
+        processed = await self.process_outbox()
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        processed = 0
+
+      if processed < _OUTBOX_BATCH_SIZE:
+        try:
+          await asyncio.wait_for(self._outbox_wakeup.wait(), _OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+          pass
+
+  @traced()
+  async def process_outbox(self, limit: int = _OUTBOX_BATCH_SIZE) -> int:
+    entries = self.db.outbox.get_all_available(limit)
+    await asyncio.gather(*(self._apply_outbox_entry(x) for x in entries))
+    _OUTBOX_SIZE.set(self.db.outbox.count())
+    return len(entries)
+
+  async def _apply_outbox_entries(self, entries: list[OutboxEntry], concurrency: int, retry=True) -> list[bool]:
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    async def apply(entry: OutboxEntry) -> bool:
+      async with semaphore:
+        return await self._apply_outbox_entry(entry, notify=False, retry=retry)
+
+    return await asyncio.gather(*(apply(x) for x in entries))
+
+  async def _apply_outbox_entry(self, entry: OutboxEntry, notify=True, retry=True) -> bool:
+    if entry.operation not in _OUTBOX_OPERATION_NAMES:
+      self._discard_outbox_entry(entry)
+      _OUTBOX_OPERATIONS.inc(entry.operation, "failed")
+      return False
+
+    try:
+      await self._apply_outbox_operation(entry)
+    except HTTPError as e:
+      if 400 <= e.code < 500:
+        self._discard_outbox_entry(entry)
+        _OUTBOX_OPERATIONS.inc(entry.operation, "failed")
+        return False
+      self._retry_outbox_entry(entry, e) if retry else self._abandon_outbox_entry(entry)
+      return False
+    except Exception as e:
+      self._retry_outbox_entry(entry, e) if retry else self._abandon_outbox_entry(entry)
+      return False
+
+    self.db.outbox.delete(entry.id)
+    _OUTBOX_OPERATIONS.inc(entry.operation, "applied")
+    await self._notify_access_keys_changed()
+    if notify and entry.operation == OutboxEntry.CREATE_ACCESS_KEY:
+      await self._on_outline_key_created(self._resolve_server(entry.payload.get("server")), entry.target)
+    return True
+
+  async def _apply_outbox_operation(self, entry: OutboxEntry) -> None:
+    payload = entry.payload
+    server = payload.get("server")
+    data_limit = payload.get("data_limit")
+    data_limit = DataLimit(int(data_limit)) if data_limit is not None else None
+
+    if entry.operation == OutboxEntry.CREATE_ACCESS_KEY:
+      try:
+        outline_key = await self.outline.create_access_key(OutlineAccessKey(
+          id=entry.target, name=payload.get("name"), port=payload.get("port"),
+          method=payload.get("method"), password=payload.get("password"),
+          data_limit=data_limit,
+        ), server)
+      except HTTPError as e:
+        if e.code != 409: raise
+        outline_key = True
+      if not outline_key:
+        raise ValueError("got an invalid response from the Outline Server")
+
+    elif entry.operation == OutboxEntry.PATCH_ACCESS_KEY:
+      await self.outline.patch_access_key(OutlineAccessKey(
+        id=entry.target, name=payload.get("name"), data_limit=data_limit,
+      ), server)
+
+    elif entry.operation == OutboxEntry.DELETE_ACCESS_KEY:
+      await self.outline.delete_access_key(entry.target, server)
+
+  async def _notify_access_keys_changed(self) -> None:
+    callback_result = self.on_access_keys_changed and self.on_access_keys_changed()
+    if isawaitable(callback_result):
+      await callback_result
+
+  async def _on_outline_key_created(self, server: str, outline_id: str) -> None:
+    db_key = self.db.access_keys.get_by_outline_id(server, outline_id)
+    access_key = db_key and await self.get_access_key(db_key.user_id, db_key.id, allow_expired=True)
+    if not access_key:
+      return
+
+    callback_result = self.on_access_key_created and self.on_access_key_created(access_key)
+    if isawaitable(callback_result):
+      await callback_result
+
+  def _retry_outbox_entry(self, entry: OutboxEntry, error: Exception) -> None:
+    delay = min(2 ** entry.attempts, _OUTBOX_MAX_BACKOFF)
+    available_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+    self.db.outbox.reschedule(entry.id, available_at, str(error) or type(error).__name__)
+    _OUTBOX_OPERATIONS.inc(entry.operation, "retried")
+
+  def _abandon_outbox_entry(self, entry: OutboxEntry) -> None:
+    with self.db.transaction():
+      self._discard_outbox_entry(entry)
+      if entry.operation == OutboxEntry.CREATE_ACCESS_KEY:
+        payload = {"server": entry.payload.get("server")}
+        self.db.outbox.create(OutboxEntry.DELETE_ACCESS_KEY, entry.target, payload)
+    _OUTBOX_OPERATIONS.inc(entry.operation, "failed")
+    self._outbox_wakeup.set()
+
+  def _discard_outbox_entry(self, entry: OutboxEntry) -> None:
+    with self.db.transaction():
+      self.db.outbox.delete(entry.id)
+      if entry.operation == OutboxEntry.CREATE_ACCESS_KEY:
+        db_key = self.db.access_keys.get_by_outline_id(self._resolve_server(entry.payload.get("server")), entry.target)
+        db_key and self.db.access_keys.delete(db_key.user_id, db_key.id)
+
+  @traced()
   async def get_raw_access_url(self, user: UserLike, id: str) -> str | None:
     db_key = self.db.access_keys.get(user, id)
     if not db_key:
@@ -297,5 +844,5 @@ class VPNManager:
       await self.delete_access_key(db_key.user_id, db_key.id)
       return None
 
-    outline_key = await self.outline.get_access_key(db_key.outline_id)
-    return outline_key and _get_prefixed_access_url(outline_key, self.prefix_map)
+    outline_key = await self.outline.get_access_key(db_key.outline_id, db_key.server)
+    return outline_key and _get_prefixed_access_url(outline_key, self._prefix_map)